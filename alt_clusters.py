@@ -0,0 +1,351 @@
+# alt_clusters.py
+"""
+Alt-ring clustering: accounts (gamertag_id) and devices (device_id) are nodes,
+every players / player_history row links its account to its device, and the
+connected components are the rings. A ring catches accounts that never shared a
+device directly (A on devices 1 and 2, B on devices 2 and 3).
+
+The union-find lives in NumPy arrays and is built once per process, then fed only
+the rows written since the previous refresh. Results are stored per account in
+the alt_clusters table, where a ring is identified by the lowest players.id of
+its accounts. The rings are built and kept up to date by
+`manage.py cluster-alts --watch`; pages only read alt_clusters.
+"""
+import threading
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pymysql
+
+from common import (
+    MONITOR_DELTA_OVERLAP,
+    get_db_connection,
+    release_db_connection,
+    invalidate_cache,
+    logger,
+)
+
+# Rows read per query while loading edges, and rows per alt_clusters upsert.
+EDGE_BATCH_SIZE = 200000
+WRITE_BATCH_SIZE = 5000
+
+_NO_PLAYER = np.iinfo(np.int64).max
+
+
+def _find_all(parent):
+    """Points every node straight at its root (pointer jumping), in place."""
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            return parent
+        parent[:] = grandparent
+
+
+def union_edges(parent, a, b):
+    """
+    Merges the components joined by the edges a[i]-b[i]. Roots always point at
+    the lower index, so every component's root is its lowest node.
+    """
+    while len(a):
+        _find_all(parent)
+        root_a, root_b = parent[a], parent[b]
+        pending = root_a != root_b
+        if not pending.any():
+            return
+        root_a, root_b = root_a[pending], root_b[pending]
+        np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+        a, b = a[pending], b[pending]
+
+
+class AltClusterEngine:
+    """Incrementally maintained union-find over account/device links."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._accounts = {}  # gamertag_id -> node
+        self._devices = {}   # device_id -> node
+        self._size = 0
+        self.parent = np.zeros(0, dtype=np.int32)
+        self.is_account = np.zeros(0, dtype=bool)
+        # Lowest players.id seen for each account node (_NO_PLAYER for devices).
+        self.first_player_id = np.zeros(0, dtype=np.int64)
+        self.marks = None
+
+    # -- node bookkeeping -------------------------------------------------------
+
+    def _grow(self, needed):
+        capacity = len(self.parent)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        parent = np.arange(capacity, dtype=np.int32)
+        parent[:self._size] = self.parent[:self._size]
+        is_account = np.zeros(capacity, dtype=bool)
+        is_account[:self._size] = self.is_account[:self._size]
+        first_player_id = np.full(capacity, _NO_PLAYER, dtype=np.int64)
+        first_player_id[:self._size] = self.first_player_id[:self._size]
+        self.parent, self.is_account, self.first_player_id = parent, is_account, first_player_id
+
+    def _nodes(self, index, keys, account):
+        """Maps keys to node numbers, adding nodes for keys seen for the first time."""
+        codes, uniques = pd.factorize(keys)
+        nodes = np.fromiter((index.get(key, -1) for key in uniques), dtype=np.int64, count=len(uniques))
+        new = nodes < 0
+        if new.any():
+            count = int(new.sum())
+            nodes[new] = np.arange(self._size, self._size + count)
+            self._grow(self._size + count)
+            self.is_account[self._size:self._size + count] = account
+            index.update(zip(uniques[new], nodes[new].tolist()))
+            self._size += count
+        return nodes[codes]
+
+    def add_edges(self, gamertag_ids, device_ids, player_ids=None):
+        """
+        Links accounts to devices. player_ids (players.id per edge, or None for
+        history rows) feed the ring identifiers. Returns the touched account nodes.
+        """
+        gamertag_ids = np.asarray(gamertag_ids, dtype=object)
+        device_ids = np.asarray(device_ids, dtype=object)
+        valid = pd.notna(gamertag_ids) & pd.notna(device_ids) & (gamertag_ids != "") & (device_ids != "")
+        gamertag_ids, device_ids = gamertag_ids[valid], device_ids[valid]
+        accounts = self._nodes(self._accounts, gamertag_ids, True)
+        devices = self._nodes(self._devices, device_ids, False)
+        if player_ids is not None:
+            np.minimum.at(self.first_player_id, accounts, np.asarray(player_ids, dtype=np.int64)[valid])
+        union_edges(self.parent[:self._size], accounts, devices)
+        return accounts
+
+    # -- results ----------------------------------------------------------------
+
+    def assignments(self, touched=None):
+        """
+        Per-account results as a DataFrame (gamertag_id, cluster_id, cluster_size,
+        device_count), limited to the rings of the touched account nodes if given.
+        Accounts never seen in players get cluster_id 0.
+        """
+        parent = _find_all(self.parent[:self._size])
+        is_account = self.is_account[:self._size]
+        cluster_size = np.bincount(parent, weights=is_account, minlength=self._size).astype(np.int64)
+        device_count = np.bincount(parent, weights=~is_account, minlength=self._size).astype(np.int64)
+        cluster_id = np.full(self._size, _NO_PLAYER, dtype=np.int64)
+        np.minimum.at(cluster_id, parent, self.first_player_id[:self._size])
+
+        account_ids = np.fromiter(self._accounts.values(), dtype=np.int64, count=len(self._accounts))
+        gamertag_ids = np.array(list(self._accounts), dtype=object)
+        if touched is not None:
+            rings = np.unique(parent[touched])
+            keep = np.isin(parent[account_ids], rings)
+            account_ids, gamertag_ids = account_ids[keep], gamertag_ids[keep]
+        roots = parent[account_ids]
+        ids = cluster_id[roots]
+        return pd.DataFrame({
+            "gamertag_id": gamertag_ids,
+            "cluster_id": np.where(ids == _NO_PLAYER, 0, ids),
+            "cluster_size": cluster_size[roots],
+            "device_count": device_count[roots],
+        })
+
+    # -- database ---------------------------------------------------------------
+
+    def refresh(self, full=False):
+        """
+        Reads the links written since the last refresh (everything on the first call
+        or when full=True), updates the rings and stores the accounts whose ring
+        changed. Returns the number of alt_clusters rows written.
+        """
+        with self._lock:
+            if full or self.marks is None:
+                self._reset()
+                previous = None
+            else:
+                previous = self.marks
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        """
+                        SELECT (SELECT COALESCE(MAX(id), 0) FROM players) AS player_id,
+                               (SELECT COALESCE(MAX(id), 0) FROM player_history) AS history_id,
+                               NOW(6) AS synced_at
+                        """
+                    )
+                    marks = cursor.fetchone()
+                touched = []
+                with conn.cursor(pymysql.cursors.Cursor) as cursor:
+                    if previous is None:
+                        touched.extend(self._load(cursor, "players", 0, marks["player_id"], with_ids=True))
+                        touched.extend(self._load(cursor, "player_history", 0, marks["history_id"]))
+                    else:
+                        since = previous["synced_at"] - timedelta(seconds=MONITOR_DELTA_OVERLAP)
+                        cursor.execute(
+                            """
+                            (SELECT id, gamertag_id, device_id FROM players WHERE id > %s AND id <= %s)
+                            UNION
+                            (SELECT id, gamertag_id, device_id FROM players WHERE updated_at >= %s)
+                            """,
+                            (previous["player_id"], marks["player_id"], since)
+                        )
+                        touched.append(self._add_rows(cursor.fetchall(), with_ids=True))
+                        touched.extend(
+                            self._load(cursor, "player_history", previous["history_id"], marks["history_id"])
+                        )
+            finally:
+                release_db_connection(conn)
+            touched = np.concatenate(touched) if touched else np.zeros(0, dtype=np.int64)
+            df = self.assignments(None if previous is None else touched)
+            written = write_assignments(df, marks["synced_at"], replace=previous is None)
+            self.marks = marks
+            return written
+
+    def _load(self, cursor, table, after_id, until_id, with_ids=False):
+        """Feeds the rows of table with after_id < id <= until_id in keyset batches."""
+        touched = []
+        while after_id < until_id:
+            cursor.execute(
+                f"SELECT id, gamertag_id, device_id FROM {table} WHERE id > %s AND id <= %s ORDER BY id LIMIT %s",
+                (after_id, until_id, EDGE_BATCH_SIZE)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            touched.append(self._add_rows(rows, with_ids))
+            after_id = rows[-1][0]
+        return touched
+
+    def _add_rows(self, rows, with_ids):
+        if not rows:
+            return np.zeros(0, dtype=np.int64)
+        ids, gamertag_ids, device_ids = zip(*rows)
+        return self.add_edges(gamertag_ids, device_ids, ids if with_ids else None)
+
+
+def write_assignments(df, refreshed_at, replace=False):
+    """
+    Upserts alt_clusters rows stamped with refreshed_at; replace=True then removes
+    the accounts that were not part of df.
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            rows = list(df[["gamertag_id", "cluster_id", "cluster_size", "device_count"]].itertuples(index=False, name=None))
+            for start in range(0, len(rows), WRITE_BATCH_SIZE):
+                batch = rows[start:start + WRITE_BATCH_SIZE]
+                cursor.execute(
+                    "INSERT INTO alt_clusters (gamertag_id, cluster_id, cluster_size, device_count, refreshed_at) VALUES "
+                    + ",".join(["(%s, %s, %s, %s, %s)"] * len(batch))
+                    + """
+                    ON DUPLICATE KEY UPDATE cluster_id = VALUES(cluster_id), cluster_size = VALUES(cluster_size),
+                        device_count = VALUES(device_count), refreshed_at = VALUES(refreshed_at)
+                    """,
+                    tuple(
+                        value for row in batch
+                        for value in (row[0], int(row[1]), int(row[2]), int(row[3]), refreshed_at)
+                    )
+                )
+            if replace:
+                cursor.execute("DELETE FROM alt_clusters WHERE refreshed_at < %s", (refreshed_at,))
+    finally:
+        release_db_connection(conn)
+    if len(df):
+        invalidate_cache("players")
+    return len(df)
+
+
+_engine = AltClusterEngine()
+
+def refresh_alt_clusters(full=False):
+    """Brings alt_clusters up to date with players and player_history. Returns the rows written."""
+    written = _engine.refresh(full=full)
+    logger.info("Alt clusters refreshed: %d accounts updated", written)
+    return written
+
+def fetch_alt_clusters_refreshed_at():
+    """When alt_clusters was last written (None if it was never built)."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT MAX(refreshed_at) AS refreshed_at FROM alt_clusters")
+            return cursor.fetchone()["refreshed_at"]
+    finally:
+        release_db_connection(conn)
+
+
+def fetch_largest_rings(allowed_servers=None, min_size=2, limit=20):
+    """
+    The biggest rings (cluster_id, cluster_size, device_count), restricted to rings
+    with at least one account on an allowed server_id when allowed_servers is given.
+    """
+    query = """
+        SELECT c.cluster_id, MAX(c.cluster_size) AS cluster_size, MAX(c.device_count) AS device_count
+        FROM alt_clusters c
+        WHERE c.cluster_size >= %s AND c.cluster_id <> 0
+    """
+    params = [min_size]
+    if allowed_servers is not None:
+        allowed_servers = list(allowed_servers)
+        if not allowed_servers:
+            return []
+        query += f"""
+            AND c.cluster_id IN (
+                SELECT c2.cluster_id FROM alt_clusters c2
+                JOIN players p ON p.gamertag_id = c2.gamertag_id
+                WHERE c2.cluster_size >= %s AND p.server_id IN ({','.join(['%s'] * len(allowed_servers))})
+            )
+        """
+        params += [min_size] + allowed_servers
+    query += " GROUP BY c.cluster_id ORDER BY cluster_size DESC, c.cluster_id ASC LIMIT %s"
+    params.append(limit)
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, tuple(params))
+            return cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+
+def fetch_rings_members(cluster_ids):
+    """The players rows of every account in the given rings, oldest first, as {cluster_id: [rows]}."""
+    members = {cluster_id: [] for cluster_id in cluster_ids}
+    if not members:
+        return members
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT p.*, c.cluster_id, c.cluster_size
+                FROM alt_clusters c
+                JOIN players p ON p.gamertag_id = c.gamertag_id
+                WHERE c.cluster_id IN ({','.join(['%s'] * len(members))})
+                ORDER BY p.id
+                """,
+                tuple(members)
+            )
+            for row in cursor.fetchall():
+                members[row["cluster_id"]].append(row)
+    finally:
+        release_db_connection(conn)
+    return members
+
+def fetch_ring_members(cluster_id):
+    """The players rows of every account in a ring, oldest first."""
+    return fetch_rings_members([cluster_id])[cluster_id]
+
+def fetch_account_cluster(gamertag_id):
+    """The ring of one account as {cluster_id, cluster_size, device_count, members}, or None."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT * FROM alt_clusters WHERE gamertag_id = %s", (gamertag_id,))
+            cluster = cursor.fetchone()
+    finally:
+        release_db_connection(conn)
+    if not cluster:
+        return None
+    cluster["members"] = fetch_ring_members(cluster["cluster_id"]) if cluster["cluster_id"] else []
+    return cluster
@@ -0,0 +1,354 @@
+# alt_scores.py
+"""
+Alt-likelihood scoring: gives every account (gamertag_id) a 0-100 score so flagged
+accounts can be triaged by confidence instead of one by one. Features are computed
+in batch over the players / player_history links:
+
+- shared_devices: devices the account used that other accounts used too
+- first_seen_gap_hours: how soon after (or before) those other accounts it appeared
+- server_spread: servers the account and its device peers were seen on
+- concurrent_sessions: times it was online together with a device peer
+  (see session_overlap.py), which points at two people on one console
+
+The first run scores everything; later runs only rescore the accounts on devices
+that gained a link (a new players row, or a player_history row pairing an account
+with a device for the first time), plus accounts with new concurrent sessions.
+Repeat sightings only bump players.last_seen and trigger nothing. Scoring runs in
+`manage.py score-alts --watch`; pages only read the alt_scores table.
+"""
+import os
+import threading
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pymysql
+import streamlit as st
+
+from common import (
+    MONITOR_DELTA_OVERLAP,
+    get_db_connection,
+    release_db_connection,
+    invalidate_cache,
+    logger,
+)
+
+# Hand-tuned logistic weights over the (transformed) features.
+ALT_SCORE_WEIGHTS = {
+    "intercept": -3.0,
+    "shared_devices": 2.0,         # log1p(shared devices)
+    "first_seen_proximity": 2.5,   # exp(-gap / ALT_SCORE_PROXIMITY_HOURS)
+    "server_spread": 1.0,          # log1p(servers - 1)
+    "concurrent_sessions": -1.5,   # log1p(concurrent sessions)
+}
+ALT_SCORE_PROXIMITY_HOURS = 72
+# Devices used by more accounts than this (shared or bogus IDs) are left out of peer features.
+ALT_SCORE_MAX_DEVICE_ACCOUNTS = 50
+# Concurrent sessions counted from this many recent days.
+ALT_SCORE_OVERLAP_DAYS = 30
+# Seconds between incremental runs of `manage.py score-alts --watch`.
+ALT_SCORE_REFRESH_INTERVAL = float(
+    st.secrets.get("ALT_SCORE_REFRESH_INTERVAL") or os.getenv("ALT_SCORE_REFRESH_INTERVAL") or 300
+)
+QUERY_CHUNK_SIZE = 1000
+WRITE_BATCH_SIZE = 5000
+
+SCORE_COLUMNS = ["gamertag_id", "score", "shared_devices", "first_seen_gap_hours", "server_spread", "concurrent_sessions"]
+
+
+def _join(sorted_keys, keys):
+    """
+    Equi-join of keys against the sorted array sorted_keys: returns (left, right)
+    index arrays, one entry per matching pair.
+    """
+    low = np.searchsorted(sorted_keys, keys, side="left")
+    counts = np.searchsorted(sorted_keys, keys, side="right") - low
+    left = np.repeat(np.arange(len(keys)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return left, np.repeat(low, counts) + offsets
+
+
+def compute_scores(edges, first_seen, servers, overlaps, accounts=None):
+    """
+    Scores accounts from DataFrames of (gamertag_id, device_id) links,
+    (gamertag_id, first_seen), (gamertag_id, server_id) and
+    (gamertag_id, concurrent_sessions). edges must hold every link of the scored
+    accounts' devices. Scores the accounts in `accounts`, or every account in edges.
+    Returns a DataFrame with SCORE_COLUMNS.
+    """
+    if accounts is None:
+        accounts = edges["gamertag_id"].to_numpy(dtype=object)
+    accounts = pd.unique(np.asarray(accounts, dtype=object))
+    # Everything below works on integer account codes.
+    keys = pd.Index(pd.unique(np.concatenate([
+        accounts,
+        edges["gamertag_id"].to_numpy(dtype=object),
+        first_seen["gamertag_id"].to_numpy(dtype=object),
+        servers["gamertag_id"].to_numpy(dtype=object),
+        overlaps["gamertag_id"].to_numpy(dtype=object),
+    ])))
+    n = len(keys)
+    scored = np.zeros(n, dtype=bool)
+    scored[keys.get_indexer(accounts)] = True
+
+    # Distinct links, and the ones on devices with a plausible number of accounts.
+    account = keys.get_indexer(edges["gamertag_id"].to_numpy(dtype=object))
+    device, devices = pd.factorize(edges["device_id"].to_numpy(dtype=object))
+    links = np.sort(pd.unique(device.astype(np.int64) * n + account))
+    device, account = links // n, links % n
+    device_accounts = np.bincount(device, minlength=len(devices))
+    keep = (device_accounts[device] > 1) & (device_accounts[device] <= ALT_SCORE_MAX_DEVICE_ACCOUNTS)
+    device, account = device[keep], account[keep]  # Sorted by device.
+    own = scored[account]
+    shared_devices = np.bincount(account[own], minlength=n)
+
+    # Peers: other accounts on the scored accounts' shared devices.
+    left, right = _join(device, device[own])
+    peer_pairs = pd.unique(account[own][left] * n + account[right])
+    scored_peer, peer = peer_pairs // n, peer_pairs % n
+    distinct = scored_peer != peer
+    scored_peer, peer = scored_peer[distinct], peer[distinct]
+
+    seen = np.full(n, np.nan)
+    first_seen_at = pd.to_datetime(first_seen["first_seen"])
+    seconds = first_seen_at.to_numpy("datetime64[s]").astype(np.int64).astype(float)
+    seconds[first_seen_at.isna().to_numpy()] = np.nan
+    seen[keys.get_indexer(first_seen["gamertag_id"].to_numpy(dtype=object))] = seconds
+    gap_hours = np.full(n, np.inf)
+    np.fmin.at(gap_hours, scored_peer, np.abs(seen[scored_peer] - seen[peer]) / 3600)
+    gap_hours[np.isinf(gap_hours)] = np.nan
+
+    # Servers seen by the account itself and by each of its peers.
+    server_account = keys.get_indexer(servers["gamertag_id"].to_numpy(dtype=object))
+    server, server_ids = pd.factorize(servers["server_id"].to_numpy())
+    order = np.argsort(server_account, kind="stable")
+    server_account, server = server_account[order], server[order]
+    left, right = _join(server_account, peer)
+    own_servers = scored[server_account]
+    spread_pairs = pd.unique(np.concatenate([
+        server_account[own_servers] * len(server_ids) + server[own_servers],
+        scored_peer[left] * len(server_ids) + server[right],
+    ]).astype(np.int64))
+    server_spread = np.bincount(spread_pairs // max(len(server_ids), 1), minlength=n)
+
+    concurrent = np.bincount(
+        keys.get_indexer(overlaps["gamertag_id"].to_numpy(dtype=object)),
+        weights=overlaps["concurrent_sessions"].to_numpy(dtype=float), minlength=n
+    )
+
+    codes = keys.get_indexer(accounts)
+    result = pd.DataFrame({
+        "gamertag_id": accounts,
+        "shared_devices": shared_devices[codes],
+        "first_seen_gap_hours": gap_hours[codes],
+        "server_spread": server_spread[codes],
+        "concurrent_sessions": concurrent[codes].astype(np.int64),
+    })
+
+    weights = ALT_SCORE_WEIGHTS
+    proximity = np.nan_to_num(np.exp(-result["first_seen_gap_hours"].to_numpy() / ALT_SCORE_PROXIMITY_HOURS))
+    z = (
+        weights["intercept"]
+        + weights["shared_devices"] * np.log1p(result["shared_devices"].to_numpy())
+        + weights["first_seen_proximity"] * proximity
+        + weights["server_spread"] * np.log1p(np.maximum(result["server_spread"].to_numpy() - 1, 0))
+        + weights["concurrent_sessions"] * np.log1p(result["concurrent_sessions"].to_numpy())
+    )
+    result["score"] = np.round(100 / (1 + np.exp(-z)), 2)
+    return result[SCORE_COLUMNS]
+
+
+def _in_chunks(cursor, query, values, columns, params=()):
+    """Runs query once per chunk of values (substituted for {placeholders}) and returns one DataFrame."""
+    frames = []
+    values = list(values)
+    for start in range(0, len(values), QUERY_CHUNK_SIZE):
+        chunk = values[start:start + QUERY_CHUNK_SIZE]
+        cursor.execute(query.format(placeholders=",".join(["%s"] * len(chunk))), tuple(params) + tuple(chunk) * query.count("{placeholders}"))
+        frames.append(pd.DataFrame(cursor.fetchall(), columns=columns))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+class AltScorer:
+    """Keeps the high-water marks between runs; one per process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.marks = None
+
+    def refresh(self, full=False):
+        """Rescores the accounts touched since the last run (all of them when full=True). Returns the rows written."""
+        with self._lock:
+            previous = None if full else self.marks
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        """
+                        SELECT (SELECT COALESCE(MAX(id), 0) FROM players) AS player_id,
+                               (SELECT COALESCE(MAX(id), 0) FROM player_history) AS history_id,
+                               NOW(6) AS synced_at
+                        """
+                    )
+                    marks = cursor.fetchone()
+                with conn.cursor(pymysql.cursors.Cursor) as cursor:
+                    if previous is None:
+                        scores = self._score_all(cursor)
+                    else:
+                        scores = self._score_touched(cursor, previous, marks)
+            finally:
+                release_db_connection(conn)
+            written = write_scores(scores, marks["synced_at"], replace=previous is None)
+            self.marks = marks
+            return written
+
+    def _score_all(self, cursor):
+        cursor.execute(
+            """
+            SELECT gamertag_id, device_id FROM players WHERE gamertag_id <> '' AND device_id <> ''
+            UNION
+            SELECT gamertag_id, device_id FROM player_history WHERE gamertag_id <> '' AND device_id <> ''
+            """
+        )
+        edges = pd.DataFrame(cursor.fetchall(), columns=["gamertag_id", "device_id"])
+        cursor.execute("SELECT gamertag_id, MIN(first_seen) FROM players GROUP BY gamertag_id")
+        first_seen = pd.DataFrame(cursor.fetchall(), columns=["gamertag_id", "first_seen"])
+        cursor.execute("SELECT DISTINCT gamertag_id, server_id FROM players WHERE server_id IS NOT NULL")
+        servers = pd.DataFrame(cursor.fetchall(), columns=["gamertag_id", "server_id"])
+        overlaps = self._overlaps(cursor)
+        return compute_scores(edges, first_seen, servers, overlaps)
+
+    def _score_touched(self, cursor, previous, marks):
+        since = previous["synced_at"] - timedelta(seconds=MONITOR_DELTA_OVERLAP)
+        # Only new links change the features; history rows repeating a link already
+        # seen before the previous run are skipped through ix_player_history_gamertag_device.
+        cursor.execute(
+            """
+            (SELECT gamertag_id, device_id FROM players WHERE id > %s AND id <= %s)
+            UNION (
+                SELECT h.gamertag_id, h.device_id FROM player_history h
+                WHERE h.id > %s AND h.id <= %s AND NOT EXISTS (
+                    SELECT 1 FROM player_history seen
+                    WHERE seen.gamertag_id = h.gamertag_id AND seen.device_id = h.device_id AND seen.id <= %s
+                )
+            )
+            """,
+            (previous["player_id"], marks["player_id"], previous["history_id"], marks["history_id"],
+             previous["history_id"])
+        )
+        changed = pd.DataFrame(cursor.fetchall(), columns=["gamertag_id", "device_id"])
+        cursor.execute(
+            """
+            SELECT gamertag_id_a, gamertag_id_b FROM session_overlaps
+            WHERE day >= DATE(%s) AND last_overlap >= %s
+            """,
+            (since, since)
+        )
+        overlapping = [account for row in cursor.fetchall() for account in row]
+        changed_devices = changed["device_id"].dropna().unique()
+        if not len(changed_devices) and not overlapping:
+            return pd.DataFrame(columns=SCORE_COLUMNS)
+
+        # Every account on a changed device is affected, and scoring them needs all
+        # links of their devices.
+        device_links = _in_chunks(
+            cursor,
+            """
+            SELECT gamertag_id, device_id FROM players WHERE device_id IN ({placeholders})
+            UNION SELECT gamertag_id, device_id FROM player_history WHERE device_id IN ({placeholders})
+            """,
+            changed_devices, ["gamertag_id", "device_id"]
+        )
+        touched = pd.unique(np.concatenate([
+            device_links["gamertag_id"].to_numpy(dtype=object),
+            changed["gamertag_id"].to_numpy(dtype=object),
+            np.asarray(overlapping, dtype=object),
+        ]))
+        touched = [account for account in touched if account]
+        own_links = _in_chunks(
+            cursor,
+            """
+            SELECT gamertag_id, device_id FROM players WHERE gamertag_id IN ({placeholders})
+            UNION SELECT gamertag_id, device_id FROM player_history WHERE gamertag_id IN ({placeholders})
+            """,
+            touched, ["gamertag_id", "device_id"]
+        )
+        edges = _in_chunks(
+            cursor,
+            """
+            SELECT gamertag_id, device_id FROM players WHERE device_id IN ({placeholders})
+            UNION SELECT gamertag_id, device_id FROM player_history WHERE device_id IN ({placeholders})
+            """,
+            own_links["device_id"].dropna().unique(), ["gamertag_id", "device_id"]
+        )
+        edges = pd.concat([edges, own_links], ignore_index=True)
+        edges = edges[(edges["gamertag_id"].fillna("") != "") & (edges["device_id"].fillna("") != "")]
+        related = edges["gamertag_id"].unique()
+        first_seen = _in_chunks(
+            cursor,
+            "SELECT gamertag_id, MIN(first_seen) FROM players WHERE gamertag_id IN ({placeholders}) GROUP BY gamertag_id",
+            related, ["gamertag_id", "first_seen"]
+        )
+        servers = _in_chunks(
+            cursor,
+            "SELECT DISTINCT gamertag_id, server_id FROM players WHERE server_id IS NOT NULL AND gamertag_id IN ({placeholders})",
+            related, ["gamertag_id", "server_id"]
+        )
+        overlaps = self._overlaps(cursor)
+        return compute_scores(edges, first_seen, servers, overlaps, accounts=touched)
+
+    def _overlaps(self, cursor):
+        cursor.execute(
+            """
+            SELECT gamertag_id, SUM(overlaps) FROM (
+                SELECT gamertag_id_a AS gamertag_id, overlaps FROM session_overlaps WHERE day > CURDATE() - INTERVAL %s DAY
+                UNION ALL
+                SELECT gamertag_id_b, overlaps FROM session_overlaps WHERE day > CURDATE() - INTERVAL %s DAY
+            ) AS sides
+            GROUP BY gamertag_id
+            """,
+            (ALT_SCORE_OVERLAP_DAYS, ALT_SCORE_OVERLAP_DAYS)
+        )
+        return pd.DataFrame(cursor.fetchall(), columns=["gamertag_id", "concurrent_sessions"])
+
+
+def write_scores(scores, scored_at, replace=False):
+    """Upserts alt_scores rows stamped with scored_at; replace=True then drops accounts not in scores."""
+    rows = [
+        (row.gamertag_id, float(row.score), int(row.shared_devices),
+         None if pd.isna(row.first_seen_gap_hours) else float(row.first_seen_gap_hours),
+         int(row.server_spread), int(row.concurrent_sessions), scored_at)
+        for row in scores.itertuples(index=False)
+    ]
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            for start in range(0, len(rows), WRITE_BATCH_SIZE):
+                batch = rows[start:start + WRITE_BATCH_SIZE]
+                cursor.execute(
+                    """
+                    INSERT INTO alt_scores (gamertag_id, score, shared_devices, first_seen_gap_hours,
+                        server_spread, concurrent_sessions, scored_at) VALUES
+                    """ + ",".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(batch)) + """
+                    ON DUPLICATE KEY UPDATE score = VALUES(score), shared_devices = VALUES(shared_devices),
+                        first_seen_gap_hours = VALUES(first_seen_gap_hours), server_spread = VALUES(server_spread),
+                        concurrent_sessions = VALUES(concurrent_sessions), scored_at = VALUES(scored_at)
+                    """,
+                    tuple(value for row in batch for value in row)
+                )
+            if replace:
+                cursor.execute("DELETE FROM alt_scores WHERE scored_at < %s", (scored_at,))
+    finally:
+        release_db_connection(conn)
+    if rows:
+        invalidate_cache("players")
+    return len(rows)
+
+
+_scorer = AltScorer()
+
+def refresh_alt_scores(full=False):
+    """Brings alt_scores up to date. Returns the number of accounts (re)scored."""
+    written = _scorer.refresh(full=full)
+    logger.info("Alt scores refreshed: %d accounts scored", written)
+    return written
@@ -2,13 +2,35 @@
 import streamlit as st
 import pymysql
 import pandas as pd
+import numpy as np
+import json
 import os
 from dotenv import load_dotenv
 import requests
 from urllib.parse import urlencode
 import plotly.express as px
 import pymysql.err
-import queue
+from pymysql.constants import SERVER_STATUS
+import logging
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import atexit
+import tempfile
+import socket
+import uuid
+import copy
+import functools
+import hashlib
+import random
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict
+try:
+    import fcntl
+except ImportError:  # Windows: spools are not shared between processes.
+    fcntl = None
 
 # Load environment variables if needed.
 if not st.secrets:
@@ -25,19 +47,57 @@ DISCORD_CLIENT_SECRET = st.secrets.get("DISCORD_CLIENT_SECRET") or os.getenv("DI
 DISCORD_REDIRECT_URI = st.secrets.get("DISCORD_REDIRECT_URI") or os.getenv("DISCORD_REDIRECT_URI")
 BOT_OWNER_ID = st.secrets.get("BOT_OWNER_ID") or os.getenv("BOT_OWNER_ID")
 
-DISCORD_OAUTH_URL = "https://discord.com/api/oauth2/authorize"
-DISCORD_TOKEN_URL = "https://discord.com/api/oauth2/token"
-DISCORD_API_URL = "https://discord.com/api/users/@me"
+# Point DISCORD_API_BASE at a local stub server to exercise the OAuth flow offline.
+DISCORD_API_BASE = (st.secrets.get("DISCORD_API_BASE") or os.getenv("DISCORD_API_BASE") or "https://discord.com/api").rstrip("/")
+DISCORD_OAUTH_URL = DISCORD_API_BASE + "/oauth2/authorize"
+DISCORD_TOKEN_URL = DISCORD_API_BASE + "/oauth2/token"
+DISCORD_API_URL = DISCORD_API_BASE + "/users/@me"
 
 # ---------------------------------------------------------------------------
 # Database Connection Pooling
 # ---------------------------------------------------------------------------
-connection_pool = queue.Queue(maxsize=10)
+DB_POOL_SIZE = int(st.secrets.get("DB_POOL_SIZE") or os.getenv("DB_POOL_SIZE") or 10)
+# Seconds to wait for a free connection before giving up.
+DB_POOL_TIMEOUT = float(st.secrets.get("DB_POOL_TIMEOUT") or os.getenv("DB_POOL_TIMEOUT") or 10)
+# Connections older than this many seconds are closed and replaced on checkout.
+DB_POOL_RECYCLE = float(st.secrets.get("DB_POOL_RECYCLE") or os.getenv("DB_POOL_RECYCLE") or 3600)
+# Connections idle for longer than this many seconds are pinged before being handed out.
+DB_POOL_PING_AFTER = float(st.secrets.get("DB_POOL_PING_AFTER") or os.getenv("DB_POOL_PING_AFTER") or 30)
+# Connections held for longer than this many seconds are reported as leaked.
+DB_POOL_LEAK_TIMEOUT = float(st.secrets.get("DB_POOL_LEAK_TIMEOUT") or os.getenv("DB_POOL_LEAK_TIMEOUT") or 300)
 
-def init_db_pool():
-    """Pre-populate the connection pool with 10 connections."""
-    for _ in range(10):
-        conn = pymysql.connect(
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of pymysql connections.
+
+    At most max_size connections exist at once; checkout blocks until one is free
+    or the timeout expires. Connections are recycled after recycle seconds, pinged
+    after sitting idle for ping_after seconds, and any connection checked out for
+    longer than leak_timeout seconds is logged once with the stack that took it.
+    """
+
+    def __init__(self, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, recycle=DB_POOL_RECYCLE,
+                 ping_after=DB_POOL_PING_AFTER, leak_timeout=DB_POOL_LEAK_TIMEOUT):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self.leak_timeout = leak_timeout
+        self._cond = threading.Condition()
+        self._idle = []        # [(conn, created_at, released_at)], most recently used last
+        self._checked_out = {}  # id(conn) -> checkout record
+        self._size = 0
+
+    @staticmethod
+    def _connect():
+        return pymysql.connect(
             host=DB_HOST,
             user=DB_USER,
             password=DB_PASS,
@@ -45,38 +105,534 @@ def init_db_pool():
             autocommit=True,
             cursorclass=pymysql.cursors.DictCursor
         )
-        connection_pool.put(conn)
+
+    def _is_usable(self, conn, created_at, released_at):
+        now = time.monotonic()
+        if not conn.open or now - created_at > self.recycle:
+            return False
+        if now - released_at > self.ping_after:
+            try:
+                conn.ping(reconnect=False)
+            except pymysql.err.Error:
+                return False
+        return True
+
+    def acquire(self, timeout=None):
+        """Checks out a live connection, blocking for up to timeout seconds."""
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    self.report_leaks()
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(
+                            f"No database connection became free within the timeout "
+                            f"({self._size} of {self.max_size} checked out)."
+                        )
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, created_at, released_at = self._idle.pop()
+                else:
+                    conn = None
+                    self._size += 1
+
+            if conn is not None and not self._is_usable(conn, created_at, released_at):
+                self._discard(conn)
+                continue
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                created_at = time.monotonic()
+
+            with self._cond:
+                self._checked_out[id(conn)] = {
+                    "conn": conn,
+                    "created_at": created_at,
+                    "checked_out_at": time.monotonic(),
+                    "stack": "".join(traceback.format_stack(limit=8)[:-1]),
+                    "reported": False,
+                }
+            return conn
+
+    def release(self, conn):
+        """Returns a connection to the pool; broken connections are dropped."""
+        with self._cond:
+            record = self._checked_out.pop(id(conn), None)
+        if record is None:
+            # Not ours (or released twice): never let it into the idle list.
+            return
+        if conn.open and conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            # Never hand the next caller someone else's open transaction.
+            try:
+                conn.rollback()
+            except pymysql.err.Error:
+                self._discard(conn)
+                return
+        with self._cond:
+            if conn.open:
+                self._idle.append((conn, record["created_at"], time.monotonic()))
+            else:
+                self._size -= 1
+            self._cond.notify()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except pymysql.err.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager that checks a connection out and always releases it."""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def report_leaks(self):
+        """Logs (once each) connections held longer than leak_timeout and returns them."""
+        now = time.monotonic()
+        leaked = []
+        with self._cond:
+            for record in self._checked_out.values():
+                if now - record["checked_out_at"] > self.leak_timeout:
+                    leaked.append(record)
+                    if not record["reported"]:
+                        record["reported"] = True
+                        logger.warning(
+                            "Database connection held for %.0fs without being released; checked out at:\n%s",
+                            now - record["checked_out_at"], record["stack"]
+                        )
+        return leaked
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle), "in_use": len(self._checked_out), "max_size": self.max_size}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def init_db_pool():
+    """Creates the pool and schema on first call; safe to call on every rerun."""
+    get_pool()
+    ensure_schema()
 
 def get_db_connection():
-    """Get a connection from the pool if available; otherwise, create a new one."""
-    try:
-        conn = connection_pool.get_nowait()
-        if not conn.open:
-            conn = pymysql.connect(
-                host=DB_HOST,
-                user=DB_USER,
-                password=DB_PASS,
-                database=DB_NAME,
-                autocommit=True,
-                cursorclass=pymysql.cursors.DictCursor
+    """Check a connection out of the pool, waiting up to DB_POOL_TIMEOUT for one to free up."""
+    if not _schema_ready:
+        ensure_schema()
+    return get_pool().acquire()
+
+def release_db_connection(conn):
+    """Return a connection obtained from get_db_connection to the pool."""
+    get_pool().release(conn)
+
+@contextmanager
+def db_connection():
+    """Context-manager form of get_db_connection/release_db_connection."""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        release_db_connection(conn)
+
+# ---------------------------------------------------------------------------
+# Schema
+# ---------------------------------------------------------------------------
+# Maps each server_stats counter to the players flag it counts (None counts rows).
+STAT_FLAG_COLUMNS = {
+    "total_players": None,
+    "flagged_accounts": "alt_flag",
+    "watchlisted_accounts": "watchlisted",
+    "whitelisted_accounts": "whitelist",
+    "multiple_devices": "multiple_devices",
+}
+STAT_COLUMNS = tuple(STAT_FLAG_COLUMNS)
+
+def _server_stats_delta(row, sign):
+    """Builds the server_stats upsert that adds (sign="") or removes (sign="-") one players row."""
+    values = [f"IFNULL({row}.server_id, 0)"]
+    for flag in STAT_FLAG_COLUMNS.values():
+        values.append(f"{sign}1" if flag is None else f"{sign}IFNULL({row}.{flag} = TRUE, 0)")
+    updates = ", ".join(f"{col} = {col} + VALUES({col})" for col in STAT_COLUMNS)
+    return (
+        f"INSERT INTO server_stats (server_id, {', '.join(STAT_COLUMNS)}) "
+        f"VALUES ({', '.join(values)}) ON DUPLICATE KEY UPDATE {updates};"
+    )
+
+_STATS_CHANGED = " OR ".join(
+    f"NOT (OLD.{col} <=> NEW.{col})"
+    for col in ["server_id"] + [flag for flag in STAT_FLAG_COLUMNS.values() if flag]
+)
+
+# The guild_configs id for a server name expression. A name configured in more than
+# one guild resolves to its oldest configuration.
+def _server_id_for_name(name_expr):
+    return f"(SELECT MIN(id) FROM guild_configs WHERE LOWER(TRIM(server_name)) = LOWER(TRIM({name_expr})))"
+
+# Applied in order by ensure_schema(). Every statement must be safe to re-run.
+SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        name VARCHAR(64) NOT NULL PRIMARY KEY,
+        rolled_up_to DATE NULL
+    )
+    """,
+    "ALTER TABLE player_history ADD INDEX ix_player_history_timestamp (timestamp)",
+    # Account search: lowercase copies for indexed prefix matches, plus an ngram
+    # FULLTEXT index for substring matches (see search_accounts).
+    "ALTER TABLE players ADD COLUMN gamertag_lc VARCHAR(255) AS (LOWER(gamertag)) STORED",
+    "ALTER TABLE players ADD COLUMN device_id_lc VARCHAR(255) AS (LOWER(device_id)) STORED",
+    "ALTER TABLE players ADD INDEX ix_players_gamertag_lc (gamertag_lc)",
+    "ALTER TABLE players ADD INDEX ix_players_device_id_lc (device_id_lc)",
+    "ALTER TABLE players ADD FULLTEXT INDEX ft_players_search (gamertag, device_id) WITH PARSER ngram",
+    "ALTER TABLE players ADD INDEX ix_players_device_alt (device_id, alt_flag)",
+    # Lets the alt scorer tell a first account/device pairing from a repeat sighting.
+    "ALTER TABLE player_history ADD INDEX ix_player_history_gamertag_device (gamertag_id, device_id, id)",
+    # Last-modified time of each player row, for the monitor's delta refreshes.
+    """
+    ALTER TABLE players ADD COLUMN updated_at TIMESTAMP(6) NOT NULL
+        DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)
+    """,
+    "ALTER TABLE players ADD INDEX ix_players_updated_at (updated_at)",
+    # Activity log paging: every filter ends in (timestamp, id) so the keyset order
+    # comes straight off the index.
+    "ALTER TABLE activity_logs ADD INDEX ix_activity_logs_timestamp_id (timestamp, id)",
+    "ALTER TABLE activity_logs ADD INDEX ix_activity_logs_user_timestamp (user_id, timestamp, id)",
+    "ALTER TABLE activity_logs ADD INDEX ix_activity_logs_action_timestamp (action, timestamp, id)",
+    "ALTER TABLE activity_logs ADD FULLTEXT INDEX ft_activity_logs_details (details) WITH PARSER ngram",
+    # Flag differences computed by log_activity at write time (see audit_state_diff).
+    "ALTER TABLE activity_logs ADD COLUMN before_diff TEXT NULL",
+    "ALTER TABLE activity_logs ADD COLUMN after_diff TEXT NULL",
+    # Set by the audit writer so replaying a spool never duplicates a row.
+    "ALTER TABLE activity_logs ADD COLUMN event_id CHAR(32) NULL",
+    "ALTER TABLE activity_logs ADD UNIQUE INDEX ux_activity_logs_event_id (event_id)",
+    # Progress of server renames; see run_server_rename_job.
+    """
+    CREATE TABLE IF NOT EXISTS server_rename_jobs (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        old_name VARCHAR(255) NOT NULL,
+        new_name VARCHAR(255) NOT NULL,
+        status VARCHAR(16) NOT NULL DEFAULT 'pending',
+        current_table VARCHAR(64) NULL,
+        last_id BIGINT NOT NULL DEFAULT 0,
+        target_id BIGINT NULL,
+        rows_updated BIGINT NOT NULL DEFAULT 0,
+        owner VARCHAR(255) NULL,
+        heartbeat TIMESTAMP NULL,
+        error TEXT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        KEY ix_server_rename_jobs_status (status)
+    )
+    """,
+    # The server whose rows a rename job updates; older jobs only have the names.
+    "ALTER TABLE server_rename_jobs ADD COLUMN server_id INT NULL",
+    # One row per account: the alt ring it belongs to (see alt_clusters.py).
+    """
+    CREATE TABLE IF NOT EXISTS alt_clusters (
+        gamertag_id VARCHAR(255) NOT NULL PRIMARY KEY,
+        cluster_id BIGINT NOT NULL,
+        cluster_size INT NOT NULL,
+        device_count INT NOT NULL,
+        refreshed_at DATETIME(6) NOT NULL,
+        KEY ix_alt_clusters_cluster (cluster_id),
+        KEY ix_alt_clusters_size (cluster_size, cluster_id)
+    )
+    """,
+    # Concurrent sessions of two accounts on one device, per day (see session_overlap.py).
+    """
+    CREATE TABLE IF NOT EXISTS session_overlaps (
+        day DATE NOT NULL,
+        device_id VARCHAR(255) NOT NULL,
+        gamertag_id_a VARCHAR(255) NOT NULL,
+        gamertag_id_b VARCHAR(255) NOT NULL,
+        server_id_a INT NOT NULL,
+        server_id_b INT NOT NULL,
+        overlaps INT NOT NULL,
+        overlap_seconds INT NOT NULL,
+        last_overlap DATETIME NOT NULL,
+        PRIMARY KEY (day, device_id, gamertag_id_a, gamertag_id_b),
+        KEY ix_session_overlaps_device (device_id, day)
+    )
+    """,
+    # Alt-likelihood score and its features per account (see alt_scores.py).
+    """
+    CREATE TABLE IF NOT EXISTS alt_scores (
+        gamertag_id VARCHAR(255) NOT NULL PRIMARY KEY,
+        score DOUBLE NOT NULL,
+        shared_devices INT NOT NULL,
+        first_seen_gap_hours DOUBLE NULL,
+        server_spread INT NOT NULL,
+        concurrent_sessions INT NOT NULL,
+        scored_at DATETIME(6) NOT NULL,
+        KEY ix_alt_scores_score (score)
+    )
+    """,
+    # Per log file read position of the .RPT ingestion (see ingest.py).
+    """
+    CREATE TABLE IF NOT EXISTS rpt_checkpoints (
+        service_id VARCHAR(64) NOT NULL,
+        file_name VARCHAR(255) NOT NULL,
+        byte_offset BIGINT NOT NULL,
+        head VARBINARY(64) NOT NULL,
+        log_time DATETIME NULL,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (service_id, file_name)
+    )
+    """,
+    # Last scheduled ingestion run per server (see ingest_scheduler.py).
+    """
+    CREATE TABLE IF NOT EXISTS ingest_status (
+        service_id VARCHAR(64) NOT NULL PRIMARY KEY,
+        server_id INT NULL,
+        server_name VARCHAR(255) NULL,
+        last_run_at DATETIME(6) NOT NULL,
+        duration_seconds DOUBLE NOT NULL,
+        rows_ingested INT NOT NULL,
+        bytes_read BIGINT NOT NULL,
+        lag_seconds INT NULL,
+        last_success_at DATETIME(6) NULL,
+        failures INT NOT NULL DEFAULT 0,
+        last_error TEXT NULL,
+        next_run_at DATETIME NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT NOT NULL PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+# MySQL errors meaning a statement has already been applied:
+# table exists, duplicate column, duplicate key name, trigger exists, nothing to drop.
+_SCHEMA_ALREADY_APPLIED = {1050, 1060, 1061, 1359, 1091}
+
+def _execute_schema_statement(cursor, statement):
+    try:
+        cursor.execute(statement)
+    except pymysql.err.MySQLError as e:
+        if e.args[0] not in _SCHEMA_ALREADY_APPLIED:
+            raise
+
+SERVER_ID_BACKFILL_CHUNK = 10000
+
+def _backfill_server_ids(cursor):
+    """Resolves the rows still without a server_id from their server names, in primary-key chunks."""
+    server_ids = """
+        SELECT LOWER(TRIM(server_name)) AS server_key, MIN(id) AS server_id
+        FROM guild_configs GROUP BY server_key
+    """
+    for table in ("players", "player_history"):
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) AS max_id FROM {table}")
+        max_id = cursor.fetchone()["max_id"]
+        for lower_id in range(0, max_id, SERVER_ID_BACKFILL_CHUNK):
+            cursor.execute(
+                f"""
+                UPDATE {table} t JOIN ({server_ids}) g ON g.server_key = LOWER(TRIM(t.server_name))
+                SET t.server_id = g.server_id
+                WHERE t.id > %s AND t.id <= %s AND t.server_id IS NULL
+                """,
+                (lower_id, lower_id + SERVER_ID_BACKFILL_CHUNK)
             )
-        return conn
-    except queue.Empty:
-        return pymysql.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASS,
-            database=DB_NAME,
-            autocommit=True,
-            cursorclass=pymysql.cursors.DictCursor
+    cursor.execute(f"""
+        UPDATE user_servers t JOIN ({server_ids}) g ON g.server_key = LOWER(TRIM(t.server_name))
+        SET t.server_id = g.server_id
+        WHERE t.server_id IS NULL
+    """)
+
+def _migrate_server_ids(conn):
+    """
+    Identifies servers by guild_configs.id: adds server_id to players, player_history
+    and user_servers, backfills it from the server names in primary-key chunks, and
+    re-keys server_stats and player_history_daily by it. Safe to re-run if interrupted.
+    """
+    with conn.cursor() as cursor:
+        for table, index in [
+            ("players", "ix_players_server_id_id (server_id, id)"),
+            ("player_history", "ix_player_history_server_id_timestamp (server_id, timestamp)"),
+            ("user_servers", "ix_user_servers_discord_server (discord_id, server_id)"),
+        ]:
+            _execute_schema_statement(cursor, f"ALTER TABLE {table} ADD COLUMN server_id INT NULL")
+            _execute_schema_statement(cursor, f"ALTER TABLE {table} ADD INDEX {index}")
+            # Rows from writers that only know the name (such as the bot) get their id here.
+            _execute_schema_statement(cursor, f"""
+                CREATE TRIGGER {table}_server_id BEFORE INSERT ON {table} FOR EACH ROW
+                SET NEW.server_id = IFNULL(NEW.server_id, {_server_id_for_name("NEW.server_name")})
+            """)
+
+        for statement in [
+            "DROP TRIGGER IF EXISTS players_stats_insert",
+            "DROP TRIGGER IF EXISTS players_stats_update",
+            "DROP TRIGGER IF EXISTS players_stats_delete",
+            "DROP TABLE IF EXISTS server_stats",
+        ]:
+            cursor.execute(statement)
+
+        _backfill_server_ids(cursor)
+
+        for statement in [
+            """
+            CREATE TABLE server_stats (
+                server_id INT NOT NULL PRIMARY KEY,
+                total_players INT NOT NULL DEFAULT 0,
+                flagged_accounts INT NOT NULL DEFAULT 0,
+                watchlisted_accounts INT NOT NULL DEFAULT 0,
+                whitelisted_accounts INT NOT NULL DEFAULT 0,
+                multiple_devices INT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            )
+            """,
+            # These triggers keep server_stats current for every writer of players,
+            # including the bot, in the same transaction as the write itself.
+            f"""
+            CREATE TRIGGER players_stats_insert AFTER INSERT ON players FOR EACH ROW
+            {_server_stats_delta("NEW", "")}
+            """,
+            f"""
+            CREATE TRIGGER players_stats_update AFTER UPDATE ON players FOR EACH ROW
+            BEGIN
+                IF {_STATS_CHANGED} THEN
+                    {_server_stats_delta("OLD", "-")}
+                    {_server_stats_delta("NEW", "")}
+                END IF;
+            END
+            """,
+            f"""
+            CREATE TRIGGER players_stats_delete AFTER DELETE ON players FOR EACH ROW
+            {_server_stats_delta("OLD", "-")}
+            """,
+            # Daily player_history counts per server for the trend charts, filled in
+            # by refresh_trend_rollup() for complete days only.
+            "DROP TABLE IF EXISTS player_history_daily",
+            """
+            CREATE TABLE player_history_daily (
+                server_id INT NOT NULL,
+                day DATE NOT NULL,
+                events INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (server_id, day),
+                KEY ix_player_history_daily_day (day)
+            )
+            """,
+            f"DELETE FROM rollup_state WHERE name = '{TREND_ROLLUP}'",
+        ]:
+            _execute_schema_statement(cursor, statement)
+
+_SERVER_ID_TABLES = ("players", "player_history", "user_servers")
+
+def _migrate_server_id_updates(conn):
+    """
+    Keeps server_id in step with server_name after the initial backfill: rows whose
+    name is changed get the id of their new name, and creating or renaming a guild
+    config resolves the rows that were waiting for a config with that name. Then
+    resolves the rows left without one so far, and drops the server_name index that
+    id-based lookups made unused.
+    """
+    with conn.cursor() as cursor:
+        for table in _SERVER_ID_TABLES:
+            # Only when the writer changed the name without setting the id itself.
+            _execute_schema_statement(cursor, f"""
+                CREATE TRIGGER {table}_server_id_update BEFORE UPDATE ON {table} FOR EACH ROW
+                BEGIN
+                    IF NOT (NEW.server_name <=> OLD.server_name) AND NEW.server_id <=> OLD.server_id THEN
+                        SET NEW.server_id = {_server_id_for_name("NEW.server_name")};
+                    END IF;
+                END
+            """)
+        # Waiting rows are found through the server_id indexes; no config had their
+        # name before, so the new config is its oldest.
+        resolve = "".join(
+            f"""
+                    UPDATE {table} SET server_id = NEW.id
+                    WHERE server_id IS NULL AND LOWER(TRIM(server_name)) = LOWER(TRIM(NEW.server_name));"""
+            for table in _SERVER_ID_TABLES
         )
+        for event in ("INSERT", "UPDATE"):
+            _execute_schema_statement(cursor, f"""
+                CREATE TRIGGER guild_configs_resolve_server_id_{event.lower()} AFTER {event} ON guild_configs
+                FOR EACH ROW
+                BEGIN{resolve}
+                END
+            """)
+        _backfill_server_ids(cursor)
+        _execute_schema_statement(cursor, "ALTER TABLE players DROP INDEX ix_players_server_name_id")
 
-def release_db_connection(conn):
-    """Return the connection to the pool if not full; otherwise, close it."""
+# Applied once each, in order, and recorded in schema_migrations: changes that
+# cannot be expressed as re-runnable SCHEMA_STATEMENTS (backfills, re-keyed tables).
+SCHEMA_MIGRATIONS = [
+    (1, "Identify servers by guild_configs.id (server_id)", _migrate_server_ids),
+    (2, "Re-resolve server_id on renames and new guild configs", _migrate_server_id_updates),
+]
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def ensure_schema():
+    """
+    Creates the tables, indexes and triggers the dashboard relies on and applies any
+    pending SCHEMA_MIGRATIONS (once per process; migrations once per database).
+    """
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with get_pool().connection() as conn, conn.cursor() as cursor:
+            for statement in SCHEMA_STATEMENTS:
+                _execute_schema_statement(cursor, statement)
+
+            # Only one process migrates; the others wait here until it is done.
+            cursor.execute("SELECT GET_LOCK('adb_schema_migrations', 3600) AS locked")
+            try:
+                cursor.execute("SELECT version FROM schema_migrations")
+                applied = {row["version"] for row in cursor.fetchall()}
+                for version, description, migrate in SCHEMA_MIGRATIONS:
+                    if version in applied:
+                        continue
+                    logger.info("Applying schema migration %s: %s", version, description)
+                    migrate(conn)
+                    cursor.execute(
+                        "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)", (version, description)
+                    )
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK('adb_schema_migrations')")
+
+            cursor.execute("SELECT 1 FROM server_stats LIMIT 1")
+            seed_stats = cursor.fetchone() is None
+        _schema_ready = True
+    if seed_stats:
+        reconcile_server_stats()
+
+def fetch_schema_migrations():
+    """Lists the applied schema migrations, oldest first."""
+    conn = get_db_connection()
     try:
-        connection_pool.put_nowait(conn)
-    except queue.Full:
-        conn.close()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT * FROM schema_migrations ORDER BY version")
+            return cursor.fetchall()
+    finally:
+        release_db_connection(conn)
 
 # ---------------------------------------------------------------------------
 # Authentication Helpers (Discord OAuth)
@@ -91,6 +647,78 @@ def login_with_discord():
     auth_url = DISCORD_OAUTH_URL + "?" + urlencode(params)
     st.markdown(f"[**Login with Discord**]({auth_url})", unsafe_allow_html=True)
 
+# Seconds to wait for a connection and for a response to Discord.
+DISCORD_CONNECT_TIMEOUT = float(st.secrets.get("DISCORD_CONNECT_TIMEOUT") or os.getenv("DISCORD_CONNECT_TIMEOUT") or 3.05)
+DISCORD_READ_TIMEOUT = float(st.secrets.get("DISCORD_READ_TIMEOUT") or os.getenv("DISCORD_READ_TIMEOUT") or 10)
+# Retries after the first attempt; a Retry-After longer than DISCORD_MAX_RETRY_WAIT is not waited out.
+DISCORD_MAX_RETRIES = int(st.secrets.get("DISCORD_MAX_RETRIES") or os.getenv("DISCORD_MAX_RETRIES") or 3)
+DISCORD_MAX_RETRY_WAIT = float(st.secrets.get("DISCORD_MAX_RETRY_WAIT") or os.getenv("DISCORD_MAX_RETRY_WAIT") or 10)
+# Kept-alive connections to Discord, i.e. concurrent Discord requests without a new handshake.
+DISCORD_POOL_SIZE = int(st.secrets.get("DISCORD_POOL_SIZE") or os.getenv("DISCORD_POOL_SIZE") or 10)
+# How long a /users/@me response is reused for the same access token.
+DISCORD_USER_CACHE_TTL = float(st.secrets.get("DISCORD_USER_CACHE_TTL") or os.getenv("DISCORD_USER_CACHE_TTL") or 300)
+DISCORD_USER_CACHE_SIZE = 1000
+
+_discord_session = None
+_discord_session_lock = threading.Lock()
+
+def get_discord_session():
+    """Returns the process-wide requests.Session that keeps connections to Discord alive."""
+    global _discord_session
+    if _discord_session is None:
+        with _discord_session_lock:
+            if _discord_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=DISCORD_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _discord_session = session
+    return _discord_session
+
+def _retry_delay(response, attempt):
+    """Seconds to wait before retrying: Discord's Retry-After (header or body), else exponential backoff with jitter."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is None and response.headers.get("Content-Type", "").startswith("application/json"):
+            try:
+                retry_after = response.json().get("retry_after")
+            except ValueError:
+                retry_after = None
+        try:
+            if retry_after is not None:
+                return max(float(retry_after), 0)
+        except ValueError:
+            pass
+    return min(0.5 * 2 ** attempt, DISCORD_MAX_RETRY_WAIT) * random.uniform(0.5, 1)
+
+def discord_request(method, url, retry_statuses=(429, 500, 502, 503, 504), retry_errors=True, **kwargs):
+    """
+    Sends a request to Discord through the shared session with bounded timeouts.
+    Responses with a status in retry_statuses, and connection errors and timeouts
+    when retry_errors is set, are retried up to DISCORD_MAX_RETRIES times. The last
+    response is returned (or the last error raised) once retries run out.
+    """
+    kwargs.setdefault("timeout", (DISCORD_CONNECT_TIMEOUT, DISCORD_READ_TIMEOUT))
+    session = get_discord_session()
+    for attempt in range(DISCORD_MAX_RETRIES + 1):
+        response = None
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if not retry_errors or attempt == DISCORD_MAX_RETRIES:
+                raise
+        else:
+            if response.status_code not in retry_statuses or attempt == DISCORD_MAX_RETRIES:
+                return response
+        delay = _retry_delay(response, attempt)
+        if delay > DISCORD_MAX_RETRY_WAIT:
+            return response  # Rate limited for longer than a page load should wait.
+        logger.warning(
+            "Discord %s %s failed (%s); retrying in %.2fs",
+            method, url, response.status_code if response is not None else "connection error", delay
+        )
+        time.sleep(delay)
+
 def exchange_code_for_token(code):
     data = {
         "client_id": DISCORD_CLIENT_ID,
@@ -100,99 +728,617 @@ def exchange_code_for_token(code):
         "redirect_uri": DISCORD_REDIRECT_URI
     }
     headers = {"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"}
-    response = requests.post(DISCORD_TOKEN_URL, data=data, headers=headers)
+    # Codes are single use, so only a 429 (which Discord never processed) is retried.
+    response = discord_request("POST", DISCORD_TOKEN_URL, retry_statuses=(429,), retry_errors=False, data=data, headers=headers)
     if response.status_code != 200:
         st.error("Token exchange failed: " + response.text)
         response.raise_for_status()
     return response.json()
 
+_discord_user_cache = OrderedDict()  # sha256(access token) -> (user info, expires_at)
+_discord_user_cache_lock = threading.Lock()
+
 def fetch_user_info(access_token):
+    """Fetches /users/@me for the token, reusing the answer for DISCORD_USER_CACHE_TTL seconds."""
+    key = hashlib.sha256(access_token.encode()).hexdigest()
+    with _discord_user_cache_lock:
+        entry = _discord_user_cache.get(key)
+        if entry and entry[1] > time.monotonic():
+            _discord_user_cache.move_to_end(key)
+            return dict(entry[0])
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(DISCORD_API_URL, headers=headers)
+    response = discord_request("GET", DISCORD_API_URL, headers=headers)
     response.raise_for_status()
-    return response.json()
+    user_info = response.json()
+    with _discord_user_cache_lock:
+        _discord_user_cache[key] = (user_info, time.monotonic() + DISCORD_USER_CACHE_TTL)
+        _discord_user_cache.move_to_end(key)
+        while len(_discord_user_cache) > DISCORD_USER_CACHE_SIZE:
+            _discord_user_cache.popitem(last=False)
+    return dict(user_info)
+
+# ---------------------------------------------------------------------------
+# Authorization
+# ---------------------------------------------------------------------------
+# Seconds a session may reuse the access level and server allowlist it loaded.
+AUTH_CACHE_TTL = float(st.secrets.get("AUTH_CACHE_TTL") or os.getenv("AUTH_CACHE_TTL") or 60)
+
+# Bumped by the write helpers below whenever a user's access or server assignments
+# change, so every session in this process drops its cached permissions at once.
+# The None key invalidates everyone (e.g. after the server list itself changes).
+_auth_generations = {}
+_auth_generations_lock = threading.Lock()
+
+def invalidate_user_auth(discord_id=None):
+    """Drops cached permissions for discord_id, or for every user when it is None."""
+    key = None if discord_id is None else str(discord_id)
+    with _auth_generations_lock:
+        _auth_generations[key] = _auth_generations.get(key, 0) + 1
+
+def get_auth_context(discord_id):
+    """
+    Returns the user's permissions as {"record", "access_level", "servers"}, where
+    servers is their allowlist as {server_id: server_name} (assigned servers for
+    "user", every server otherwise),
+    or None if they have no user_access record. Results are cached in the session
+    for AUTH_CACHE_TTL seconds and dropped as soon as invalidate_user_auth is called.
+    """
+    key = str(discord_id)
+    generation = (_auth_generations.get(None, 0), _auth_generations.get(key, 0))
+    cache = st.session_state.setdefault("auth_context_cache", {})
+    entry = cache.get(key)
+    if entry and entry["generation"] == generation and time.monotonic() - entry["loaded_at"] < AUTH_CACHE_TTL:
+        return entry["context"]
+
+    record = get_user_record(discord_id)
+    context = None
+    if record:
+        access_level = record.get("access_level", "user")
+        context = {
+            "record": record,
+            "access_level": access_level,
+            "servers": fetch_servers_for_user(discord_id) if access_level == "user" else fetch_server_map(),
+        }
+    cache[key] = {"context": context, "generation": generation, "loaded_at": time.monotonic()}
+    return context
+
+def require_auth():
+    """
+    The authorization check every page starts with: stops the page unless the session
+    has a logged-in user with a user_access record. Returns (user, auth context).
+    """
+    user = st.session_state.get("user")
+    if not user:
+        st.error("Please log in.")
+        st.stop()
+    auth = get_auth_context(user["id"])
+    if not auth:
+        st.error("Your account is not authorized. Please contact an administrator.")
+        st.stop()
+    user["access_level"] = auth["access_level"]
+    st.session_state["user"] = user
+    return user, auth
+
+# ---------------------------------------------------------------------------
+# Audit Log Writer
+# ---------------------------------------------------------------------------
+AUDIT_SPOOL_DIR = (
+    st.secrets.get("AUDIT_SPOOL_DIR") or os.getenv("AUDIT_SPOOL_DIR")
+    or os.path.join(tempfile.gettempdir(), "adb_audit_spool")
+)
+# A batch is written as soon as this many events are waiting...
+AUDIT_FLUSH_SIZE = int(st.secrets.get("AUDIT_FLUSH_SIZE") or os.getenv("AUDIT_FLUSH_SIZE") or 50)
+# ...or every this many seconds, whichever comes first.
+AUDIT_FLUSH_INTERVAL = float(st.secrets.get("AUDIT_FLUSH_INTERVAL") or os.getenv("AUDIT_FLUSH_INTERVAL") or 2)
+
+AUDIT_EVENT_COLUMNS = (
+    "event_id", "user_id", "action", "details", "before_state", "after_state", "before_diff", "after_diff", "timestamp"
+)
+
+
+class AuditLogWriter:
+    """
+    Writes activity_logs rows from a background thread so UI actions never wait on
+    the audit table. Events are batched into multi-row INSERTs of up to flush_size
+    rows, written when a batch fills up or flush_interval seconds pass.
+
+    Each event is appended to this writer's spool file before it is queued, and the
+    spool is only trimmed once its rows are committed. On start, spool files left by
+    processes that died are replayed; event_id makes replayed rows idempotent. Spool
+    names are unique per writer, so a restarted process that reuses a dead one's PID
+    (PID 1 in a container) still replays that spool instead of taking it over.
+    """
+
+    def __init__(self, spool_dir=AUDIT_SPOOL_DIR, flush_size=AUDIT_FLUSH_SIZE, flush_interval=AUDIT_FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._cond = threading.Condition()
+        self._pending = []
+        self._submitted = 0
+        self._committed = 0
+        self._flush_requested = False
+        self._closed = False
+        self._clock_offset = self._measure_clock_offset()
+        os.makedirs(spool_dir, exist_ok=True)
+        self._spool_path = os.path.join(spool_dir, f"audit-{os.getpid()}-{uuid.uuid4().hex}.jsonl")
+        self._spool = open(self._spool_path, "a", encoding="utf-8")
+        if fcntl:
+            fcntl.flock(self._spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._replay_orphaned_spools(spool_dir)
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+
+    def _measure_clock_offset(self):
+        """How far the database clock is ahead of this process's clock."""
+        try:
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT NOW(6) AS now")
+                    return cursor.fetchone()["now"] - datetime.now()
+            finally:
+                release_db_connection(conn)
+        except Exception:
+            logger.exception("Could not read the database clock; audit events are timestamped with the local clock")
+            return timedelta(0)
+
+    def now(self):
+        """The database's current time (what NOW() would return), to the second."""
+        return (datetime.now() + self._clock_offset).replace(microsecond=0)
+
+    def _replay_orphaned_spools(self, spool_dir):
+        """Queues events from spool files whose owning process is gone (their lock is free)."""
+        if not fcntl:
+            return
+        for name in sorted(os.listdir(spool_dir)):
+            path = os.path.join(spool_dir, name)
+            if path == self._spool_path or not name.endswith(".jsonl"):
+                continue
+            with open(path, "r+", encoding="utf-8") as orphan:
+                try:
+                    fcntl.flock(orphan, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # Still owned by a live process.
+                events = [json.loads(line) for line in orphan if line.strip()]
+                for event in events:
+                    self._append(event)
+                os.remove(path)
+            if events:
+                logger.info("Replaying %d spooled audit events from %s", len(events), path)
+
+    def _append(self, event):
+        self._spool.write(json.dumps(event, default=str) + "\n")
+        self._spool.flush()
+        os.fsync(self._spool.fileno())
+        self._pending.append(event)
+        self._submitted += 1
+
+    def submit(self, event):
+        """Queues one activity_logs row (a dict keyed by AUDIT_EVENT_COLUMNS)."""
+        with self._cond:
+            self._append(event)
+            if len(self._pending) >= self.flush_size:
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Blocks until every event submitted so far is committed; returns False on timeout."""
+        with self._cond:
+            target = self._submitted
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._committed >= target, timeout)
+
+    def close(self, timeout=10):
+        """Writes out everything still queued and stops the writer thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _run(self):
+        retry_delay = self.flush_interval
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or self._flush_requested or len(self._pending) >= self.flush_size,
+                    self.flush_interval
+                )
+                if not self._pending:
+                    self._flush_requested = False
+                    if self._closed:
+                        return
+                    continue
+                batch = self._pending[:self.flush_size]
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception("Writing %d audit events failed; retrying in %.1fs", len(batch), retry_delay)
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 60)
+                continue
+            retry_delay = self.flush_interval
+            with self._cond:
+                del self._pending[:len(batch)]
+                self._committed += len(batch)
+                self._rewrite_spool()
+                self._cond.notify_all()
+
+    def _write(self, batch):
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.executemany(
+                    f"INSERT IGNORE INTO activity_logs ({', '.join(AUDIT_EVENT_COLUMNS)}) "
+                    f"VALUES ({', '.join(['%s'] * len(AUDIT_EVENT_COLUMNS))})",
+                    [tuple(event[col] for col in AUDIT_EVENT_COLUMNS) for event in batch]
+                )
+            conn.commit()
+        finally:
+            release_db_connection(conn)
+        invalidate_cache("activity_logs")
+
+    def _rewrite_spool(self):
+        """Shrinks the spool to the events that are still pending (caller holds the lock)."""
+        self._spool.seek(0)
+        self._spool.truncate()
+        for event in self._pending:
+            self._spool.write(json.dumps(event, default=str) + "\n")
+        self._spool.flush()
+        os.fsync(self._spool.fileno())
+
+
+_audit_writer = None
+_audit_writer_lock = threading.Lock()
+
+def get_audit_writer():
+    """Returns the process-wide audit writer, starting it (and replaying spools) on first use."""
+    global _audit_writer
+    if _audit_writer is None:
+        with _audit_writer_lock:
+            if _audit_writer is None:
+                _audit_writer = AuditLogWriter()
+                atexit.register(_audit_writer.close)
+    return _audit_writer
+
+def flush_activity_logs(timeout=5):
+    """Waits for queued audit events to reach activity_logs (e.g. before showing them)."""
+    if _audit_writer is not None:
+        _audit_writer.flush(timeout)
+
+# ---------------------------------------------------------------------------
+# Read Cache
+# ---------------------------------------------------------------------------
+# Lifetime of cached reads of data only the dashboard writes (configs, users)...
+READ_CACHE_TTL = float(st.secrets.get("READ_CACHE_TTL") or os.getenv("READ_CACHE_TTL") or 300)
+# ...and of data the bot also writes, whose changes cannot invalidate the cache.
+READ_CACHE_PLAYER_TTL = float(st.secrets.get("READ_CACHE_PLAYER_TTL") or os.getenv("READ_CACHE_PLAYER_TTL") or 15)
+# How old a shared monitor snapshot may get before the next reader refreshes it.
+MONITOR_REFRESH_INTERVAL = float(
+    st.secrets.get("MONITOR_REFRESH_INTERVAL") or os.getenv("MONITOR_REFRESH_INTERVAL") or 60
+)
+# Lifetime of player reads made only after a monitor delta sync, which drops them as
+# soon as it finds changed players, so they can outlive one refresh interval.
+READ_CACHE_MONITOR_TTL = max(READ_CACHE_PLAYER_TTL, MONITOR_REFRESH_INTERVAL)
+READ_CACHE_SIZE = int(st.secrets.get("READ_CACHE_SIZE") or os.getenv("READ_CACHE_SIZE") or 512)
+
+
+class ReadCache:
+    """
+    Process-wide TTL + LRU cache of read helper results. Every entry carries tags
+    naming the data it was read from; invalidate(tag) drops all of them. A read
+    that was in flight while one of its tags was invalidated is not stored.
+    """
+
+    def __init__(self, max_entries=READ_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, tags, expires_at)
+        self._generations = {}         # tag -> invalidation count
+
+    def generations(self, tags):
+        with self._lock:
+            return tuple(self._generations.get(tag, 0) for tag in sorted(tags))
+
+    def get(self, key):
+        """Returns (True, value) for a live entry, else (False, None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[2] <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry[0]
+
+    def put(self, key, value, tags, ttl, generations):
+        with self._lock:
+            if generations != tuple(self._generations.get(tag, 0) for tag in sorted(tags)):
+                return
+            self._entries[key] = (value, tags, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+            stale = [key for key, entry in self._entries.items() if not entry[1].isdisjoint(tags)]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_read_cache = ReadCache()
+
+def _cache_key_part(value):
+    """Turns list/set/dict arguments into hashable equivalents."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_cache_key_part(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return ("set",) + tuple(sorted(_cache_key_part(item) for item in value))
+    if isinstance(value, dict):
+        return ("dict",) + tuple(sorted((key, _cache_key_part(item)) for key, item in value.items()))
+    hash(value)
+    return value
+
+def cached_read(*tags, ttl=READ_CACHE_TTL):
+    """
+    Caches a read helper's result per arguments under the given tags. Callers get
+    a copy, so they can modify DataFrames and rows freely.
+    """
+    tags = frozenset(tags)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                key = (func.__qualname__, _cache_key_part(args), _cache_key_part(kwargs))
+            except TypeError:
+                return func(*args, **kwargs)
+            hit, value = _read_cache.get(key)
+            if not hit:
+                generations = _read_cache.generations(tags)
+                value = func(*args, **kwargs)
+                _read_cache.put(key, value, tags, ttl, generations)
+            return copy.deepcopy(value)
+        return wrapper
+    return decorator
+
+def invalidates(*tags):
+    """Marks a write helper: once it returns (or fails), cached reads tagged with any of tags are dropped."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _read_cache.invalidate(*tags)
+        return wrapper
+    return decorator
+
+def invalidate_cache(*tags):
+    """Drops cached reads tagged with any of tags, for writes made outside the decorated helpers."""
+    _read_cache.invalidate(*tags)
 
 # ---------------------------------------------------------------------------
 # Database Query Helper Functions
 # ---------------------------------------------------------------------------
-def fetch_stats(server_name=None):
+PLAYER_STATS_QUERY = """
+    SELECT IFNULL(server_id, 0) AS server_id,
+           COUNT(*) AS total_players,
+           COALESCE(SUM(alt_flag = TRUE), 0) AS flagged_accounts,
+           COALESCE(SUM(watchlisted = TRUE), 0) AS watchlisted_accounts,
+           COALESCE(SUM(whitelist = TRUE), 0) AS whitelisted_accounts,
+           COALESCE(SUM(multiple_devices = TRUE), 0) AS multiple_devices
+    FROM players
+    GROUP BY 1
+"""
+
+def fetch_server_stats():
+    """
+    Recomputes every player counter for every server in a single pass over players.
+    Returns a dict mapping server_id (0 for unassigned rows) to a dict keyed by STAT_COLUMNS.
+    This is the source of truth that server_stats is reconciled against.
+    """
     conn = get_db_connection()
     try:
         with conn.cursor() as cursor:
-            total_query = "SELECT COUNT(*) AS total_players FROM players"
-            if server_name and server_name != "All":
-                total_query += " WHERE LOWER(TRIM(server_name)) LIKE CONCAT('%%', LOWER(TRIM(%s)), '%%')"
-                cursor.execute(total_query, (server_name,))
-            else:
-                cursor.execute(total_query)
-            total_players = cursor.fetchone()["total_players"]
+            cursor.execute(PLAYER_STATS_QUERY)
+            rows = cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+    return {row["server_id"]: {col: int(row[col]) for col in STAT_COLUMNS} for row in rows}
 
-            flagged_query = "SELECT COUNT(*) AS flagged_accounts FROM players WHERE alt_flag = TRUE"
-            if server_name and server_name != "All":
-                flagged_query += " AND LOWER(TRIM(server_name)) LIKE CONCAT('%%', LOWER(TRIM(%s)), '%%')"
-                cursor.execute(flagged_query, (server_name,))
+@cached_read("players", ttl=READ_CACHE_PLAYER_TTL)
+def fetch_stats(server_id=None):
+    """
+    Reads the dashboard counters from the server_stats summary table: a primary-key
+    lookup for one server, or a sum over the (one row per server) table when server_id is None.
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            columns = ", ".join(f"COALESCE(SUM({col}), 0) AS {col}" for col in STAT_COLUMNS)
+            query = f"SELECT {columns} FROM server_stats"
+            if server_id is not None:
+                query += " WHERE server_id = %s"
+                cursor.execute(query, (server_id,))
             else:
-                cursor.execute(flagged_query)
-            flagged_accounts = cursor.fetchone()["flagged_accounts"]
+                cursor.execute(query)
+            row = cursor.fetchone()
+    finally:
+        release_db_connection(conn)
+    return {col: int(row[col]) for col in STAT_COLUMNS}
 
-            watchlisted_query = "SELECT COUNT(*) AS watchlisted_accounts FROM players WHERE watchlisted = TRUE"
-            if server_name and server_name != "All":
-                watchlisted_query += " AND LOWER(TRIM(server_name)) LIKE CONCAT('%%', LOWER(TRIM(%s)), '%%')"
-                cursor.execute(watchlisted_query, (server_name,))
-            else:
-                cursor.execute(watchlisted_query)
-            watchlisted_accounts = cursor.fetchone()["watchlisted_accounts"]
+@invalidates("players")
+def reconcile_server_stats():
+    """
+    Rebuilds server_stats from players and returns the drift that was corrected as a
+    list of dicts (server_id, column, stored, actual).
 
-            whitelisted_query = "SELECT COUNT(*) AS whitelisted_accounts FROM players WHERE whitelist = TRUE"
-            if server_name and server_name != "All":
-                whitelisted_query += " AND LOWER(TRIM(server_name)) LIKE CONCAT('%%', LOWER(TRIM(%s)), '%%')"
-                cursor.execute(whitelisted_query, (server_name,))
-            else:
-                cursor.execute(whitelisted_query)
-            whitelisted_accounts = cursor.fetchone()["whitelisted_accounts"]
-
-            # New: Query to count accounts using multiple devices.
-            multi_query = "SELECT COUNT(*) AS multiple_devices FROM players WHERE multiple_devices = TRUE"
-            if server_name and server_name != "All":
-                multi_query += " AND LOWER(TRIM(server_name)) LIKE CONCAT('%%', LOWER(TRIM(%s)), '%%')"
-                cursor.execute(multi_query, (server_name,))
-            else:
-                cursor.execute(multi_query)
-            multiple_devices = cursor.fetchone()["multiple_devices"]
+    The counter rows are locked before players is read, so writers that race with the
+    rebuild wait in their trigger and apply their delta on top of the rebuilt values.
+    """
+    conn = get_db_connection()
+    drift = []
+    try:
+        conn.begin()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT * FROM server_stats FOR UPDATE")
+            stored = {row["server_id"]: row for row in cursor.fetchall()}
+            cursor.execute(PLAYER_STATS_QUERY)
+            actual = {row["server_id"]: row for row in cursor.fetchall()}
+
+            for key in sorted(set(stored) | set(actual)):
+                for col in STAT_COLUMNS:
+                    stored_value = int(stored[key][col]) if key in stored else 0
+                    actual_value = int(actual[key][col]) if key in actual else 0
+                    if stored_value != actual_value:
+                        drift.append({"server_id": key, "column": col, "stored": stored_value, "actual": actual_value})
+
+            if actual:
+                cursor.executemany(
+                    f"REPLACE INTO server_stats (server_id, {', '.join(STAT_COLUMNS)}) "
+                    f"VALUES (%s, {', '.join(['%s'] * len(STAT_COLUMNS))})",
+                    [(key,) + tuple(int(row[col]) for col in STAT_COLUMNS) for key, row in actual.items()]
+                )
+            stale = [key for key in stored if key not in actual]
+            if stale:
+                placeholders = ",".join(["%s"] * len(stale))
+                cursor.execute(f"DELETE FROM server_stats WHERE server_id IN ({placeholders})", tuple(stale))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         release_db_connection(conn)
+    return drift
 
-    return {
-        "total_players": total_players,
-        "flagged_accounts": flagged_accounts,
-        "watchlisted_accounts": watchlisted_accounts,
-        "whitelisted_accounts": whitelisted_accounts,
-        "multiple_devices": multiple_devices
-    }
 
+TREND_ROLLUP = "player_history_daily"
+_trend_rolled_up_to = None
 
+def refresh_trend_rollup(full=False, build=True):
+    """
+    Rolls player_history up into player_history_daily for every complete day past the
+    stored high-water mark (or for all history when full=True), then moves the mark to
+    yesterday. Returns the last day the rollup now covers (None if it was never built).
+    build=False leaves a rollup that was never built alone, so pages do not run the
+    full-history build; `manage.py migrate` and `manage.py refresh-trends` do.
+    Rows written for an already rolled-up day are only picked up by a full refresh,
+    except for the log ingestion (ingest.py), which adds its late rows itself.
+    """
+    global _trend_rolled_up_to
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            # Created in its own statement: inside the transaction below, the share lock
+            # INSERT IGNORE takes on an existing row deadlocks two concurrent refreshes
+            # once both ask for the exclusive one.
+            cursor.execute(
+                "INSERT IGNORE INTO rollup_state (name, rolled_up_to) VALUES (%s, NULL)", (TREND_ROLLUP,)
+            )
+        conn.begin()
+        with conn.cursor() as cursor:
+            # Locking the state row serializes refreshes across sessions and processes.
+            cursor.execute(
+                "SELECT rolled_up_to, CURDATE() - INTERVAL 1 DAY AS yesterday FROM rollup_state WHERE name = %s FOR UPDATE",
+                (TREND_ROLLUP,)
+            )
+            state = cursor.fetchone()
+            rolled_up_to = None if full else state["rolled_up_to"]
+            yesterday = state["yesterday"]
+            if rolled_up_to is None and not (full or build):
+                pass
+            elif rolled_up_to is None or rolled_up_to < yesterday:
+                query = """
+                    INSERT INTO player_history_daily (server_id, day, events)
+                    SELECT IFNULL(server_id, 0), DATE(timestamp), COUNT(*)
+                    FROM player_history
+                    WHERE timestamp < CURDATE()
+                """
+                params = ()
+                if rolled_up_to is not None:
+                    query += " AND timestamp >= %s + INTERVAL 1 DAY"
+                    params = (rolled_up_to,)
+                query += """
+                    GROUP BY 1, 2
+                    ON DUPLICATE KEY UPDATE events = VALUES(events)
+                """
+                if full:
+                    cursor.execute("DELETE FROM player_history_daily")
+                cursor.execute(query, params)
+                rolled_up_to = yesterday
+                cursor.execute(
+                    "UPDATE rollup_state SET rolled_up_to = %s WHERE name = %s", (rolled_up_to, TREND_ROLLUP)
+                )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+    _trend_rolled_up_to = rolled_up_to
+    return rolled_up_to
 
-def fetch_trend_data(server_name=None):
+def fetch_trend_rolled_up_to():
+    """The last day player_history_daily covers (None until the rollup has been built)."""
     conn = get_db_connection()
     try:
         with conn.cursor() as cursor:
-            base_query = """
-                SELECT DATE(timestamp) AS date, COUNT(*) AS count
-                FROM player_history
-            """
-            if server_name and server_name != "All":
-                base_query += " WHERE LOWER(TRIM(server_name)) LIKE CONCAT('%%', LOWER(TRIM(%s)), '%%')"
-                base_query += " GROUP BY DATE(timestamp) ORDER BY date ASC"
-                cursor.execute(base_query, (server_name,))
-            else:
-                base_query += " GROUP BY DATE(timestamp) ORDER BY date ASC"
-                cursor.execute(base_query)
+            cursor.execute("SELECT rolled_up_to FROM rollup_state WHERE name = %s", (TREND_ROLLUP,))
+            state = cursor.fetchone()
+            return state["rolled_up_to"] if state else None
+    finally:
+        release_db_connection(conn)
+
+@cached_read("players", ttl=READ_CACHE_PLAYER_TTL)
+def fetch_trend_data(server_id=None, until_id=None):
+    """
+    Daily player_history counts for the trend charts: complete days come from the
+    player_history_daily rollup and only the days since (normally just today) are
+    counted live, over an index range on timestamp. until_id caps the live rows at
+    a player_history id high-water mark. Until the rollup has been built, only
+    today is counted.
+    """
+    rolled_up_to = _trend_rolled_up_to
+    if rolled_up_to is None or rolled_up_to < date.today() - timedelta(days=1):
+        # One session per process rolls up the new day; the others wait for it.
+        rolled_up_to = _snapshots.get(("trend_rollup",), lambda previous: refresh_trend_rollup(build=False), 0)
+
+    rollup_query = "SELECT day AS date, CAST(SUM(events) AS SIGNED) AS count FROM player_history_daily"
+    live_query = "SELECT DATE(timestamp) AS date, COUNT(*) AS count FROM player_history WHERE timestamp >= %s"
+    live_since = rolled_up_to + timedelta(days=1) if rolled_up_to else date.today()
+    rollup_params, live_params = (), (live_since,)
+    if server_id is not None:
+        rollup_query += " WHERE server_id = %s"
+        live_query += " AND server_id = %s"
+        rollup_params, live_params = (server_id,), (live_since, server_id)
+    if until_id is not None:
+        live_query += " AND id <= %s"
+        live_params += (until_id,)
+    rollup_query += " GROUP BY day"
+    live_query += " GROUP BY DATE(timestamp)"
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT date, count FROM ({rollup_query} UNION ALL {live_query}) AS trend ORDER BY date ASC",
+                rollup_params + live_params
+            )
             rows = cursor.fetchall()
     finally:
         release_db_connection(conn)
 
     return pd.DataFrame(rows)
 
+@cached_read("servers")
 def fetch_servers():
     conn = get_db_connection()
     try:
@@ -203,24 +1349,226 @@ def fetch_servers():
         release_db_connection(conn)
     return [row["server_name"] for row in rows if row["server_name"]]
 
-def update_players_server_name(old_server, new_server):
+@cached_read("servers")
+def fetch_server_map():
+    """
+    Maps every server_id to its display name. A name configured in several guilds
+    appears once, under the id its rows are stored with (see _server_id_for_name).
+    """
     conn = get_db_connection()
     try:
         with conn.cursor() as cursor:
-            query = """
-            UPDATE players
-            SET server_name = %s
-            WHERE LOWER(TRIM(server_name)) = LOWER(TRIM(%s))
-            """
-            cursor.execute(query, (new_server, old_server))
+            cursor.execute(
+                """
+                SELECT MIN(id) AS server_id, MIN(server_name) AS server_name FROM guild_configs
+                WHERE server_name IS NOT NULL AND server_name <> ''
+                GROUP BY LOWER(TRIM(server_name))
+                ORDER BY server_name
+                """
+            )
+            rows = cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+    return {row["server_id"]: row["server_name"] for row in rows}
+
+# Rows per primary-key range touched by each rename transaction, and the pause
+# between chunks that lets the bot's own writes through.
+RENAME_CHUNK_SIZE = int(st.secrets.get("RENAME_CHUNK_SIZE") or os.getenv("RENAME_CHUNK_SIZE") or 5000)
+RENAME_CHUNK_PAUSE = float(st.secrets.get("RENAME_CHUNK_PAUSE") or os.getenv("RENAME_CHUNK_PAUSE") or 0.05)
+# A running job whose owner has not reported progress for this long is taken over.
+RENAME_STALE_AFTER = 120
+# Tables renamed chunk by chunk, in order; everything else is updated in one go at the end.
+RENAME_CHUNKED_TABLES = ("players", "player_history")
+
+_rename_owner = f"{socket.gethostname()}:{os.getpid()}"
+_rename_threads = {}
+_rename_threads_lock = threading.Lock()
+
+def start_server_rename(old_server, new_server, server_id=None):
+    """
+    Queues a job that renames the rows of server_id (by default, the server old_server
+    currently resolves to) to new_server in every table that stores the name, and
+    starts it in the background. Returns the job id.
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            if server_id is None:
+                cursor.execute(f"SELECT {_server_id_for_name('%s')} AS server_id", (old_server,))
+                server_id = cursor.fetchone()["server_id"]
+            cursor.execute(
+                "INSERT INTO server_rename_jobs (old_name, new_name, server_id, current_table) VALUES (%s, %s, %s, %s)",
+                (old_server, new_server, server_id, RENAME_CHUNKED_TABLES[0])
+            )
+            job_id = cursor.lastrowid
+    finally:
+        release_db_connection(conn)
+    _start_rename_worker(job_id)
+    return job_id
+
+def update_players_server_name(old_server, new_server, server_id=None):
+    """Renames a server's player records (and the rest of its data) via a background rename job."""
+    return start_server_rename(old_server, new_server, server_id)
+
+def resume_server_rename_jobs():
+    """Restarts unfinished rename jobs whose owner is gone. Returns the ids that were started."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT id FROM server_rename_jobs
+                WHERE status = 'pending'
+                   OR (status = 'running' AND (owner = %s OR heartbeat < NOW() - INTERVAL %s SECOND))
+                ORDER BY id
+                """,
+                (_rename_owner, RENAME_STALE_AFTER)
+            )
+            job_ids = [row["id"] for row in cursor.fetchall()]
+    finally:
+        release_db_connection(conn)
+    return [job_id for job_id in job_ids if _start_rename_worker(job_id)]
+
+def retry_server_rename(job_id):
+    """Puts a failed rename job back in the queue; it resumes from its last chunk."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE server_rename_jobs SET status = 'pending', error = NULL, owner = NULL WHERE id = %s AND status = 'failed'",
+                (job_id,)
+            )
+    finally:
+        release_db_connection(conn)
+    _start_rename_worker(job_id)
+
+def fetch_server_rename_jobs(limit=20):
+    """Fetches the most recent rename jobs with their progress."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT * FROM server_rename_jobs ORDER BY id DESC LIMIT %s", (limit,))
+            return cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+
+def _start_rename_worker(job_id):
+    with _rename_threads_lock:
+        thread = _rename_threads.get(job_id)
+        if thread and thread.is_alive():
+            return False
+        thread = threading.Thread(target=run_server_rename_job, args=(job_id,), name=f"server-rename-{job_id}", daemon=True)
+        _rename_threads[job_id] = thread
+        thread.start()
+        return True
+
+def wait_for_server_renames(timeout=None):
+    """Blocks until the rename workers started by this process have finished."""
+    with _rename_threads_lock:
+        threads = list(_rename_threads.values())
+    for thread in threads:
+        thread.join(timeout)
+
+def _rename_job_match(job):
+    """The WHERE condition (and its parameter) selecting a rename job's rows."""
+    if job.get("server_id") is None:
+        # Jobs queued before rename jobs recorded their server_id.
+        return "LOWER(TRIM(server_name)) = LOWER(TRIM(%s))", job["old_name"]
+    return "server_id = %s", job["server_id"]
+
+def run_server_rename_job(job_id):
+    """
+    Runs (or resumes) a rename job in the calling thread. players and player_history
+    are updated in primary-key ranges of RENAME_CHUNK_SIZE, each in its own short
+    transaction that also records the job's progress, so a failed or interrupted
+    job picks up after the last committed chunk.
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE server_rename_jobs
+                SET status = 'running', owner = %s, heartbeat = NOW()
+                WHERE id = %s AND status IN ('pending', 'running')
+                  AND (owner IS NULL OR owner = %s OR heartbeat < NOW() - INTERVAL %s SECOND)
+                """,
+                (_rename_owner, job_id, _rename_owner, RENAME_STALE_AFTER)
+            )
+            if cursor.rowcount != 1:
+                return  # Finished, failed, or owned by a live worker elsewhere.
+
+        while True:
+            conn.begin()
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT * FROM server_rename_jobs WHERE id = %s FOR UPDATE", (job_id,))
+                job = cursor.fetchone()
+                if job["owner"] != _rename_owner or job["status"] != "running":
+                    conn.rollback()
+                    return
+                table = job["current_table"]
+                if table in RENAME_CHUNKED_TABLES:
+                    cursor.execute(f"SELECT COALESCE(MAX(id), 0) AS max_id FROM {table}")
+                    max_id = cursor.fetchone()["max_id"]
+                    if job["last_id"] >= max_id:
+                        position = RENAME_CHUNKED_TABLES.index(table) + 1
+                        next_table = RENAME_CHUNKED_TABLES[position] if position < len(RENAME_CHUNKED_TABLES) else "finalize"
+                        cursor.execute(
+                            "UPDATE server_rename_jobs SET current_table = %s, last_id = 0, target_id = NULL, heartbeat = NOW() WHERE id = %s",
+                            (next_table, job_id)
+                        )
+                        conn.commit()
+                        continue
+                    upper_id = job["last_id"] + RENAME_CHUNK_SIZE
+                    server_match, server_key = _rename_job_match(job)
+                    cursor.execute(
+                        f"UPDATE {table} SET server_name = %s WHERE id > %s AND id <= %s AND {server_match}",
+                        (job["new_name"], job["last_id"], upper_id, server_key)
+                    )
+                    cursor.execute(
+                        """
+                        UPDATE server_rename_jobs
+                        SET last_id = %s, target_id = %s, rows_updated = rows_updated + %s, heartbeat = NOW()
+                        WHERE id = %s
+                        """,
+                        (min(upper_id, max_id), max_id, cursor.rowcount, job_id)
+                    )
+                    conn.commit()
+                    time.sleep(RENAME_CHUNK_PAUSE)
+                    continue
+
+                # Assignments are small enough to rename in one go. server_stats and the
+                # trend rollup are keyed by server_id and need no changes.
+                server_match, server_key = _rename_job_match(job)
+                cursor.execute(
+                    f"UPDATE user_servers SET server_name = %s WHERE {server_match}", (job["new_name"], server_key)
+                )
+                cursor.execute(
+                    "UPDATE server_rename_jobs SET status = 'done', current_table = NULL, heartbeat = NOW() WHERE id = %s",
+                    (job_id,)
+                )
             conn.commit()
+            invalidate_user_auth()
+            invalidate_cache("servers", "users", "players")
+            return
+    except Exception as e:
+        logger.exception("Server rename job %s failed", job_id)
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE server_rename_jobs SET status = 'failed', error = %s WHERE id = %s", (str(e), job_id)
+            )
     finally:
         release_db_connection(conn)
 
+@invalidates("servers", "users")
 def update_server_config(new_config, old_server):
     conn = get_db_connection()
     try:
         with conn.cursor() as cursor:
+            # Resolved before the config is renamed, while old_server still names it.
+            cursor.execute(f"SELECT {_server_id_for_name('%s')} AS server_id", (old_server,))
+            server_id = cursor.fetchone()["server_id"]
             query = """
             UPDATE guild_configs SET 
                 guild_name = %s, 
@@ -243,8 +1591,8 @@ def update_server_config(new_config, old_server):
             conn.commit()
             st.success("Server configuration updated! Please refresh the page to see changes.")
             if new_config["server_name"].strip().lower() != old_server.strip().lower():
-                update_players_server_name(old_server, new_config["server_name"])
-                st.success("All player records updated with the new server name!")
+                start_server_rename(old_server, new_config["server_name"], server_id)
+                st.success("Player records are being renamed in the background; progress is shown under Server Rename Jobs.")
     except pymysql.err.IntegrityError as e:
         if e.args[0] == 1062:
             st.error("Duplicate entry error: This server name already exists for this guild. Please choose a different server name.")
@@ -254,18 +1602,21 @@ def update_server_config(new_config, old_server):
         st.error(f"Error updating config: {e}")
     finally:
         release_db_connection(conn)
+        invalidate_user_auth()
 
 # Helpers        
 
-def fetch_server_config(server_name):
+@cached_read("servers")
+def fetch_server_config(server_id):
     conn = get_db_connection()
     try:
         with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM guild_configs WHERE server_name = %s", (server_name,))
+            cursor.execute("SELECT * FROM guild_configs WHERE id = %s", (server_id,))
             return cursor.fetchone()
     finally:
         release_db_connection(conn)
 
+@cached_read("users")
 def fetch_user_access():
     conn = get_db_connection()
     try:
@@ -276,6 +1627,7 @@ def fetch_user_access():
         release_db_connection(conn)
     return pd.DataFrame(rows)
 
+@invalidates("users")
 def add_user_access(discord_id, username, access_level):
     conn = get_db_connection()
     try:
@@ -291,7 +1643,9 @@ def add_user_access(discord_id, username, access_level):
         st.error(f"Error: A user with that Discord ID may already exist. {e}")
     finally:
         release_db_connection(conn)
+        invalidate_user_auth(discord_id)
 
+@invalidates("users")
 def remove_user_access(record_id):
     conn = get_db_connection()
     try:
@@ -304,8 +1658,11 @@ def remove_user_access(record_id):
         st.error(f"Error removing user: {e}")
     finally:
         release_db_connection(conn)
+        invalidate_user_auth()
 
 # Add this function to common.py
+# The permission reads are not read-cached: get_auth_context keeps them for at most
+# AUTH_CACHE_TTL, and a longer-lived copy would outlast revoked access.
 def get_user_record(discord_id):
     conn = get_db_connection()
     try:
@@ -316,17 +1673,25 @@ def get_user_record(discord_id):
         release_db_connection(conn)
 
 def fetch_servers_for_user(discord_id):
+    """Maps the server_ids assigned to the user to their current display names."""
     conn = get_db_connection()
     try:
         with conn.cursor() as cursor:
-            query = "SELECT DISTINCT server_name FROM user_servers WHERE discord_id = %s"
+            query = """
+            SELECT DISTINCT gc.id AS server_id, gc.server_name
+            FROM user_servers us
+            JOIN guild_configs gc ON gc.id = us.server_id
+            WHERE us.discord_id = %s
+            ORDER BY gc.server_name
+            """
             cursor.execute(query, (discord_id,))
             rows = cursor.fetchall()
-            return [row["server_name"] for row in rows if row["server_name"]]
+            return {row["server_id"]: row["server_name"] for row in rows}
     finally:
         release_db_connection(conn)
 
 
+@invalidates("users")
 def update_user_access(discord_id, new_username, new_access):
     """
     Updates the username and access level for the user with the given Discord ID.
@@ -346,7 +1711,9 @@ def update_user_access(discord_id, new_username, new_access):
         st.error(f"Error updating user: {e}")
     finally:
         release_db_connection(conn)
+        invalidate_user_auth(discord_id)
 
+@invalidates("users")
 def remove_user_by_discord_id(discord_id):
     """
     Removes a user from the user_access table and deletes associated server assignments.
@@ -363,60 +1730,249 @@ def remove_user_by_discord_id(discord_id):
         st.error(f"Error removing user: {e}")
     finally:
         release_db_connection(conn)
+        invalidate_user_auth(discord_id)
 
-def assign_servers_to_user(discord_id, server_list):
+def _apply_server_assignments(cursor, assignments):
     """
-    Assigns the provided list of servers to the user with the given discord_id.
-    Existing assignments are removed first.
-    Assumes you have a table 'user_servers' with columns 'discord_id' and 'server_name'.
+    Brings user_servers in line with assignments ({discord_id: server_ids}) using
+    only the deletes and inserts needed. Rows whose server no longer exists are
+    removed as well. Returns (inserted, deleted) row counts.
     """
+    discord_ids = list(assignments)
+    placeholders = ",".join(["%s"] * len(discord_ids))
+    cursor.execute(
+        f"SELECT discord_id, server_id FROM user_servers WHERE discord_id IN ({placeholders}) FOR UPDATE",
+        tuple(discord_ids)
+    )
+    current = {discord_id: set() for discord_id in discord_ids}
+    for row in cursor.fetchall():
+        current[row["discord_id"]].add(row["server_id"])
+
+    to_delete, to_insert = [], []
+    for discord_id, server_ids in assignments.items():
+        wanted = set(server_ids)
+        to_delete.extend((discord_id, server_id) for server_id in current[discord_id] - wanted if server_id is not None)
+        to_insert.extend((discord_id, server_id) for server_id in wanted - current[discord_id])
+
+    deleted = 0
+    if to_delete:
+        pairs = ",".join(["(%s, %s)"] * len(to_delete))
+        deleted += cursor.execute(
+            f"DELETE FROM user_servers WHERE (discord_id, server_id) IN ({pairs})",
+            tuple(value for pair in to_delete for value in pair)
+        )
+    deleted += cursor.execute(
+        f"DELETE FROM user_servers WHERE discord_id IN ({placeholders}) AND server_id IS NULL", tuple(discord_ids)
+    )
+    if to_insert:
+        # server_name is kept alongside the id for the bot, which still reads it.
+        server_ids = sorted({server_id for _, server_id in to_insert})
+        cursor.execute(
+            f"SELECT id, server_name FROM guild_configs WHERE id IN ({','.join(['%s'] * len(server_ids))})",
+            tuple(server_ids)
+        )
+        names = {row["id"]: row["server_name"] for row in cursor.fetchall()}
+        cursor.executemany(
+            "INSERT INTO user_servers (discord_id, server_id, server_name) VALUES (%s, %s, %s)",
+            [(discord_id, server_id, names[server_id]) for discord_id, server_id in to_insert if server_id in names]
+        )
+    return len(to_insert), deleted
+
+def assign_servers_to_user(discord_id, server_ids):
+    """
+    Assigns the provided list of server_ids to the user with the given discord_id.
+    Only the assignments that changed are inserted or deleted, in one transaction.
+    """
+    bulk_assign_servers({discord_id: server_ids})
+
+@invalidates("users")
+def bulk_assign_servers(assignments):
+    """
+    Sets the server assignments of many users at once, given {discord_id: server_ids}.
+    Every user's changes are applied in a single transaction.
+    """
+    if not assignments:
+        return
     conn = get_db_connection()
     try:
+        conn.begin()
         with conn.cursor() as cursor:
-            # Remove current assignments for the given user
-            cursor.execute("DELETE FROM user_servers WHERE discord_id = %s", (discord_id,))
-            # Insert new assignments
-            for server in server_list:
-                cursor.execute(
-                    "INSERT INTO user_servers (discord_id, server_name) VALUES (%s, %s)",
-                    (discord_id, server)
-                )
-            conn.commit()
-            st.success("Server assignments updated successfully.")
+            _apply_server_assignments(cursor, assignments)
+        conn.commit()
+        st.success("Server assignments updated successfully.")
     except Exception as e:
+        conn.rollback()
         st.error(f"Error updating server assignments: {e}")
     finally:
         release_db_connection(conn)
+        for discord_id in assignments:
+            invalidate_user_auth(discord_id)
 
 def get_assigned_servers_for_user(discord_id):
     """
-    Retrieves the list of server names assigned to the user with the given discord_id.
+    Retrieves the list of server_ids assigned to the user with the given discord_id.
     """
     conn = get_db_connection()
     try:
         with conn.cursor() as cursor:
-            cursor.execute("SELECT server_name FROM user_servers WHERE discord_id = %s", (discord_id,))
+            cursor.execute(
+                "SELECT server_id FROM user_servers WHERE discord_id = %s AND server_id IS NOT NULL", (discord_id,)
+            )
             rows = cursor.fetchall()
-            return [row["server_name"] for row in rows]
+            return [row["server_id"] for row in rows]
     finally:
         release_db_connection(conn)
 
 
-def log_activity(user_id, action, details, before_state, after_state):
+# Separates values packed by GROUP_CONCAT; server names never contain it.
+_GROUP_CONCAT_SEPARATOR = "\x1f"
+
+@cached_read("users", "servers")
+def fetch_users_with_servers(search_term=None):
     """
-    Logs an activity with details including before and after states.
+    Fetches user_access rows together with their server assignments in one query.
+    The optional search_term matches username or Discord ID. Returns a DataFrame
+    with extra "assigned_servers" (server names) and "assigned_server_ids" list columns.
+    """
+    query = f"""
+        SELECT ua.*,
+               GROUP_CONCAT(DISTINCT gc.server_name ORDER BY gc.server_name SEPARATOR '{_GROUP_CONCAT_SEPARATOR}') AS assigned_servers,
+               GROUP_CONCAT(DISTINCT gc.id ORDER BY gc.server_name) AS assigned_server_ids
+        FROM user_access ua
+        LEFT JOIN user_servers us ON us.discord_id = ua.discord_id
+        LEFT JOIN guild_configs gc ON gc.id = us.server_id
     """
+    params = ()
+    if search_term:
+        pattern = f"%{_escape_like(search_term)}%"
+        query += " WHERE ua.username LIKE %s OR ua.discord_id LIKE %s"
+        params = (pattern, pattern)
+    query += " GROUP BY ua.id ORDER BY ua.id"
     conn = get_db_connection()
     try:
         with conn.cursor() as cursor:
-            query = """
-                INSERT INTO activity_logs (user_id, action, details, before_state, after_state, timestamp)
-                VALUES (%s, %s, %s, %s, %s, NOW())
-            """
-            cursor.execute(query, (user_id, action, details, before_state, after_state))
-            conn.commit()
+            cursor.execute("SET SESSION group_concat_max_len = 1048576")
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
     finally:
         release_db_connection(conn)
+    for row in rows:
+        packed = row["assigned_servers"]
+        row["assigned_servers"] = packed.split(_GROUP_CONCAT_SEPARATOR) if packed else []
+        packed = row["assigned_server_ids"]
+        row["assigned_server_ids"] = [int(server_id) for server_id in packed.split(",")] if packed else []
+    return pd.DataFrame(rows)
+
+
+# Actions whose before/after states are account rows, and the flags diffed for them.
+AUDIT_DIFF_ACTIONS = ("Account Edit",)
+AUDIT_DIFF_KEYS = ("alt_flag", "watchlisted", "whitelist", "multiple_devices")
+_AUDIT_DIFF_CACHE_SIZE = 10000
+_audit_diff_cache = {}
+
+def _parse_state(state_json):
+    """Parses a logged state; unparseable states count as {}, non-objects as None."""
+    try:
+        state = json.loads(state_json)
+    except (TypeError, ValueError):
+        return {}
+    return state if isinstance(state, dict) else None
+
+def audit_state_diff(before, after):
+    """
+    Describes the flag changes between two account states as a pair of strings,
+    e.g. ("Alt_flag - No", "Alt_flag - Yes").
+    """
+    if not isinstance(before, dict) or not isinstance(after, dict):
+        return "", ""
+    diffs_before, diffs_after = [], []
+    for key in AUDIT_DIFF_KEYS:
+        if before.get(key) != after.get(key):
+            diffs_before.append(f"{key.capitalize()} - {'Yes' if before.get(key) else 'No'}")
+            diffs_after.append(f"{key.capitalize()} - {'Yes' if after.get(key) else 'No'}")
+    return ", ".join(diffs_before), ", ".join(diffs_after)
+
+def _audit_diffs_batch(before_states, after_states):
+    """Column-wise audit_state_diff over equally long lists of parsed states."""
+    valid = np.array([isinstance(b, dict) and isinstance(a, dict) for b, a in zip(before_states, after_states)], dtype=bool)
+    before = pd.DataFrame.from_records(
+        [b if ok else {} for b, ok in zip(before_states, valid)], columns=list(AUDIT_DIFF_KEYS)
+    ).astype(object)
+    after = pd.DataFrame.from_records(
+        [a if ok else {} for a, ok in zip(after_states, valid)], columns=list(AUDIT_DIFF_KEYS)
+    ).astype(object)
+    changed = before.ne(after) & ~(before.isna() & after.isna()) & valid[:, None]
+    before_yes = before.fillna(False).astype(bool)
+    after_yes = after.fillna(False).astype(bool)
+
+    before_parts, after_parts = [], []
+    for key in AUDIT_DIFF_KEYS:
+        label = f"{key.capitalize()} - "
+        before_parts.append(np.where(changed[key], np.where(before_yes[key], label + "Yes", label + "No"), ""))
+        after_parts.append(np.where(changed[key], np.where(after_yes[key], label + "Yes", label + "No"), ""))
+    join = lambda parts: [", ".join(part for part in row if part) for row in zip(*parts)]
+    return join(before_parts), join(after_parts)
+
+def apply_audit_diffs(df_logs):
+    """
+    Replaces before_state/after_state with the flag diff for every diffable row of a
+    page of activity logs. Diffs stored at write time are used as-is; older rows are
+    parsed once, in one batch, and cached by log id for later reruns.
+    """
+    if df_logs.empty:
+        return df_logs
+    df_logs = df_logs.copy()
+    mask = df_logs["action"].isin(AUDIT_DIFF_ACTIONS)
+    if "before_diff" in df_logs:
+        stored = mask & df_logs["before_diff"].notna()
+        df_logs.loc[stored, "before_state"] = df_logs.loc[stored, "before_diff"]
+        df_logs.loc[stored, "after_state"] = df_logs.loc[stored, "after_diff"]
+        df_logs = df_logs.drop(columns=["before_diff", "after_diff"])
+        mask &= ~stored
+
+    if not mask.any():
+        return df_logs
+    # Look the page up once: a cache cleared while filling it must not lose the rows found.
+    ids = df_logs.loc[mask, "id"].tolist()
+    diffs_by_id = {log_id: _audit_diff_cache[log_id] for log_id in ids if log_id in _audit_diff_cache}
+    pending = df_logs[mask & ~df_logs["id"].isin(list(diffs_by_id))]
+    if not pending.empty:
+        diffs = _audit_diffs_batch(
+            [_parse_state(state) for state in pending["before_state"]],
+            [_parse_state(state) for state in pending["after_state"]],
+        )
+        computed = dict(zip(pending["id"], zip(*diffs)))
+        diffs_by_id.update(computed)
+        if len(_audit_diff_cache) + len(computed) > _AUDIT_DIFF_CACHE_SIZE:
+            _audit_diff_cache.clear()
+        _audit_diff_cache.update(computed)
+
+    df_logs.loc[mask, "before_state"] = [diffs_by_id[log_id][0] for log_id in ids]
+    df_logs.loc[mask, "after_state"] = [diffs_by_id[log_id][1] for log_id in ids]
+    return df_logs
+
+def log_activity(user_id, action, details, before_state, after_state):
+    """
+    Logs an activity with details including before and after states.
+    The row is queued on the background audit writer, so this returns immediately.
+    It is timestamped now, on the database clock, rather than when the batch is written.
+    For account edits the flag diff is computed here once, so reads never parse JSON.
+    """
+    before_diff = after_diff = None
+    if action in AUDIT_DIFF_ACTIONS:
+        before_diff, after_diff = audit_state_diff(_parse_state(before_state), _parse_state(after_state))
+    writer = get_audit_writer()
+    writer.submit({
+        "event_id": uuid.uuid4().hex,
+        "user_id": user_id,
+        "action": action,
+        "details": details,
+        "before_state": before_state,
+        "after_state": after_state,
+        "before_diff": before_diff,
+        "after_diff": after_diff,
+        "timestamp": writer.now().strftime("%Y-%m-%d %H:%M:%S"),
+    })
 
 
 def fetch_activity_logs():
@@ -430,7 +1986,71 @@ def fetch_activity_logs():
         release_db_connection(conn)
     return logs
 
+ACTIVITY_LOGS_PAGE_SIZE = 100
 
+def fetch_activity_logs_page(start=None, end=None, user_id=None, action=None, search_term=None,
+                             before=None, limit=ACTIVITY_LOGS_PAGE_SIZE):
+    """
+    Fetches one page of activity logs, newest first.
+    start/end bound the timestamp (end is exclusive), user_id and action must match
+    exactly, and search_term is looked up in details through its FULLTEXT index.
+    Pass the (timestamp, id) of the last row of the previous page as before to get
+    the next page.
+    """
+    clauses, params = [], []
+    if start is not None:
+        clauses.append("timestamp >= %s")
+        params.append(start)
+    if end is not None:
+        clauses.append("timestamp < %s")
+        params.append(end)
+    if user_id:
+        clauses.append("user_id = %s")
+        params.append(user_id)
+    if action:
+        clauses.append("action = %s")
+        params.append(action)
+    term = (search_term or "").strip()
+    if term:
+        if len(term) >= SEARCH_NGRAM_SIZE:
+            clauses.append("MATCH(details) AGAINST (%s IN BOOLEAN MODE)")
+            params.append('"' + term.replace('"', " ") + '"')
+        else:
+            clauses.append("details LIKE %s")
+            params.append(f"%{_escape_like(term)}%")
+    if before is not None:
+        before_timestamp, before_id = before
+        clauses.append("(timestamp < %s OR (timestamp = %s AND id < %s))")
+        params.extend([before_timestamp, before_timestamp, before_id])
+
+    query = "SELECT * FROM activity_logs"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY timestamp DESC, id DESC LIMIT %s"
+    params.append(limit)
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, tuple(params))
+            logs = cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+    return logs
+
+@cached_read("activity_logs")
+def fetch_activity_log_actions():
+    """Fetches the distinct action names in activity_logs (an index-only scan)."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT DISTINCT action FROM activity_logs ORDER BY action")
+            rows = cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+    return [row["action"] for row in rows if row["action"]]
+
+
+@invalidates("feedback")
 def add_user_feedback(user_id, subject, message, category, priority):
     conn = get_db_connection()
     try:
@@ -445,6 +2065,7 @@ def add_user_feedback(user_id, subject, message, category, priority):
         release_db_connection(conn)
 
 
+@cached_read("feedback")
 def fetch_feedback():
     """Fetch all feedback entries."""
     conn = get_db_connection()
@@ -456,15 +2077,16 @@ def fetch_feedback():
         release_db_connection(conn)
     return feedback
 
-def fetch_alt_accounts(server_name=None):
-    """Fetches accounts flagged as alt accounts, optionally filtering by server."""
+@cached_read("players", ttl=READ_CACHE_PLAYER_TTL)
+def fetch_alt_accounts(server_id=None):
+    """Fetches accounts flagged as alt accounts, optionally filtering by server_id."""
     conn = get_db_connection()
     try:
         with conn.cursor() as cursor:
             query = "SELECT * FROM players WHERE alt_flag = TRUE"
-            if server_name and server_name != "All":
-                query += " AND LOWER(TRIM(server_name)) LIKE CONCAT('%%', LOWER(TRIM(%s)), '%%')"
-                cursor.execute(query, (server_name,))
+            if server_id is not None:
+                query += " AND server_id = %s"
+                cursor.execute(query, (server_id,))
             else:
                 cursor.execute(query)
             rows = cursor.fetchall()
@@ -484,6 +2106,184 @@ def fetch_all_accounts():
         release_db_connection(conn)
     return rows
 
+ACCOUNT_FLAG_COLUMNS = ("alt_flag", "watchlisted", "whitelist", "multiple_devices")
+ACCOUNTS_PAGE_SIZE = 50
+
+def _escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _account_filters(allowed_servers, search_term=None, flags=(), min_score=None):
+    """
+    Builds the WHERE conditions shared by fetch_accounts_page and count_accounts.
+    allowed_servers is a collection of server_ids; None means unrestricted and an
+    empty collection matches nothing. min_score keeps accounts whose alt score is
+    at least that high.
+    """
+    clauses, params = [], []
+    if allowed_servers is not None:
+        allowed_servers = list(allowed_servers)
+        if not allowed_servers:
+            clauses.append("FALSE")
+        else:
+            clauses.append(f"server_id IN ({','.join(['%s'] * len(allowed_servers))})")
+            params.extend(allowed_servers)
+    if search_term:
+        pattern = f"%{_escape_like(search_term)}%"
+        clauses.append("(gamertag LIKE %s OR device_id LIKE %s)")
+        params.extend([pattern, pattern])
+    for flag in flags:
+        if flag not in ACCOUNT_FLAG_COLUMNS:
+            raise ValueError(f"Unknown account flag: {flag}")
+        clauses.append(f"{flag} = TRUE")
+    if min_score:
+        clauses.append("players.gamertag_id IN (SELECT gamertag_id FROM alt_scores WHERE score >= %s)")
+        params.append(min_score)
+    return clauses, params
+
+# Adds each account's alt score (NULL until it has been scored) to a players query.
+_ALT_SCORE_JOIN = " LEFT JOIN alt_scores ON alt_scores.gamertag_id = players.gamertag_id"
+
+@cached_read("players", ttl=READ_CACHE_PLAYER_TTL)
+def fetch_accounts_page(allowed_servers, search_term=None, flags=(), after_id=None, limit=ACCOUNTS_PAGE_SIZE,
+                        min_score=None, newest_first=False):
+    """
+    Fetches one page of players in ascending id order (descending with
+    newest_first), filtered in SQL, with an alt_score column. Pass the last id of
+    the previous page as after_id to get the next page.
+    """
+    clauses, params = _account_filters(allowed_servers, search_term, flags, min_score)
+    if after_id is not None:
+        clauses.append("players.id < %s" if newest_first else "players.id > %s")
+        params.append(after_id)
+    query = "SELECT players.*, alt_scores.score AS alt_score FROM players" + _ALT_SCORE_JOIN
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += f" ORDER BY players.id {'DESC' if newest_first else 'ASC'} LIMIT %s"
+    params.append(limit)
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, tuple(params))
+            rows = cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+    return rows
+
+@cached_read("players", ttl=READ_CACHE_PLAYER_TTL)
+def fetch_accounts_by_score(allowed_servers, flags=(), min_score=None, after=None, limit=ACCOUNTS_PAGE_SIZE):
+    """
+    Like fetch_accounts_page, but only scored accounts, highest alt score first.
+    Pass the (alt_score, id) of the previous page's last row as after.
+    """
+    clauses, params = _account_filters(allowed_servers, flags=flags, min_score=min_score)
+    if after is not None:
+        clauses.append("(alt_scores.score < %s OR (alt_scores.score = %s AND players.id < %s))")
+        params.extend([after[0], after[0], after[1]])
+    query = (
+        "SELECT players.*, alt_scores.score AS alt_score FROM players"
+        " JOIN alt_scores ON alt_scores.gamertag_id = players.gamertag_id"
+    )
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY alt_scores.score DESC, players.id DESC LIMIT %s"
+    params.append(limit)
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, tuple(params))
+            rows = cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+    return rows
+
+@cached_read("players", ttl=READ_CACHE_PLAYER_TTL)
+def fetch_alt_scores(gamertag_ids):
+    """{gamertag_id: alt score} for the given accounts; unscored accounts are left out."""
+    gamertag_ids = list(dict.fromkeys(gamertag_ids))
+    if not gamertag_ids:
+        return {}
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT gamertag_id, score FROM alt_scores WHERE gamertag_id IN ({','.join(['%s'] * len(gamertag_ids))})",
+                tuple(gamertag_ids)
+            )
+            return {row["gamertag_id"]: row["score"] for row in cursor.fetchall()}
+    finally:
+        release_db_connection(conn)
+
+@cached_read("players", ttl=READ_CACHE_PLAYER_TTL)
+def count_accounts(allowed_servers, search_term=None, flags=(), min_score=None, scored_only=False):
+    """
+    Counts the players matching the same filters as fetch_accounts_page, or with
+    scored_only those fetch_accounts_by_score lists (scored accounts only).
+    """
+    clauses, params = _account_filters(allowed_servers, search_term, flags, min_score)
+    query = "SELECT COUNT(*) AS total FROM players"
+    if scored_only:
+        query += " JOIN alt_scores ON alt_scores.gamertag_id = players.gamertag_id"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, tuple(params))
+            return cursor.fetchone()["total"]
+    finally:
+        release_db_connection(conn)
+
+# Matches the server's ngram_token_size; shorter terms can only be prefix-searched.
+SEARCH_NGRAM_SIZE = 2
+SEARCH_LIMIT = 100
+
+@cached_read("players", ttl=READ_CACHE_PLAYER_TTL)
+def search_accounts(search_term, allowed_servers=None, flags=(), limit=SEARCH_LIMIT, min_score=None):
+    """
+    Ranked gamertag / device ID search: exact matches first, then prefix matches
+    (index ranges on the lowercase columns), then substring matches found through
+    the ngram FULLTEXT index. Ties go to the newest account. Each row carries its
+    search_rank (3 exact, 2 prefix, 1 substring).
+    """
+    term = (search_term or "").strip().lower()
+    if not term:
+        return []
+    prefix = _escape_like(term) + "%"
+    branches = [
+        "SELECT id, 2 + (gamertag_lc = %s) AS score FROM players WHERE gamertag_lc LIKE %s",
+        "SELECT id, 2 + (device_id_lc = %s) AS score FROM players WHERE device_id_lc LIKE %s",
+    ]
+    params = [term, prefix, term, prefix]
+    if len(term) >= SEARCH_NGRAM_SIZE:
+        branches.append(
+            "SELECT id, 1 AS score FROM players WHERE MATCH(gamertag, device_id) AGAINST (%s IN BOOLEAN MODE)"
+        )
+        params.append('"' + term.replace('"', " ") + '"')
+
+    clauses, filter_params = _account_filters(allowed_servers, flags=flags, min_score=min_score)
+    query = f"""
+        SELECT players.*, alt_scores.score AS alt_score, hits.search_rank
+        FROM (
+            SELECT id, MAX(score) AS search_rank
+            FROM ({" UNION ALL ".join(branches)}) AS matches
+            GROUP BY id
+        ) AS hits
+        JOIN players ON players.id = hits.id
+        {_ALT_SCORE_JOIN}
+    """
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY hits.search_rank DESC, players.id DESC LIMIT %s"
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, tuple(params + filter_params + [limit]))
+            rows = cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+    return rows
+
+@invalidates("players")
 def update_account_details(account_id, new_gamertag, alt_flag, watchlisted, whitelist, multiple_devices):
     """Updates account details in the players table using the 'gamertag' column."""
     conn = get_db_connection()
@@ -515,3 +2315,288 @@ def fetch_main_account_by_device(device_id):
     finally:
         release_db_connection(conn)
     return main_account
+
+def fetch_main_accounts_by_devices(device_ids, memo=None):
+    """
+    Batched fetch_main_account_by_device: resolves every device_id in one query and
+    returns {device_id: main account row or None}. Pass the same memo dict for the
+    whole rerun so device IDs that were already resolved are never queried again.
+    """
+    memo = {} if memo is None else memo
+    missing = [device_id for device_id in dict.fromkeys(device_ids) if device_id not in memo]
+    if missing:
+        placeholders = ",".join(["%s"] * len(missing))
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                query = f"""
+                    SELECT p.*
+                    FROM players p
+                    JOIN (
+                        SELECT device_id, MIN(id) AS id
+                        FROM players
+                        WHERE device_id IN ({placeholders}) AND alt_flag = FALSE
+                        GROUP BY device_id
+                    ) AS main ON main.id = p.id
+                """
+                cursor.execute(query, tuple(missing))
+                found = {row["device_id"]: row for row in cursor.fetchall()}
+        finally:
+            release_db_connection(conn)
+        for device_id in missing:
+            memo[device_id] = found.get(device_id)
+    return {device_id: memo[device_id] for device_id in device_ids}
+
+ALT_GROUPS_PAGE_SIZE = 10
+
+def _alt_group_filters(allowed_servers, server_id=None):
+    clauses, params = _account_filters(allowed_servers, flags=("alt_flag",))
+    clauses.append("device_id IS NOT NULL AND device_id <> ''")
+    if server_id is not None:
+        clauses.append("server_id = %s")
+        params.append(server_id)
+    return " WHERE " + " AND ".join(clauses), tuple(params)
+
+# A device group's alt score is that of its most alt-like account.
+_ALT_GROUPS_QUERY = """
+    SELECT device_id, MAX(players.id) AS max_id, MAX(alt_scores.score) AS alt_score
+    FROM players LEFT JOIN alt_scores ON alt_scores.gamertag_id = players.gamertag_id{where}
+    GROUP BY device_id
+"""
+
+def _alt_groups_having(min_score):
+    return (" HAVING alt_score >= %s", (min_score,)) if min_score else ("", ())
+
+@cached_read("players", ttl=READ_CACHE_MONITOR_TTL)
+def count_alt_device_groups(allowed_servers, server_id=None, min_score=None):
+    """Counts the device groups that fetch_alt_device_groups pages through."""
+    where, params = _alt_group_filters(allowed_servers, server_id)
+    having, having_params = _alt_groups_having(min_score)
+    if having:
+        query = f"SELECT COUNT(*) AS total FROM ({_ALT_GROUPS_QUERY.format(where=where)}{having}) AS alt_groups"
+    else:
+        query = f"SELECT COUNT(DISTINCT device_id) AS total FROM players{where}"
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, params + having_params)
+            return cursor.fetchone()["total"]
+    finally:
+        release_db_connection(conn)
+
+@cached_read("players", ttl=READ_CACHE_MONITOR_TTL)
+def fetch_alt_device_groups(allowed_servers, server_id=None, page=1, per_page=ALT_GROUPS_PAGE_SIZE,
+                            min_score=None, by_score=False):
+    """
+    Fetches one page of flagged alt accounts grouped by device_id, restricted to the
+    allowed server_ids (and to server_id unless it is None). Groups are ordered by
+    their highest player id, newest first, or by_score by their alt score; min_score
+    drops groups scoring lower. Returns a list of (device_id, [accounts], alt score).
+    """
+    where, params = _alt_group_filters(allowed_servers, server_id)
+    having, having_params = _alt_groups_having(min_score)
+    order = "alt_score DESC, max_id DESC" if by_score else "max_id DESC"
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"{_ALT_GROUPS_QUERY.format(where=where)}{having} ORDER BY {order} LIMIT %s OFFSET %s",
+                params + having_params + (per_page, (page - 1) * per_page)
+            )
+            groups = cursor.fetchall()
+            device_ids = [row["device_id"] for row in groups]
+            members = {device_id: [] for device_id in device_ids}
+            if device_ids:
+                placeholders = ",".join(["%s"] * len(device_ids))
+                cursor.execute(
+                    f"SELECT * FROM players{where} AND device_id IN ({placeholders}) ORDER BY id ASC",
+                    params + tuple(device_ids)
+                )
+                for row in cursor.fetchall():
+                    members[row["device_id"]].append(row)
+    finally:
+        release_db_connection(conn)
+    return [(row["device_id"], members[row["device_id"]], row["alt_score"]) for row in groups]
+
+# ---------------------------------------------------------------------------
+# Real-Time Monitor Delta Sync
+# ---------------------------------------------------------------------------
+# Changed players are re-read from this many seconds before the previous sync, so
+# rows committed late by transactions that started before it are not missed.
+MONITOR_DELTA_OVERLAP = 5
+
+def fetch_monitor_marks():
+    """The current high-water marks: max players.id, max player_history.id and the database clock."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT (SELECT COALESCE(MAX(id), 0) FROM players) AS player_id,
+                       (SELECT COALESCE(MAX(id), 0) FROM player_history) AS history_id,
+                       NOW(6) AS synced_at
+                """
+            )
+            return cursor.fetchone()
+    finally:
+        release_db_connection(conn)
+
+def fetch_changed_players(after_id, since):
+    """The ids of players inserted after after_id or modified at or after since."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "(SELECT id FROM players WHERE id > %s) UNION (SELECT id FROM players WHERE updated_at >= %s)",
+                (after_id, since)
+            )
+            return cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+
+def fetch_history_counts_between(after_id, until_id, server_id=None):
+    """Daily counts of the player_history rows with after_id < id <= until_id."""
+    query = "SELECT DATE(timestamp) AS date, COUNT(*) AS count FROM player_history WHERE id > %s AND id <= %s"
+    params = (after_id, until_id)
+    if server_id is not None:
+        query += " AND server_id = %s"
+        params += (server_id,)
+    query += " GROUP BY DATE(timestamp)"
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+
+def load_monitor_state(server_id=None):
+    """
+    Full sync for the Real-Time Monitoring page: loads the stats and the trend
+    counts, and records the high-water marks that sync_monitor_state() continues
+    from. The state is shared by every session and never modified once published. The alt groups themselves are paged in SQL (fetch_alt_device_groups).
+    """
+    # Marks first, so anything written while loading is picked up by the next delta.
+    marks = fetch_monitor_marks()
+    df_trend = fetch_trend_data(server_id, until_id=marks["history_id"])
+    return {
+        "server_id": server_id,
+        "marks": marks,
+        "stats": fetch_stats(server_id),
+        "trend": {row["date"]: int(row["count"]) for row in df_trend.to_dict("records")},
+        "last_changes": 0,
+    }
+
+def sync_monitor_state(state):
+    """
+    Delta sync: adds the player_history rows written since the previous sync to the
+    trend, and re-reads the counters (and drops cached player reads, including the
+    alt group pages) only if players or history changed. Returns the number of
+    changed rows.
+    """
+    previous = state["marks"]
+    marks = fetch_monitor_marks()
+    since = previous["synced_at"] - timedelta(seconds=MONITOR_DELTA_OVERLAP)
+    changed = fetch_changed_players(previous["player_id"], since)
+    changes = len(changed)
+    if marks["history_id"] > previous["history_id"]:
+        rows = fetch_history_counts_between(previous["history_id"], marks["history_id"], state["server_id"])
+        for row in rows:
+            state["trend"][row["date"]] = state["trend"].get(row["date"], 0) + int(row["count"])
+        changes += sum(int(row["count"]) for row in rows)
+    if changes:
+        # The bot's writes cannot invalidate cached player reads; finding them here does.
+        invalidate_cache("players")
+        state["stats"] = fetch_stats(state["server_id"])
+    state["marks"] = marks
+    state["last_changes"] = changes
+    return changes
+
+# ---------------------------------------------------------------------------
+# Shared Snapshots
+# ---------------------------------------------------------------------------
+
+
+class SnapshotService:
+    """
+    Process-wide query results shared by every session. get() returns the value
+    computed for a key within max_age seconds; on a miss exactly one caller
+    computes it (single-flight) while concurrent callers for the same key wait
+    for that result instead of running the query themselves.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}   # key -> (value, computed_at)
+        self._inflight = {}  # key -> {"done": Event, "value", "error"}
+
+    def get(self, key, compute, max_age):
+        """
+        Returns the snapshot for key, calling compute(previous) to refresh it when it
+        is missing or stale. previous is the last value (or None), so computations
+        can update incrementally; they must not modify it in place.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[1] < max_age:
+                return entry[0]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = {"done": threading.Event(), "value": None, "error": None}
+        if not leader:
+            flight["done"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["value"]
+        try:
+            value = compute(entry[0] if entry else None)
+            with self._lock:
+                self._entries[key] = (value, time.monotonic())
+            flight["value"] = value
+            return value
+        except Exception as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight["done"].set()
+
+    def invalidate(self, key=None):
+        """Drops the snapshot for key, or every snapshot when key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+_snapshots = SnapshotService()
+
+def get_snapshot_service():
+    return _snapshots
+
+def _refresh_monitor_snapshot(server_id, previous):
+    if previous is None:
+        return load_monitor_state(server_id)
+    # Readers may still hold the previous state, so sync a copy.
+    state = dict(previous)
+    state["trend"] = previous["trend"].copy()
+    sync_monitor_state(state)
+    return state
+
+def get_monitor_snapshot(server_id=None, resync=False):
+    """
+    The Real-Time Monitoring state for one server (None for all), shared by every
+    session: loaded once, then delta-synced at most once per MONITOR_REFRESH_INTERVAL
+    however many sessions are watching. resync=True forces a full load.
+    """
+    key = ("monitor", server_id)
+    if resync:
+        _snapshots.invalidate(key)
+        invalidate_cache("players")
+    return _snapshots.get(
+        key, lambda previous: _refresh_monitor_snapshot(server_id, previous), MONITOR_REFRESH_INTERVAL
+    )
+
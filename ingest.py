@@ -0,0 +1,362 @@
+# ingest.py
+"""
+.RPT log ingestion: tails each server's DayZ logs and records every player
+sighting in players / player_history.
+
+Logs are read from RPT_LOG_DIR/<nitrado_service_id>/, the local stand-in for the
+server's Nitrado log folder. Every file has a checkpoint in rpt_checkpoints (byte
+offset, the first bytes of the file and the last log time seen), so a run reads
+only the bytes appended since the previous one. A file that shrank or whose
+first bytes changed was rotated and is read again from the start.
+
+Lines are matched with one compiled bytes regex over whole chunks, and each
+chunk's sightings, player upserts and checkpoint are written in one transaction
+with multi-row statements.
+"""
+import os
+import re
+import time
+from datetime import datetime, time as dt_time, timedelta
+
+import pymysql
+import streamlit as st
+
+from common import (
+    TREND_ROLLUP,
+    _server_id_for_name,
+    get_db_connection,
+    release_db_connection,
+    invalidate_cache,
+    logger,
+)
+from session_overlap import OVERLAP_ROLLUP
+
+RPT_LOG_DIR = st.secrets.get("RPT_LOG_DIR") or os.getenv("RPT_LOG_DIR") or "logs"
+# One sighting per match. Needs the named groups gamertag, gamertag_id and device_id;
+# an optional time group (HH:MM:SS) dates the sighting, otherwise it is dated now.
+DEFAULT_RPT_LINE_PATTERN = (
+    r'^[ \t]*(?P<time>\d{1,2}:\d{2}:\d{2})[^\n]*?Player "(?P<gamertag>[^"\n]+)"'
+    r'[^\n]*?\bid=(?P<gamertag_id>[^\s,)]+)[^\n]*?\bdeviceId=(?P<device_id>[^\s,)]+)'
+)
+RPT_LINE_PATTERN = (
+    st.secrets.get("RPT_LINE_PATTERN") or os.getenv("RPT_LINE_PATTERN") or DEFAULT_RPT_LINE_PATTERN
+)
+RPT_LINE_RE = re.compile(RPT_LINE_PATTERN.encode(), re.MULTILINE)
+# DayZ names its logs after the server start, e.g. DayZServer_X1_x64_2024_05_01_120000123.RPT.
+RPT_FILE_START_RE = re.compile(r"(\d{4})_(\d{2})_(\d{2})_(\d{2})(\d{2})(\d{2})")
+# Bytes read (and committed) at a time; a run keeps reading until the end of every file.
+RPT_READ_CHUNK = int(st.secrets.get("RPT_READ_CHUNK") or os.getenv("RPT_READ_CHUNK") or 8 * 1024 * 1024)
+# Leading bytes kept per file to recognise it after a rotation.
+RPT_HEAD_BYTES = 64
+# A log time this far before the previous one means the log passed midnight.
+RPT_ROLLOVER = 12 * 3600
+QUERY_CHUNK_SIZE = 1000
+WRITE_BATCH_SIZE = 2000
+
+
+def _log_start(path):
+    """When a log file starts: from its DayZ file name, else midnight of its modification day."""
+    match = RPT_FILE_START_RE.search(os.path.basename(path))
+    if match:
+        try:
+            return datetime(*map(int, match.groups()))
+        except ValueError:
+            pass
+    return datetime.combine(datetime.fromtimestamp(os.path.getmtime(path)).date(), dt_time())
+
+
+def parse_sightings(data, log_time):
+    """
+    Parses the complete lines in data (bytes). Returns ([(timestamp, gamertag,
+    gamertag_id, device_id)], log_time), where log_time is the last timestamp
+    seen; pass it back in for the next chunk of the same file so the date carries
+    over midnight.
+    """
+    sightings = []
+    day = log_time.date()
+    last_seconds = log_time.hour * 3600 + log_time.minute * 60 + log_time.second
+    timed = "time" in RPT_LINE_RE.groupindex
+    for match in RPT_LINE_RE.finditer(data):
+        gamertag, gamertag_id, device_id = match.group("gamertag", "gamertag_id", "device_id")
+        if timed:
+            hours, minutes, seconds = match.group("time").split(b":")
+            seconds = int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+            if seconds + RPT_ROLLOVER < last_seconds:
+                day += timedelta(days=1)
+            last_seconds = seconds
+            timestamp = datetime.combine(day, dt_time()) + timedelta(seconds=seconds)
+        else:
+            timestamp = datetime.now().replace(microsecond=0)
+        sightings.append((
+            timestamp,
+            gamertag.decode("utf-8", "replace").strip(),
+            gamertag_id.decode("utf-8", "replace"),
+            device_id.decode("utf-8", "replace"),
+        ))
+    if sightings:
+        log_time = sightings[-1][0]
+    return sightings, log_time
+
+
+def fetch_ingest_targets(service_id=None):
+    """
+    The servers to ingest: one per configured nitrado_service_id, with the
+    server_id and server_name its rows are stored under.
+    """
+    query = f"""
+        SELECT t.service_id, t.server_name, {_server_id_for_name("t.server_name")} AS server_id
+        FROM (
+            SELECT nitrado_service_id AS service_id, MIN(server_name) AS server_name
+            FROM guild_configs
+            WHERE nitrado_service_id IS NOT NULL AND nitrado_service_id <> ''
+            GROUP BY nitrado_service_id
+        ) AS t
+    """
+    params = ()
+    if service_id is not None:
+        query += " WHERE t.service_id = %s"
+        params = (service_id,)
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query, params)
+            return [dict(row, service_id=str(row["service_id"])) for row in cursor.fetchall()]
+    finally:
+        release_db_connection(conn)
+
+
+def _fetch_checkpoints(service_id):
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT file_name, byte_offset, head, log_time FROM rpt_checkpoints WHERE service_id = %s",
+                (service_id,)
+            )
+            return {row["file_name"]: row for row in cursor.fetchall()}
+    finally:
+        release_db_connection(conn)
+
+
+def _select_in(cursor, query, values, params=()):
+    """Runs query once per chunk of values, filling its {} with the placeholders."""
+    rows = []
+    for offset in range(0, len(values), QUERY_CHUNK_SIZE):
+        chunk = values[offset:offset + QUERY_CHUNK_SIZE]
+        cursor.execute(query.format(",".join(["%s"] * len(chunk))), tuple(params) + tuple(chunk))
+        rows.extend(cursor.fetchall())
+    return rows
+
+
+def _insert_rows(cursor, statement, rows, suffix=""):
+    """Inserts rows with multi-row INSERT statements of up to WRITE_BATCH_SIZE rows."""
+    placeholders = "(" + ", ".join(["%s"] * len(rows[0])) + ")" if rows else ""
+    for offset in range(0, len(rows), WRITE_BATCH_SIZE):
+        batch = rows[offset:offset + WRITE_BATCH_SIZE]
+        cursor.execute(
+            statement + ",".join([placeholders] * len(batch)) + suffix,
+            tuple(value for row in batch for value in row)
+        )
+
+
+def _store_sightings(cursor, target, sightings):
+    """
+    Appends the sightings to player_history and upserts one players row per account
+    on the server. New accounts on a device another account already uses are
+    flagged as alts; accounts seen on more than one device get multiple_devices.
+    """
+    server_id, server_name = target["server_id"], target["server_name"]
+    accounts = {}
+    for timestamp, gamertag, gamertag_id, device_id in sightings:
+        account = accounts.get(gamertag_id)
+        if account is None:
+            accounts[gamertag_id] = {"gamertag": gamertag, "device_id": device_id, "first_seen": timestamp,
+                                     "last_seen": timestamp, "devices": {device_id}}
+            continue
+        account["devices"].add(device_id)
+        account["first_seen"] = min(account["first_seen"], timestamp)
+        if timestamp >= account["last_seen"]:
+            account.update(gamertag=gamertag, device_id=device_id, last_seen=timestamp)
+
+    gamertag_ids = list(accounts)
+    existing = dict(_select_in(
+        cursor,
+        "SELECT gamertag_id, MAX(id) FROM players WHERE server_id = %s AND gamertag_id IN ({}) GROUP BY gamertag_id",
+        gamertag_ids, (server_id,)
+    ))
+    device_accounts = {}
+    for device_id, gamertag_id in _select_in(
+        cursor,
+        "SELECT DISTINCT device_id, gamertag_id FROM players WHERE device_id IN ({})",
+        list({device for account in accounts.values() for device in account["devices"]})
+    ):
+        device_accounts.setdefault(device_id, set()).add(gamertag_id)
+
+    rows = []
+    for gamertag_id, account in sorted(accounts.items(), key=lambda item: item[1]["first_seen"]):
+        alt_flag = False
+        if gamertag_id not in existing:
+            alt_flag = any(device_accounts.get(device, set()) - {gamertag_id} for device in account["devices"])
+        for device in account["devices"]:
+            device_accounts.setdefault(device, set()).add(gamertag_id)
+        rows.append((
+            existing.get(gamertag_id), account["gamertag"], gamertag_id, account["device_id"], server_name, server_id,
+            account["first_seen"], account["last_seen"], alt_flag, len(account["devices"]) > 1,
+        ))
+    # Existing accounts are upserted on their primary key; the others get a new id.
+    # Assignments run left to right, so last_seen is updated after the columns that compare against it.
+    _insert_rows(
+        cursor,
+        """
+        INSERT INTO players (id, gamertag, gamertag_id, device_id, server_name, server_id,
+            first_seen, last_seen, alt_flag, multiple_devices) VALUES
+        """,
+        rows,
+        """
+        ON DUPLICATE KEY UPDATE
+            multiple_devices = multiple_devices OR VALUES(multiple_devices) OR NOT (device_id <=> VALUES(device_id)),
+            gamertag = IF(VALUES(last_seen) >= last_seen, VALUES(gamertag), gamertag),
+            device_id = IF(VALUES(last_seen) >= last_seen, VALUES(device_id), device_id),
+            first_seen = LEAST(first_seen, VALUES(first_seen)),
+            last_seen = GREATEST(last_seen, VALUES(last_seen))
+        """
+    )
+    _insert_rows(
+        cursor,
+        "INSERT INTO player_history (gamertag_id, device_id, server_name, server_id, timestamp) VALUES ",
+        [(gamertag_id, device_id, server_name, server_id, timestamp)
+         for timestamp, _, gamertag_id, device_id in sightings]
+    )
+    _update_rollups(cursor, server_id, sightings)
+
+
+def _update_rollups(cursor, server_id, sightings):
+    """
+    Sightings can be dated on days the rollups already treat as complete (a run
+    past midnight, a backoff, a re-read rotated log). Such days are added to
+    player_history_daily here, and the session_overlaps mark is moved back so
+    the next refresh redoes them.
+    """
+    days = {}
+    for timestamp, *_ in sightings:
+        days[timestamp.date()] = days.get(timestamp.date(), 0) + 1
+    # Shares the row refresh_trend_rollup locks for update: a rollup either finishes
+    # before this reads the mark, or waits for this transaction and counts the rows itself.
+    cursor.execute("SELECT rolled_up_to FROM rollup_state WHERE name = %s LOCK IN SHARE MODE", (TREND_ROLLUP,))
+    state = cursor.fetchone()
+    rolled_up_to = state[0] if state else None
+    late = [(server_id or 0, day, count) for day, count in sorted(days.items())
+            if rolled_up_to is not None and day <= rolled_up_to]
+    if late:
+        _insert_rows(
+            cursor,
+            "INSERT INTO player_history_daily (server_id, day, events) VALUES ",
+            late,
+            " ON DUPLICATE KEY UPDATE events = events + VALUES(events)"
+        )
+    cursor.execute(
+        "UPDATE rollup_state SET rolled_up_to = %s WHERE name = %s AND rolled_up_to >= %s",
+        (min(days) - timedelta(days=1), OVERLAP_ROLLUP, min(days))
+    )
+
+
+def _ingest_file(target, path, checkpoint, deadline=None):
+    """
+    Reads the new bytes of one log file, stopping between chunks once the
+    time.monotonic() deadline has passed. Returns (sightings stored, bytes read,
+    last log time).
+    """
+    file_name = os.path.basename(path)
+    size = os.path.getsize(path)
+    with open(path, "rb") as handle:
+        head = handle.read(RPT_HEAD_BYTES)
+        offset, log_time = 0, None
+        if checkpoint and size >= checkpoint["byte_offset"] and head.startswith(bytes(checkpoint["head"] or b"")):
+            offset, log_time = checkpoint["byte_offset"], checkpoint["log_time"]
+        elif checkpoint:
+            logger.info("Log %s/%s was rotated; reading it from the start", target["service_id"], file_name)
+        log_time = log_time or _log_start(path)
+
+        stored = read = 0
+        handle.seek(offset)
+        while offset < size:
+            if deadline is not None and time.monotonic() >= deadline:
+                break  # the checkpoint is saved; the next run continues from here
+            data = handle.read(min(RPT_READ_CHUNK, size - offset))
+            if not data:
+                break
+            end = data.rfind(b"\n") + 1
+            if not end:
+                if len(data) < RPT_READ_CHUNK:
+                    break  # a line still being written; it is read on the next run
+                end = len(data)  # a single line longer than a chunk is skipped
+            handle.seek(offset + end)
+            sightings, log_time = parse_sightings(data[:end], log_time)
+            offset += end
+            read += end
+
+            conn = get_db_connection()
+            try:
+                conn.begin()
+                with conn.cursor(pymysql.cursors.Cursor) as cursor:
+                    if sightings:
+                        _store_sightings(cursor, target, sightings)
+                    cursor.execute(
+                        """
+                        INSERT INTO rpt_checkpoints (service_id, file_name, byte_offset, head, log_time)
+                        VALUES (%s, %s, %s, %s, %s)
+                        ON DUPLICATE KEY UPDATE byte_offset = VALUES(byte_offset), head = VALUES(head),
+                            log_time = VALUES(log_time)
+                        """,
+                        (target["service_id"], file_name, offset, head, log_time)
+                    )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                release_db_connection(conn)
+            stored += len(sightings)
+    return stored, read, log_time
+
+
+def ingest_server(target, deadline=None):
+    """
+    Ingests everything new in one server's log directory, oldest file first, or
+    as much as can be read before the time.monotonic() deadline. Returns {"rows",
+    "bytes", "files", "log_time"}, log_time being the newest log time ingested
+    (or None).
+    """
+    directory = os.path.join(RPT_LOG_DIR, target["service_id"])
+    result = {"rows": 0, "bytes": 0, "files": 0, "log_time": None}
+    if not os.path.isdir(directory):
+        return result
+    paths = [
+        entry.path for entry in os.scandir(directory)
+        if entry.is_file() and entry.name.lower().endswith(".rpt")
+    ]
+    checkpoints = _fetch_checkpoints(target["service_id"])
+    for path in sorted(paths, key=os.path.getmtime):
+        if deadline is not None and time.monotonic() >= deadline:
+            logger.info("Ingestion for service %s reached its time limit; the rest is read next run",
+                        target["service_id"])
+            break
+        checkpoint = checkpoints.get(os.path.basename(path))
+        if checkpoint and os.path.getsize(path) == checkpoint["byte_offset"]:
+            continue
+        stored, read, log_time = _ingest_file(target, path, checkpoint, deadline)
+        if read:
+            result["files"] += 1
+            result["rows"] += stored
+            result["bytes"] += read
+            result["log_time"] = max(filter(None, [result["log_time"], log_time]))
+    if result["rows"]:
+        invalidate_cache("players")
+    logger.info("Ingested %d sightings (%d bytes, %d files) for service %s",
+                result["rows"], result["bytes"], result["files"], target["service_id"])
+    return result
+
+
+def ingest_all(service_id=None):
+    """Ingests every configured server in turn. Returns {service_id: ingest_server result}."""
+    return {target["service_id"]: ingest_server(target) for target in fetch_ingest_targets(service_id)}
@@ -0,0 +1,239 @@
+# ingest_scheduler.py
+"""
+Runs the .RPT ingestion (ingest.py) for every configured server on its own
+cycle, up to INGEST_WORKERS servers at a time. A run stops reading new chunks
+after INGEST_RUN_TIMEOUT seconds and continues from its checkpoint next time, so
+a slow server cannot keep a worker for long. A run that is still not back after
+twice that (e.g. a read hung on the log mount) is recorded as failed and stops
+counting against INGEST_WORKERS, so hung servers do not hold up the others; the
+hung server itself is not started again until its run returns. First runs are
+spread over the interval and every delay is jittered, so servers do not all fire
+on the same second; a server whose run fails backs off exponentially.
+
+Each run is recorded in ingest_status, shown on the Server Management page.
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from datetime import datetime, timedelta
+
+import streamlit as st
+
+from common import (
+    get_db_connection,
+    release_db_connection,
+    logger,
+)
+from ingest import fetch_ingest_targets, ingest_server
+
+# Seconds between the starts of a server's runs.
+INGEST_INTERVAL = float(st.secrets.get("INGEST_INTERVAL") or os.getenv("INGEST_INTERVAL") or 300)
+INGEST_WORKERS = int(st.secrets.get("INGEST_WORKERS") or os.getenv("INGEST_WORKERS") or 4)
+# Every delay is randomly stretched or shortened by up to this fraction.
+INGEST_JITTER = 0.1
+# Longest wait after repeated failures.
+INGEST_MAX_BACKOFF = float(st.secrets.get("INGEST_MAX_BACKOFF") or os.getenv("INGEST_MAX_BACKOFF") or 3600)
+# How often guild_configs is re-read for added or removed servers.
+INGEST_TARGETS_REFRESH = 60
+# Seconds after which a run stops reading; twice this and it is treated as hung.
+INGEST_RUN_TIMEOUT = float(
+    st.secrets.get("INGEST_RUN_TIMEOUT") or os.getenv("INGEST_RUN_TIMEOUT") or INGEST_INTERVAL
+)
+
+
+def record_ingest_status(target, run, failures, next_run_at):
+    """Stores the outcome of one run in ingest_status."""
+    result = run["result"] or {}
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO ingest_status (service_id, server_id, server_name, last_run_at, duration_seconds,
+                    rows_ingested, bytes_read, lag_seconds, last_success_at, failures, last_error, next_run_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s,
+                    (SELECT TIMESTAMPDIFF(SECOND, MAX(log_time), NOW()) FROM rpt_checkpoints WHERE service_id = %s),
+                    %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    server_id = VALUES(server_id),
+                    server_name = VALUES(server_name),
+                    last_run_at = VALUES(last_run_at),
+                    duration_seconds = VALUES(duration_seconds),
+                    rows_ingested = VALUES(rows_ingested),
+                    bytes_read = VALUES(bytes_read),
+                    lag_seconds = VALUES(lag_seconds),
+                    last_success_at = COALESCE(VALUES(last_success_at), last_success_at),
+                    failures = VALUES(failures),
+                    last_error = VALUES(last_error),
+                    next_run_at = VALUES(next_run_at)
+                """,
+                (
+                    target["service_id"], target["server_id"], target["server_name"], run["started_at"],
+                    run["duration"], result.get("rows", 0), result.get("bytes", 0), target["service_id"],
+                    None if run["error"] else run["started_at"], failures, run["error"], next_run_at,
+                )
+            )
+    finally:
+        release_db_connection(conn)
+
+
+def fetch_ingest_status(service_ids=None):
+    """ingest_status rows, optionally only for the given Nitrado service IDs."""
+    query = "SELECT * FROM ingest_status"
+    params = ()
+    if service_ids is not None:
+        service_ids = [str(service_id) for service_id in service_ids if service_id]
+        if not service_ids:
+            return []
+        query += f" WHERE service_id IN ({','.join(['%s'] * len(service_ids))})"
+        params = tuple(service_ids)
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(query + " ORDER BY server_name", params)
+            return cursor.fetchall()
+    finally:
+        release_db_connection(conn)
+
+
+def _ingest(target, started_at, started, timeout):
+    """One timed run for one server; errors are returned, not raised."""
+    result, error = None, None
+    try:
+        result = ingest_server(target, deadline=started + timeout)
+    except Exception as e:
+        logger.exception("Log ingestion failed for service %s", target["service_id"])
+        error = f"{type(e).__name__}: {e}"[:2000]
+    return {"started_at": started_at, "started": started, "duration": time.monotonic() - started,
+            "result": result, "error": error}
+
+
+class IngestScheduler:
+    """
+    Keeps every server on its own INGEST_INTERVAL cycle. Only the thread calling
+    run_forever (or run_once) touches the schedule; each run gets its own worker
+    thread, and at most `workers` runs that are not hung are in progress.
+    """
+
+    def __init__(self, workers=INGEST_WORKERS, interval=INGEST_INTERVAL, timeout=INGEST_RUN_TIMEOUT):
+        self.workers = workers
+        self.interval = interval
+        self.timeout = timeout
+        self._targets = {}    # service_id -> target
+        self._next_run = {}   # service_id -> time.monotonic() it is due
+        self._failures = {}   # service_id -> consecutive failed runs
+        self._running = {}    # service_id -> (Future, target, started_at, time.monotonic() at start)
+        self._hung = set()    # service_ids of running runs past twice the timeout
+        self._targets_at = None
+        self._stop = threading.Event()
+
+    def _delay(self, failures):
+        delay = self.interval if not failures else min(self.interval * 2 ** failures, INGEST_MAX_BACKOFF)
+        return delay * random.uniform(1 - INGEST_JITTER, 1 + INGEST_JITTER)
+
+    def _refresh_targets(self):
+        targets = {target["service_id"]: target for target in fetch_ingest_targets()}
+        now = time.monotonic()
+        for service_id in targets.keys() - self._targets.keys():
+            # Spread first runs over one interval.
+            self._next_run[service_id] = now + random.uniform(0, self.interval)
+        for service_id in self._targets.keys() - targets.keys():
+            self._next_run.pop(service_id, None)
+            self._failures.pop(service_id, None)
+        self._targets, self._targets_at = targets, now
+
+    def _finish(self, target, run):
+        service_id = target["service_id"]
+        failures = self._failures.get(service_id, 0) + 1 if run["error"] else 0
+        self._failures[service_id] = failures
+        # The next run is timed from this run's start, so a run's duration does not
+        # push back its cycle; a run longer than the interval is followed at once.
+        due = max(run["started"] + self._delay(failures), time.monotonic())
+        if service_id in self._targets:
+            self._next_run[service_id] = due
+        next_run_at = datetime.now() + timedelta(seconds=due - time.monotonic())
+        try:
+            record_ingest_status(target, run, failures, next_run_at)
+        except Exception:
+            logger.exception("Could not record ingest status for service %s", service_id)
+
+    def _collect(self):
+        """Records finished runs and runs that just became hung. Returns {service_id: run} for both."""
+        runs = {}
+        now = time.monotonic()
+        for service_id, (future, target, started_at, started) in list(self._running.items()):
+            if future.done():
+                del self._running[service_id]
+                self._hung.discard(service_id)
+                runs[service_id] = future.result()
+            elif service_id not in self._hung and now - started >= 2 * self.timeout:
+                # The thread cannot be stopped; it only stops counting as a worker.
+                self._hung.add(service_id)
+                logger.error("Log ingestion for service %s has not returned after %.0fs", service_id, now - started)
+                runs[service_id] = {"started_at": started_at, "started": started, "duration": now - started,
+                                    "result": None, "error": f"Still running after {now - started:.0f}s (hung?)"}
+            else:
+                continue
+            self._finish(target, runs[service_id])
+        return runs
+
+    def _active(self):
+        return [future for service_id, (future, *_) in self._running.items() if service_id not in self._hung]
+
+    def _submit(self, target):
+        future = Future()
+        started_at, started = datetime.now(), time.monotonic()
+        worker = threading.Thread(
+            target=lambda: future.set_result(_ingest(target, started_at, started, self.timeout)),
+            name=f"ingest-{target['service_id']}", daemon=True
+        )
+        self._running[target["service_id"]] = (future, target, started_at, started)
+        worker.start()
+
+    def run_pending(self):
+        """Records finished runs and starts due servers that are not still running, while workers are free."""
+        if self._targets_at is None or time.monotonic() - self._targets_at >= INGEST_TARGETS_REFRESH:
+            try:
+                self._refresh_targets()
+            except Exception:
+                logger.exception("Could not load ingest targets")
+        self._collect()
+        now = time.monotonic()
+        free = self.workers - len(self._active())
+        due = sorted((due, service_id) for service_id, due in self._next_run.items()
+                     if due <= now and service_id not in self._running)
+        for _, service_id in due[:max(free, 0)]:
+            self._submit(self._targets[service_id])
+
+    def run_forever(self, poll=1.0):
+        """Runs the schedule until stop() is called."""
+        try:
+            while not self._stop.is_set():
+                self.run_pending()
+                self._stop.wait(poll)
+        finally:
+            # Hung runs are not waited for.
+            while self._active():
+                wait(self._active(), timeout=poll)
+                self._collect()
+            self._collect()
+
+    def run_once(self, service_id=None, poll=1.0):
+        """
+        Ingests every server (or one) once, `workers` at a time, and waits for all of
+        them except hung runs, which are returned as failed.
+        """
+        self._targets = {target["service_id"]: target for target in fetch_ingest_targets(service_id)}
+        queue = list(self._targets.values())
+        runs = {}
+        while queue or self._active():
+            while queue and len(self._active()) < self.workers:
+                self._submit(queue.pop(0))
+            wait(self._active(), timeout=poll, return_when=FIRST_COMPLETED)
+            runs.update(self._collect())
+        return runs
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,183 @@
+# manage.py
+"""Maintenance commands for the ADB dashboard database. Run `python manage.py --help`."""
+import argparse
+import sys
+import time
+from alt_clusters import refresh_alt_clusters
+from session_overlap import refresh_session_overlaps, OVERLAP_REFRESH_INTERVAL
+from alt_scores import refresh_alt_scores, ALT_SCORE_REFRESH_INTERVAL
+from ingest import ingest_all
+from ingest_scheduler import IngestScheduler, INGEST_WORKERS
+from common import (
+    MONITOR_REFRESH_INTERVAL,
+    logger,
+    ensure_schema,
+    fetch_schema_migrations,
+    reconcile_server_stats,
+    refresh_trend_rollup,
+    resume_server_rename_jobs,
+    wait_for_server_renames,
+    fetch_server_rename_jobs
+)
+
+
+def cmd_reconcile_stats(args):
+    drift = reconcile_server_stats()
+    if not drift:
+        print("server_stats is in sync with players.")
+        return 0
+    for item in drift:
+        print(f"server {item['server_id'] or '<none>'}: {item['column']} stored={item['stored']} actual={item['actual']}")
+    print(f"Corrected {len(drift)} drifted counter(s).")
+    return 1 if args.check else 0
+
+
+def cmd_migrate(args):
+    # main() has already applied anything pending; this reports where the database stands.
+    for migration in fetch_schema_migrations():
+        print(f"{migration['version']}: {migration['description']} (applied {migration['applied_at']})")
+    # Builds the trend rollup if it was never built or a migration emptied it; pages do not.
+    rolled_up_to = refresh_trend_rollup()
+    print(f"player_history_daily covers history up to {rolled_up_to}.")
+    return 0
+
+
+def cmd_refresh_trends(args):
+    rolled_up_to = refresh_trend_rollup(full=args.full)
+    print(f"player_history_daily now covers history up to {rolled_up_to}.")
+    return 0
+
+
+def _watch(refresh, interval):
+    """Calls refresh() every interval seconds until interrupted; failed runs are logged and retried."""
+    print(f"Refreshing every {interval:g}s; press Ctrl+C to stop.")
+    try:
+        while True:
+            started = time.monotonic()
+            try:
+                refresh()
+            except Exception:
+                logger.exception("Refresh failed")
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        return 0
+
+
+def cmd_cluster_alts(args):
+    written = refresh_alt_clusters(full=True)
+    print(f"Rebuilt alt rings for {written} accounts.")
+    if args.watch:
+        # Later refreshes only read the rows written since the previous one.
+        return _watch(refresh_alt_clusters, args.interval)
+    return 0
+
+
+def cmd_detect_overlaps(args):
+    results = refresh_session_overlaps(days=args.days)
+    for day, rows in results.items():
+        print(f"{day}: {rows} account pair(s) with concurrent sessions")
+    if args.watch:
+        # Later refreshes redo today and any day that became complete since.
+        return _watch(refresh_session_overlaps, args.interval)
+    return 0
+
+
+def cmd_score_alts(args):
+    written = refresh_alt_scores(full=True)
+    print(f"Rescored {written} accounts.")
+    if args.watch:
+        return _watch(refresh_alt_scores, args.interval)
+    return 0
+
+
+def cmd_ingest_logs(args):
+    results = ingest_all(args.service)
+    if not results:
+        print("No servers with a Nitrado service ID configured.")
+    for service_id, result in results.items():
+        print(f"{service_id}: {result['rows']} sightings from {result['bytes']} bytes in {result['files']} file(s)")
+    return 0
+
+
+def cmd_schedule_ingest(args):
+    scheduler = IngestScheduler(workers=args.workers)
+    if args.once:
+        runs = scheduler.run_once()
+        for service_id, run in runs.items():
+            outcome = run["error"] or f"{run['result']['rows']} sightings"
+            print(f"{service_id}: {outcome} in {run['duration']:.1f}s")
+        return 1 if any(run["error"] for run in runs.values()) else 0
+    print(f"Ingesting logs with {args.workers} workers; press Ctrl+C to stop.")
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        scheduler.stop()
+    return 0
+
+
+def cmd_resume_renames(args):
+    started = resume_server_rename_jobs()
+    if not started:
+        print("No unfinished server renames.")
+        return 0
+    print(f"Resuming rename job(s) {', '.join(map(str, started))}...")
+    wait_for_server_renames()
+    failed = [job for job in fetch_server_rename_jobs() if job["id"] in started and job["status"] != "done"]
+    for job in failed:
+        print(f"Job {job['id']} ({job['old_name']} -> {job['new_name']}) is {job['status']}: {job['error'] or ''}")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ADB dashboard maintenance commands.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate = subparsers.add_parser("migrate", help="Apply pending schema migrations and list the applied ones.")
+    migrate.set_defaults(func=cmd_migrate)
+
+    reconcile = subparsers.add_parser("reconcile-stats", help="Rebuild server_stats from players and report drift.")
+    reconcile.add_argument("--check", action="store_true", help="Exit with status 1 if any drift was found.")
+    reconcile.set_defaults(func=cmd_reconcile_stats)
+
+    trends = subparsers.add_parser("refresh-trends", help="Roll complete days of player_history into player_history_daily.")
+    trends.add_argument("--full", action="store_true", help="Rebuild the rollup from all of player_history.")
+    trends.set_defaults(func=cmd_refresh_trends)
+
+    clusters = subparsers.add_parser("cluster-alts", help="Rebuild the alt_clusters table from all players and history.")
+    clusters.add_argument("--watch", action="store_true", help="Keep the rings up to date after the rebuild.")
+    clusters.add_argument("--interval", type=float, default=MONITOR_REFRESH_INTERVAL,
+                          help="Seconds between refreshes with --watch.")
+    clusters.set_defaults(func=cmd_cluster_alts)
+
+    overlaps = subparsers.add_parser("detect-overlaps", help="Find concurrent sessions of accounts sharing a device.")
+    overlaps.add_argument("--days", type=int, help="Reprocess the last N days instead of only the pending ones.")
+    overlaps.add_argument("--watch", action="store_true", help="Keep re-processing today after the first run.")
+    overlaps.add_argument("--interval", type=float, default=OVERLAP_REFRESH_INTERVAL,
+                          help="Seconds between refreshes with --watch.")
+    overlaps.set_defaults(func=cmd_detect_overlaps)
+
+    scores = subparsers.add_parser("score-alts", help="Recompute the alt likelihood score of every account.")
+    scores.add_argument("--watch", action="store_true", help="Keep rescoring touched accounts after the full run.")
+    scores.add_argument("--interval", type=float, default=ALT_SCORE_REFRESH_INTERVAL,
+                        help="Seconds between rescoring runs with --watch.")
+    scores.set_defaults(func=cmd_score_alts)
+
+    ingest_logs = subparsers.add_parser("ingest-logs", help="Read new .RPT log lines into players and player_history.")
+    ingest_logs.add_argument("--service", help="Only ingest the server with this Nitrado service ID.")
+    ingest_logs.set_defaults(func=cmd_ingest_logs)
+
+    schedule = subparsers.add_parser("schedule-ingest", help="Keep ingesting every server's logs on its own cycle.")
+    schedule.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Servers ingested at the same time.")
+    schedule.add_argument("--once", action="store_true", help="Ingest every server once, concurrently, and exit.")
+    schedule.set_defaults(func=cmd_schedule_ingest)
+
+    renames = subparsers.add_parser("resume-renames", help="Finish server renames interrupted by a restart or failure.")
+    renames.set_defaults(func=cmd_resume_renames)
+
+    args = parser.parse_args(argv)
+    ensure_schema()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
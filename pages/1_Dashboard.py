@@ -2,26 +2,14 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from common import fetch_stats, fetch_trend_data, fetch_servers, fetch_servers_for_user, get_user_record
+from common import fetch_stats, fetch_trend_data, fetch_trend_rolled_up_to, require_auth
 
 # --- Authorization Check ---
-user = st.session_state.get("user")
-if not user:
-    st.error("Please log in.")
-    st.stop()
-user_record = get_user_record(user["id"])
-if not user_record:
-    st.error("Your account is not authorized. Please contact an administrator.")
-    st.stop()
-user["access_level"] = user_record.get("access_level", "user")
-st.session_state["user"] = user
+user, auth = require_auth()
 # --- End Authorization Check ---
 
-access_level = user.get("access_level", "user")
-if access_level == "user":
-    server_options = ["All"] + fetch_servers_for_user(user["id"])
-else:
-    server_options = ["All"] + fetch_servers()
+# None stands for "All" servers; the rest are server_ids shown by name.
+server_options = [None] + list(auth["servers"])
 
 st.header("🏠 Dashboard")
 st.sidebar.subheader("Customize Dashboard")
@@ -43,7 +31,11 @@ selected_metrics = st.sidebar.multiselect(
     ]
 )
 
-selected_server = st.selectbox("Select Server (for all stats)", options=server_options)
+selected_server = st.selectbox(
+    "Select Server (for all stats)",
+    options=server_options,
+    format_func=lambda server_id: "All" if server_id is None else auth["servers"][server_id]
+)
 
 # Fetch and display stats.
 stats = fetch_stats(selected_server)
@@ -87,3 +79,5 @@ if not df_trend.empty:
     st.line_chart(df_trend)
 else:
     st.write("No trend data available")
+if fetch_trend_rolled_up_to() is None:
+    st.caption("Only today is shown until the trend rollup is built; run `python manage.py migrate`.")
@@ -2,55 +2,39 @@
 import streamlit as st
 import pandas as pd
 from common import (
-    get_db_connection,
-    release_db_connection,
-    fetch_servers,
-    fetch_servers_for_user,
+    db_connection,
     fetch_server_config,
     update_server_config,
-    get_user_record
+    fetch_server_rename_jobs,
+    resume_server_rename_jobs,
+    retry_server_rename,
+    require_auth
 )
+from ingest_scheduler import fetch_ingest_status
 
 # --- Authorization Check ---
-user = st.session_state.get("user")
-if not user:
-    st.error("Please log in.")
-    st.stop()
-user_record = get_user_record(user["id"])
-if not user_record:
-    st.error("Your account is not authorized. Please contact an administrator.")
-    st.stop()
-user["access_level"] = user_record.get("access_level", "user")
-st.session_state["user"] = user
+user, auth = require_auth()
 # --- End Authorization Check ---
 
 access_level = user.get("access_level", "user")
-# Determine server list based on role.
-if access_level == "user":
-    server_options = fetch_servers_for_user(user["id"])
-else:
-    server_options = fetch_servers()
+# Server list based on role (assigned servers for users, all servers otherwise).
+server_options = auth["servers"]
 
 st.header("🧑‍💻 Server Management")
 st.write("Below is a list of your server configurations:")
 
 # Display server configurations filtered by user permissions.
-conn = get_db_connection()
-try:
-    with conn.cursor() as cursor:
-        if access_level == "user":
-            if server_options:
-                placeholders = ','.join(['%s'] * len(server_options))
-                query = f"SELECT * FROM guild_configs WHERE server_name IN ({placeholders})"
-                cursor.execute(query, tuple(server_options))
-            else:
-                server_configs = []
-        else:
-            cursor.execute("SELECT * FROM guild_configs")
-        if 'server_configs' not in locals():
+server_configs = []
+with db_connection() as conn, conn.cursor() as cursor:
+    if access_level == "user":
+        if server_options:
+            placeholders = ','.join(['%s'] * len(server_options))
+            query = f"SELECT * FROM guild_configs WHERE id IN ({placeholders})"
+            cursor.execute(query, tuple(server_options))
             server_configs = cursor.fetchall()
-finally:
-    release_db_connection(conn)
+    else:
+        cursor.execute("SELECT * FROM guild_configs")
+        server_configs = cursor.fetchall()
 
 if server_configs:
     df_configs = pd.DataFrame(server_configs)
@@ -58,9 +42,24 @@ if server_configs:
 else:
     st.write("No server configurations found.")
 
+st.subheader("📥 Log Ingestion")
+ingest_status = fetch_ingest_status([config["nitrado_service_id"] for config in server_configs])
+if ingest_status:
+    df_ingest = pd.DataFrame(ingest_status)
+    st.dataframe(df_ingest[[
+        "server_name", "service_id", "last_run_at", "lag_seconds", "rows_ingested", "bytes_read",
+        "duration_seconds", "failures", "last_error", "last_success_at", "next_run_at"
+    ]])
+    if (df_ingest["failures"] > 0).any():
+        st.warning("Log ingestion is failing for some servers; they are retried with backoff.")
+else:
+    st.write("Log ingestion has not run for these servers yet.")
+
 st.subheader("⚙️ Edit Server Configuration")
 if server_options:
-    selected_server = st.selectbox("Select a server to edit", options=server_options)
+    selected_server = st.selectbox(
+        "Select a server to edit", options=list(server_options), format_func=server_options.get
+    )
     config = fetch_server_config(selected_server)
     if config:
         # Only allow editing if the user is a basic user managing this server or is a super-admin/bot owner.
@@ -95,3 +94,28 @@ if server_options:
         st.error("Could not fetch configuration for the selected server.")
 else:
     st.write("No servers found to edit.")
+
+st.subheader("🔁 Server Rename Jobs")
+# Pick up renames interrupted by a restart (no-op when nothing is unfinished).
+resume_server_rename_jobs()
+rename_jobs = fetch_server_rename_jobs()
+if rename_jobs:
+    df_jobs = pd.DataFrame(rename_jobs)
+    df_jobs["progress"] = df_jobs.apply(
+        lambda job: "100%" if job["status"] == "done" else (
+            f"{job['current_table']}: {min(100, int(100 * job['last_id'] / job['target_id']))}%"
+            if job["target_id"] else (job["current_table"] or "")
+        ),
+        axis=1
+    )
+    st.dataframe(df_jobs[["id", "old_name", "new_name", "status", "progress", "rows_updated", "heartbeat", "error"]])
+    failed_jobs = [job["id"] for job in rename_jobs if job["status"] == "failed"]
+    if failed_jobs:
+        retry_job = st.selectbox("Failed job to retry", options=failed_jobs)
+        if st.button("Retry Rename Job"):
+            retry_server_rename(retry_job)
+            st.rerun()
+    if st.button("Refresh Progress"):
+        st.rerun()
+else:
+    st.write("No server renames have been run.")
@@ -7,28 +7,19 @@ from common import (
     BOT_OWNER_ID,
     get_db_connection,
     release_db_connection,
-    fetch_user_access,
+    fetch_users_with_servers,
     add_user_access,
     remove_user_by_discord_id,
     update_user_access,
-    fetch_servers,                  
+    fetch_server_map,
     assign_servers_to_user,        
-    get_assigned_servers_for_user,
+    bulk_assign_servers,
     log_activity,
-    get_user_record
+    require_auth
 )
 
 # --- Authorization Check ---
-user = st.session_state.get("user")
-if not user:
-    st.error("Please log in.")
-    st.stop()
-user_record = get_user_record(user["id"])
-if not user_record:
-    st.error("Your account is not authorized. Please contact an administrator.")
-    st.stop()
-user["access_level"] = user_record.get("access_level", "user")
-st.session_state["user"] = user
+user, auth = require_auth()
 # --- End Authorization Check ---
 
 access_level = user.get("access_level", "user")
@@ -37,16 +28,16 @@ if access_level not in ["admin", "super-admin"] and user["id"] != BOT_OWNER_ID:
     st.stop()
 
 st.header("👤 User Management")
+
+# Every server by id; assignments are stored and edited by server_id.
+server_map = fetch_server_map()
+
+def server_names(server_ids):
+    return [server_map.get(server_id, str(server_id)) for server_id in server_ids]
+
 search_term = st.text_input("Search Users", "")
 
-df_users_full = fetch_user_access()
-if not df_users_full.empty and search_term:
-    df_users = df_users_full[
-        df_users_full["username"].str.contains(search_term, case=False) |
-        df_users_full["discord_id"].str.contains(search_term, case=False)
-    ]
-else:
-    df_users = df_users_full
+df_users = fetch_users_with_servers(search_term)
 
 if not df_users.empty:
     access_counts = df_users["access_level"].value_counts().to_dict()
@@ -75,11 +66,9 @@ else:
 
 st.subheader("Current Users")
 if not df_users.empty:
-    def get_assigned(d_id):
-        servers = get_assigned_servers_for_user(d_id)
-        return ", ".join(servers) if servers else "None"
-    df_users["Assigned Servers"] = df_users["discord_id"].apply(get_assigned)
-    st.dataframe(df_users)
+    df_display = df_users.drop(columns=["assigned_servers", "assigned_server_ids"])
+    df_display["Assigned Servers"] = df_users["assigned_servers"].map(lambda servers: ", ".join(servers) or "None")
+    st.dataframe(df_display)
 else:
     st.write("No user access records found.")
 
@@ -102,6 +91,34 @@ with st.form("add_user_form", clear_on_submit=True):
         else:
             st.error("Please provide both Discord ID and Username.")
 
+st.subheader("👥 Bulk Server Assignment")
+if not df_users.empty:
+    with st.form("bulk_assign_form", clear_on_submit=True):
+        user_labels = dict(zip(df_users["discord_id"], df_users["username"] + " (" + df_users["discord_id"] + ")"))
+        bulk_users = st.multiselect("Users", options=list(user_labels), format_func=lambda x: user_labels.get(x, x))
+        bulk_servers = st.multiselect("Servers", options=list(server_map), format_func=server_map.get)
+        bulk_mode = st.radio("Mode", options=["Add to current assignments", "Replace current assignments"], horizontal=True)
+        bulk_submitted = st.form_submit_button("Apply to Selected Users")
+        if bulk_submitted:
+            if bulk_users:
+                current = dict(zip(df_users["discord_id"], df_users["assigned_server_ids"]))
+                if bulk_mode.startswith("Add"):
+                    assignments = {d_id: sorted(set(current[d_id]) | set(bulk_servers)) for d_id in bulk_users}
+                else:
+                    assignments = {d_id: list(bulk_servers) for d_id in bulk_users}
+                bulk_assign_servers(assignments)
+                log_activity(
+                    user["id"],
+                    "Bulk Update Server Assignments",
+                    f"Updated server assignments for {len(assignments)} users",
+                    json.dumps({d_id: server_names(current[d_id]) for d_id in assignments}, default=str),
+                    json.dumps({d_id: server_names(ids) for d_id, ids in assignments.items()}, default=str)
+                )
+            else:
+                st.error("Please select at least one user.")
+else:
+    st.write("No user records to assign.")
+
 st.subheader("📋 Edit User")
 if not df_users.empty:
     user_options = df_users.apply(
@@ -112,8 +129,9 @@ if not df_users.empty:
         options=[opt[0] for opt in user_options],
         format_func=lambda x: next((opt[1] for opt in user_options if opt[0] == x), x)
     )
-    selected_user_record = df_users[df_users["discord_id"] == selected_account].iloc[0]
-    current_assigned_servers = get_assigned_servers_for_user(selected_account)
+    selected_row = df_users[df_users["discord_id"] == selected_account].iloc[0]
+    current_assigned_servers = selected_row["assigned_server_ids"]
+    selected_user_record = selected_row.drop(["assigned_servers", "assigned_server_ids"])
     
     hierarchy = {"user": 1, "moderator": 2, "admin": 3, "super-admin": 4}
     current_logged_in_level = hierarchy.get(user["access_level"], 1)
@@ -130,8 +148,9 @@ if not df_users.empty:
         )
         new_assigned_servers = st.multiselect(
             "Assigned Servers",
-            options=fetch_servers(),
-            default=current_assigned_servers
+            options=list(server_map),
+            default=[server_id for server_id in current_assigned_servers if server_id in server_map],
+            format_func=server_map.get
         )
         col1, col2, col3 = st.columns(3)
         update_button = col1.form_submit_button("Update User Info")
@@ -165,9 +184,9 @@ if not df_users.empty:
                 remove_user_by_discord_id(selected_account)
                 st.success("User removed successfully.")
             if update_servers_button:
-                before = {"assigned_servers": current_assigned_servers}
+                before = {"assigned_servers": server_names(current_assigned_servers)}
                 assign_servers_to_user(selected_account, new_assigned_servers)
-                after = {"assigned_servers": new_assigned_servers}
+                after = {"assigned_servers": server_names(new_assigned_servers)}
                 log_activity(
                     user["id"],
                     "Update Server Assignments",
@@ -203,9 +222,9 @@ if not df_users.empty:
                 remove_user_by_discord_id(selected_account)
                 st.success("User removed successfully.")
             if update_servers_button:
-                before = {"assigned_servers": current_assigned_servers}
+                before = {"assigned_servers": server_names(current_assigned_servers)}
                 assign_servers_to_user(selected_account, new_assigned_servers)
-                after = {"assigned_servers": new_assigned_servers}
+                after = {"assigned_servers": server_names(new_assigned_servers)}
                 log_activity(
                     user["id"],
                     "Update Server Assignments (Bot Owner)",
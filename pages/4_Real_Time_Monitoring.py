@@ -4,39 +4,43 @@ import pandas as pd
 import plotly.express as px
 from streamlit_autorefresh import st_autorefresh
 from common import (
-    fetch_stats,
-    fetch_trend_data,
-    fetch_alt_accounts,
-    fetch_main_account_by_device,
-    fetch_servers,
-    fetch_servers_for_user,
-    get_user_record
+    get_monitor_snapshot,
+    fetch_alt_device_groups,
+    count_alt_device_groups,
+    MONITOR_REFRESH_INTERVAL,
+    ALT_GROUPS_PAGE_SIZE,
+    fetch_main_accounts_by_devices,
+    fetch_alt_scores,
+    fetch_trend_rolled_up_to,
+    require_auth
 )
+from alt_clusters import fetch_alt_clusters_refreshed_at, fetch_largest_rings, fetch_rings_members
+from session_overlap import fetch_session_overlaps_rolled_up_to, count_concurrent_devices, fetch_concurrent_counts
 
 # --- Authorization Check ---
-user = st.session_state.get("user")
-if not user:
-    st.error("Please log in.")
-    st.stop()
-user_record = get_user_record(user["id"])
-if not user_record:
-    st.error("Your account is not authorized. Please contact an administrator.")
-    st.stop()
-user["access_level"] = user_record.get("access_level", "user")
-st.session_state["user"] = user
+user, auth = require_auth()
 # --- End Authorization Check ---
 
-access_level = user.get("access_level", "user")
-if access_level == "user":
-    server_options = ["All"] + fetch_servers_for_user(user["id"])
-else:
-    server_options = ["All"] + fetch_servers()
+# None stands for "All" servers; the rest are server_ids shown by name.
+server_options = [None] + list(auth["servers"])
 
 st.header("📊 Real-Time Monitoring & Alerts")
-st_autorefresh(interval=60000, key="real_time_monitor")
-selected_server = st.selectbox("Select Server", options=server_options)
+st_autorefresh(interval=int(MONITOR_REFRESH_INTERVAL * 1000), key="real_time_monitor")
+selected_server = st.selectbox(
+    "Select Server",
+    options=server_options,
+    format_func=lambda server_id: "All" if server_id is None else auth["servers"][server_id]
+)
+
+allowed_servers = list(auth["servers"])
 
-stats = fetch_stats(selected_server)
+# One snapshot per server is shared by every open session; it is refreshed at most
+# once per interval, and each refresh only fetches rows new or changed since the last.
+resync = st.button("🔄 Full resync")
+monitor = get_monitor_snapshot(selected_server, resync=resync)
+st.caption(f"Last synced {monitor['marks']['synced_at']:%H:%M:%S} ({monitor['last_changes']} new or changed rows).")
+
+stats = monitor["stats"]
 col1, col2, col3, col4, col5 = st.columns(5)
 col1.metric("👤 Total Players", stats["total_players"])
 col2.metric("🚩 Flagged Accounts", stats["flagged_accounts"])
@@ -47,44 +51,49 @@ col5.metric("💻 Multi Device Accounts", stats["multiple_devices"])
 if stats["flagged_accounts"] > 50:
     st.error("Alert: High number of flagged accounts!")
 
-df_trend = fetch_trend_data(selected_server)
+concurrent = count_concurrent_devices(allowed_servers if selected_server is None else [selected_server])
+st.metric(
+    "🎮 Concurrent on Same Device (today)",
+    concurrent["devices"],
+    help=f"Devices with two accounts online at the same time; {concurrent['overlaps']} concurrent sessions in total."
+)
+if fetch_session_overlaps_rolled_up_to() is None:
+    st.caption("Concurrent sessions have not been detected yet; run `python manage.py detect-overlaps --watch`.")
+
+df_trend = pd.DataFrame(sorted(monitor["trend"].items()), columns=["date", "count"])
 if not df_trend.empty:
     df_trend['date'] = pd.to_datetime(df_trend['date'])
     df_trend.set_index('date', inplace=True)
     st.line_chart(df_trend)
 else:
     st.write("No trend data available")
+if fetch_trend_rolled_up_to() is None:
+    st.caption("Only today is shown until the trend rollup is built; run `python manage.py migrate`.")
 
 st.subheader("Detected Alt Accounts (Grouped by Device)")
 
-# Fetch alt accounts based on the selected server.
-alt_accounts = fetch_alt_accounts(selected_server)
-# If the user selected "All", further restrict alt accounts to those from allowed servers.
-if selected_server == "All":
-    allowed_servers = fetch_servers_for_user(user["id"]) if access_level == "user" else fetch_servers()
-    alt_accounts = [acc for acc in alt_accounts if acc.get("server_name") in allowed_servers]
-
-if alt_accounts:
-    device_groups = {}
-    for account in alt_accounts:
-        device_id = account.get("device_id")
-        if device_id:
-            device_groups.setdefault(device_id, []).append(account)
-    
-    group_max_id = {}
-    for device_id, group in device_groups.items():
-        ids = [acc.get("id") for acc in group if acc.get("id") is not None]
-        group_max_id[device_id] = max(ids) if ids else 0
+score_cols = st.columns(2)
+min_group_score = score_cols[0].slider("Minimum Alt Score", 0, 100, 0)
+by_score = score_cols[1].radio("Sort groups by", ["Newest", "Highest alt score"], horizontal=True) == "Highest alt score"
+# Groups are counted, ordered and paged in SQL; the delta sync above drops the
+# cached pages whenever players change.
+total_groups = count_alt_device_groups(allowed_servers, selected_server, min_group_score)
 
-    sorted_device_ids = sorted(device_groups.keys(), key=lambda d: group_max_id[d], reverse=True)
-    items_per_page = 10
-    total_pages = (len(sorted_device_ids) + items_per_page - 1) // items_per_page
+if total_groups:
+    total_pages = (total_groups + ALT_GROUPS_PAGE_SIZE - 1) // ALT_GROUPS_PAGE_SIZE
     page = st.number_input("Page", min_value=1, max_value=total_pages, value=1, step=1)
-    start_index = (page - 1) * items_per_page
-    end_index = start_index + items_per_page
+    device_groups = fetch_alt_device_groups(
+        allowed_servers, selected_server, page=page, min_score=min_group_score, by_score=by_score
+    )
 
-    for device_id in sorted_device_ids[start_index:end_index]:
-        main_account = fetch_main_account_by_device(device_id)
+    page_device_ids = [device_id for device_id, _, _ in device_groups]
+    alt_scores = fetch_alt_scores([alt["gamertag_id"] for _, alts, _ in device_groups for alt in alts])
+    # Resolve the main accounts for the page in one query. The memo is this rerun's
+    # own: the monitor snapshot is shared by every session and must not be modified.
+    main_accounts = fetch_main_accounts_by_devices(page_device_ids, memo={})
+    concurrent_counts = fetch_concurrent_counts(page_device_ids)
+    for device_id, alt_accounts, group_score in device_groups:
+        main_account = main_accounts[device_id]
         if main_account:
             st.write("**👑 Main Account:**")
             st.write("- 📛 Gamertag: ", main_account.get('gamertag', 'N/A'))
@@ -95,15 +104,45 @@ if alt_accounts:
             st.write("- 🆔 Gamertag ID: ", main_account.get('gamertag_id', 'N/A'))
         else:
             st.write("**Main Account:** Not found for device_id", device_id)
+        if group_score is not None:
+            st.write(f"📈 Alt score: {group_score:.0f}")
+        if concurrent_counts.get(device_id):
+            st.write(f"⚠️ Concurrent sessions on this device in the last 7 days: {concurrent_counts[device_id]}")
         
         st.write("**🔗 Alt Accounts:**")
-        for alt in device_groups[device_id]:
+        for alt in alt_accounts:
             st.write("- 📛 Gamertag: ", alt.get('gamertag', 'N/A'))
             st.write("  - 🖥️ Server: ", alt.get('server_name', 'N/A'))
             st.write("  - 📅 First Seen: ", alt.get('first_seen', 'N/A'))
             st.write("  - 🕒 Last Seen: ", alt.get('last_seen', 'N/A'))
             st.write("  - 🆔 Device ID: ", device_id)
             st.write("  - 🆔 Gamertag ID: ", alt.get('gamertag_id', 'N/A'))
+            if alt.get('gamertag_id') in alt_scores:
+                st.write(f"  - 📈 Alt Score: {alt_scores[alt['gamertag_id']]:.0f}")
         st.write("---")
 else:
     st.write("No alt accounts detected.")
+
+st.subheader("🕸️ Largest Alt Rings")
+clusters_refreshed_at = fetch_alt_clusters_refreshed_at()
+st.caption(
+    "Accounts linked through any chain of shared devices, including devices used in the past."
+    + (f" Updated {clusters_refreshed_at:%Y-%m-%d %H:%M:%S}." if clusters_refreshed_at else "")
+)
+rings = fetch_largest_rings(allowed_servers, limit=10)
+if rings:
+    ring_members = fetch_rings_members([ring["cluster_id"] for ring in rings])
+    for ring in rings:
+        with st.expander(f"Ring #{ring['cluster_id']}: {ring['cluster_size']} accounts on {ring['device_count']} devices"):
+            members = ring_members[ring["cluster_id"]]
+            visible = [member for member in members if member["server_id"] in auth["servers"]]
+            for member in visible:
+                st.write(
+                    f"- 📛 {member.get('gamertag', 'N/A')} ({member.get('gamertag_id', 'N/A')}) — "
+                    f"🖥️ {member.get('server_name', 'N/A')} — 🆔 {member.get('device_id', 'N/A')}"
+                )
+            if len(members) > len(visible):
+                st.write(f"...and {len(members) - len(visible)} accounts on servers you cannot view.")
+else:
+    st.write("No alt rings detected." if clusters_refreshed_at else
+             "Alt rings have not been built yet; run `python manage.py cluster-alts --watch`.")
@@ -1,71 +1,73 @@
 # ActivityLogs.py
 import streamlit as st
 import pandas as pd
-import json
-from common import fetch_activity_logs, get_user_record
+from datetime import date, timedelta
+from common import (
+    ACTIVITY_LOGS_PAGE_SIZE,
+    fetch_activity_logs_page,
+    fetch_activity_log_actions,
+    apply_audit_diffs,
+    flush_activity_logs,
+    require_auth
+)
 
 # --- Authorization Check ---
-user = st.session_state.get("user")
-if not user:
-    st.error("Please log in.")
-    st.stop()
-user_record = get_user_record(user["id"])
-if not user_record:
-    st.error("Your account is not authorized. Please contact an administrator.")
-    st.stop()
-user["access_level"] = user_record.get("access_level", "user")
-st.session_state["user"] = user
+user, auth = require_auth()
 # --- End Authorization Check ---
 
 if user.get("access_level") not in ["moderator", "admin", "super-admin"]:
     st.error("Access Denied: You must be a moderator or higher to view activity logs.")
     st.stop()
 
-def diff_states(before_json, after_json):
-    keys_to_check = ["alt_flag", "watchlisted", "whitelist", "multiple_devices"]
-    
-    try:
-        before = json.loads(before_json)
-    except Exception:
-        before = {}
-    try:
-        after = json.loads(after_json)
-    except Exception:
-        after = {}
-    
-    if not isinstance(before, dict) or not isinstance(after, dict):
-        return "", ""
-    
-    diffs_before = []
-    diffs_after = []
-    for key in keys_to_check:
-        if before.get(key) != after.get(key):
-            b = before.get(key)
-            a = after.get(key)
-            b_str = "Yes" if b else "No"
-            a_str = "Yes" if a else "No"
-            diffs_before.append(f"{key.capitalize()} - {b_str}")
-            diffs_after.append(f"{key.capitalize()} - {a_str}")
-    return ", ".join(diffs_before), ", ".join(diffs_after)
-
 st.header("Activity Logs & Audit Trail")
 
-search_term = st.text_input("Search Logs", "")
-logs = fetch_activity_logs()
+filter_cols = st.columns(4)
+date_range = filter_cols[0].date_input("Date Range", value=(date.today() - timedelta(days=7), date.today()))
+user_filter = filter_cols[1].text_input("User ID", "").strip()
+action_filter = filter_cols[2].selectbox("Action", options=["All"] + fetch_activity_log_actions())
+search_term = filter_cols[3].text_input("Search Details", "")
+
+# The date input returns a single date while the user is still picking the range end.
+if isinstance(date_range, (tuple, list)):
+    start_date = date_range[0] if date_range else None
+    end_date = date_range[1] if len(date_range) > 1 else start_date
+else:
+    start_date = end_date = date_range
+filters = {
+    "start": start_date,
+    "end": end_date + timedelta(days=1) if end_date else None,
+    "user_id": user_filter or None,
+    "action": None if action_filter == "All" else action_filter,
+    "search_term": search_term,
+}
+
+# Keyset pagination on (timestamp, id); start over whenever the filters change.
+filter_key = tuple(filters.items())
+if st.session_state.get("activity_logs_filter_key") != filter_key:
+    st.session_state["activity_logs_filter_key"] = filter_key
+    st.session_state["activity_logs_page_cursors"] = [None]
+page_cursors = st.session_state["activity_logs_page_cursors"]
+
+# Make sure events queued by this process are visible before reading them back.
+flush_activity_logs()
+
+# One extra row tells us whether there is a next page.
+logs = fetch_activity_logs_page(**filters, before=page_cursors[-1], limit=ACTIVITY_LOGS_PAGE_SIZE + 1)
+has_next_page = len(logs) > ACTIVITY_LOGS_PAGE_SIZE
+logs = logs[:ACTIVITY_LOGS_PAGE_SIZE]
 df_logs = pd.DataFrame(logs)
 
 if not df_logs.empty:
-    if search_term:
-        df_logs = df_logs[
-            df_logs["user_id"].str.contains(search_term, case=False) |
-            df_logs["action"].str.contains(search_term, case=False) |
-            df_logs["details"].str.contains(search_term, case=False)
-        ]
-    for idx, row in df_logs.iterrows():
-        if row.get("action") == "Account Edit":
-            before, after = diff_states(row.get("before_state", ""), row.get("after_state", ""))
-            df_logs.at[idx, "before_state"] = before
-            df_logs.at[idx, "after_state"] = after
+    df_logs = apply_audit_diffs(df_logs)
+    st.write(f"Page {len(page_cursors)}")
     st.dataframe(df_logs)
 else:
     st.write("No activity logs found.")
+
+nav_prev, nav_next = st.columns(2)
+if nav_prev.button("⬅️ Newer", disabled=len(page_cursors) == 1):
+    page_cursors.pop()
+    st.rerun()
+if nav_next.button("Older ➡️", disabled=not has_next_page):
+    page_cursors.append((logs[-1]["timestamp"], logs[-1]["id"]))
+    st.rerun()
@@ -2,26 +2,23 @@
 import streamlit as st
 import pandas as pd
 import json
-from common import fetch_all_accounts, update_account_details, fetch_servers, fetch_servers_for_user, log_activity, get_user_record
+from common import (
+    ACCOUNTS_PAGE_SIZE,
+    SEARCH_LIMIT,
+    fetch_accounts_page,
+    fetch_accounts_by_score,
+    count_accounts,
+    search_accounts,
+    update_account_details,
+    log_activity,
+    require_auth
+)
 
 # --- Authorization Check ---
-user = st.session_state.get("user")
-if not user:
-    st.error("Please log in.")
-    st.stop()
-user_record = get_user_record(user["id"])
-if not user_record:
-    st.error("Your account is not authorized. Please contact an administrator.")
-    st.stop()
-user["access_level"] = user_record.get("access_level", "user")
-st.session_state["user"] = user
+user, auth = require_auth()
 # --- End Authorization Check ---
 
-access_level = user.get("access_level", "user")
-if access_level == "user":
-    allowed_servers = fetch_servers_for_user(user["id"])
-else:
-    allowed_servers = fetch_servers()
+allowed_servers = list(auth["servers"])
 
 st.header("📝 Logged Accounts")
 
@@ -45,31 +42,63 @@ filter_watchlisted = cols[1].checkbox("Watchlisted", value=False)
 filter_whitelisted = cols[2].checkbox("Whitelisted", value=False)
 filter_multiple = cols[3].checkbox("Multiple Device Accounts", value=False)
 
-accounts = fetch_all_accounts()
-df_accounts = pd.DataFrame(accounts)
+flags = [
+    flag for flag, enabled in [
+        ("alt_flag", filter_alt),
+        ("watchlisted", filter_watchlisted),
+        ("whitelist", filter_whitelisted),
+        ("multiple_devices", filter_multiple),
+    ] if enabled
+]
 
-if not df_accounts.empty:
-    df_accounts = df_accounts[df_accounts["server_name"].isin(allowed_servers)]
-    if search_term:
-        df_accounts = df_accounts[
-            df_accounts["gamertag"].str.contains(search_term, case=False, na=False) |
-            df_accounts["device_id"].str.contains(search_term, case=False, na=False)
-        ]
-    if filter_alt:
-        df_accounts = df_accounts[df_accounts["alt_flag"] == True]
-    if filter_watchlisted:
-        df_accounts = df_accounts[df_accounts["watchlisted"] == True]
-    if filter_whitelisted:
-        df_accounts = df_accounts[df_accounts["whitelist"] == True]
-    if filter_multiple:
-        df_accounts = df_accounts[df_accounts["multiple_devices"] == True]
-    
-    df_accounts = df_accounts.sort_values(by="id", ascending=True)
+score_cols = st.columns(2)
+min_score = score_cols[0].slider("Minimum Alt Score", 0, 100, 0, help="Likelihood (0-100) that an account is an alt.")
+sort_by_score = score_cols[1].radio("Sort by", ["Newest", "Highest alt score"], horizontal=True) == "Highest alt score"
 
-if not df_accounts.empty:
-    st.dataframe(df_accounts)
+if search_term:
+    # Searches go through the indexed, ranked search and show the best matches.
+    accounts = search_accounts(search_term, allowed_servers, flags, min_score=min_score)
+    df_accounts = pd.DataFrame(accounts)
+    if not df_accounts.empty:
+        if len(accounts) == SEARCH_LIMIT:
+            st.write(f"Showing the top {SEARCH_LIMIT} matches. Refine the search to narrow them down.")
+        st.dataframe(df_accounts)
+    else:
+        st.write("No logged accounts found for the selected filters.")
 else:
-    st.write("No logged accounts found for the selected filters.")
+    # Keyset pagination: remember the last id of every page visited so far, and
+    # start again from the first page whenever the filters change.
+    filter_key = (tuple(flags), tuple(allowed_servers), min_score, sort_by_score)
+    if st.session_state.get("accounts_filter_key") != filter_key:
+        st.session_state["accounts_filter_key"] = filter_key
+        st.session_state["accounts_page_cursors"] = [None]
+    page_cursors = st.session_state["accounts_page_cursors"]
+
+    # One extra row tells us whether there is a next page.
+    if sort_by_score:
+        accounts = fetch_accounts_by_score(allowed_servers, flags, min_score, after=page_cursors[-1], limit=ACCOUNTS_PAGE_SIZE + 1)
+    else:
+        accounts = fetch_accounts_page(allowed_servers, None, flags, after_id=page_cursors[-1], limit=ACCOUNTS_PAGE_SIZE + 1,
+                                       min_score=min_score, newest_first=True)
+    has_next_page = len(accounts) > ACCOUNTS_PAGE_SIZE
+    accounts = accounts[:ACCOUNTS_PAGE_SIZE]
+    total_accounts = count_accounts(allowed_servers, None, flags, min_score, scored_only=sort_by_score)
+    df_accounts = pd.DataFrame(accounts)
+
+    if not df_accounts.empty:
+        st.write(f"Page {len(page_cursors)} of {max(1, -(-total_accounts // ACCOUNTS_PAGE_SIZE))} ({total_accounts} matching accounts)")
+        st.dataframe(df_accounts)
+    else:
+        st.write("No logged accounts found for the selected filters.")
+
+    nav_prev, nav_next = st.columns(2)
+    if nav_prev.button("⬅️ Previous Page", disabled=len(page_cursors) == 1):
+        page_cursors.pop()
+        st.rerun()
+    if nav_next.button("Next Page ➡️", disabled=not has_next_page):
+        last = accounts[-1]
+        page_cursors.append((last["alt_score"], last["id"]) if sort_by_score else last["id"])
+        st.rerun()
 
 st.subheader("📋 Edit Account")
 if not df_accounts.empty:
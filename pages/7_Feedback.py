@@ -1,19 +1,10 @@
 # Feedback.py
 import streamlit as st
 import pandas as pd
-from common import add_user_feedback, fetch_feedback, get_user_record
+from common import add_user_feedback, fetch_feedback, require_auth
 
 # --- Authorization Check ---
-user = st.session_state.get("user")
-if not user:
-    st.error("Please log in.")
-    st.stop()
-user_record = get_user_record(user["id"])
-if not user_record:
-    st.error("Your account is not authorized. Please contact an administrator.")
-    st.stop()
-user["access_level"] = user_record.get("access_level", "user")
-st.session_state["user"] = user
+user, auth = require_auth()
 # --- End Authorization Check ---
 
 st.header("User Feedback & Support")
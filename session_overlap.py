@@ -0,0 +1,278 @@
+# session_overlap.py
+"""
+Concurrent-session detection: turns player_history sightings into per-account
+play sessions and finds sessions of different accounts on the same device that
+overlap in time. One device online as two gamertags at once points at a shared
+(family) console rather than an alt, or at ban evasion across servers.
+
+Days are processed whole and stored in session_overlaps, one row per day,
+device and account pair. The last complete day processed is kept in
+rollup_state, so each refresh only redoes today and any days it missed. The log
+ingestion moves that mark back when it writes sightings for a day already done.
+Refreshes run from `manage.py detect-overlaps --watch`; pages only read the table.
+"""
+import os
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pymysql
+import streamlit as st
+
+from common import (
+    get_db_connection,
+    release_db_connection,
+    invalidate_cache,
+    logger,
+)
+
+# Sightings of one account on one device further apart than this start a new session.
+SESSION_GAP = int(st.secrets.get("SESSION_GAP") or os.getenv("SESSION_GAP") or 900)
+# A session lasts this long past its last sighting (the log scan interval).
+SESSION_PAD = int(st.secrets.get("SESSION_PAD") or os.getenv("SESSION_PAD") or 300)
+# History read before a day's start so sessions already running at midnight are whole.
+SESSION_LOOKBACK = timedelta(hours=12)
+# Days processed by the first refresh.
+OVERLAP_INITIAL_DAYS = 7
+# Seconds between refreshes of `manage.py detect-overlaps --watch`.
+OVERLAP_REFRESH_INTERVAL = float(
+    st.secrets.get("OVERLAP_REFRESH_INTERVAL") or os.getenv("OVERLAP_REFRESH_INTERVAL") or 900
+)
+OVERLAP_ROLLUP = "session_overlaps"
+WRITE_BATCH_SIZE = 5000
+
+
+def build_sessions(device_codes, account_codes, timestamps):
+    """
+    Groups sightings into sessions. Inputs are equally long integer arrays
+    (timestamps in epoch seconds). Returns (order, starts_at, device, account,
+    start, end): order sorts the sightings, starts_at indexes each session's first
+    sighting in that order, and the rest describe each session.
+    """
+    order = np.lexsort((timestamps, account_codes, device_codes))
+    device, account, ts = device_codes[order], account_codes[order], timestamps[order]
+    new_session = np.ones(len(ts), dtype=bool)
+    new_session[1:] = (device[1:] != device[:-1]) | (account[1:] != account[:-1]) | (ts[1:] - ts[:-1] > SESSION_GAP)
+    starts_at = np.flatnonzero(new_session)
+    end = np.maximum.reduceat(ts, starts_at) + SESSION_PAD if len(ts) else ts
+    return order, starts_at, device[starts_at], account[starts_at], ts[starts_at], end
+
+
+def find_overlaps(device, account, start, end):
+    """
+    Sweep-line overlap join: returns index pairs (i, j) of sessions on the same
+    device, from different accounts, whose intervals overlap.
+    """
+    if not len(start):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+    # Sessions ordered by device, then start: a later session j overlaps i exactly
+    # when it starts before i ends, so i's partners are a contiguous run after it.
+    span = int(max(end.max(), start.max()) - start.min()) + 1
+    keys = (device.astype(np.int64) * span) + (start - start.min())
+    order = np.argsort(keys, kind="stable")
+    keys, device, account, start, end = keys[order], device[order], account[order], start[order], end[order]
+    stop = np.searchsorted(keys, device.astype(np.int64) * span + (end - start.min()), side="left")
+    counts = np.maximum(stop - np.arange(1, len(keys) + 1), 0)
+    i = np.repeat(np.arange(len(keys)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    j = i + 1 + offsets
+    different = account[i] != account[j]
+    return order[i[different]], order[j[different]]
+
+
+def detect_overlaps(history):
+    """
+    Finds concurrent sessions in a DataFrame of sightings (gamertag_id, device_id,
+    server_id, timestamp). Returns one row per overlapping pair of sessions:
+    device_id, gamertag_id_a < gamertag_id_b, their server_ids, overlap_start and
+    overlap_seconds.
+    """
+    columns = ["device_id", "gamertag_id_a", "gamertag_id_b", "server_id_a", "server_id_b",
+               "overlap_start", "overlap_seconds"]
+    history = history.dropna(subset=["gamertag_id", "device_id", "timestamp"])
+    history = history[(history["gamertag_id"] != "") & (history["device_id"] != "")]
+    if history.empty:
+        return pd.DataFrame(columns=columns)
+    device_codes, devices = pd.factorize(history["device_id"])
+    account_codes, accounts = pd.factorize(history["gamertag_id"])
+    timestamps = pd.to_datetime(history["timestamp"]).to_numpy("datetime64[s]").astype(np.int64)
+    servers = history["server_id"].fillna(0).to_numpy(np.int64)
+
+    order, starts_at, device, account, start, end = build_sessions(device_codes, account_codes, timestamps)
+    i, j = find_overlaps(device, account, start, end)
+    session_server = servers[order][starts_at]
+    names = np.asarray(accounts, dtype=object)
+    a, b = names[account[i]], names[account[j]]
+    swap = a > b
+    overlap_start = np.maximum(start[i], start[j])
+    return pd.DataFrame({
+        "device_id": np.asarray(devices, dtype=object)[device[i]],
+        "gamertag_id_a": np.where(swap, b, a),
+        "gamertag_id_b": np.where(swap, a, b),
+        "server_id_a": np.where(swap, session_server[j], session_server[i]),
+        "server_id_b": np.where(swap, session_server[i], session_server[j]),
+        "overlap_start": pd.to_datetime(overlap_start, unit="s"),
+        "overlap_seconds": np.minimum(end[i], end[j]) - overlap_start,
+    }, columns=columns)
+
+
+def _fetch_history(cursor, since, until):
+    cursor.execute(
+        """
+        SELECT gamertag_id, device_id, server_id, timestamp
+        FROM player_history
+        WHERE timestamp >= %s AND timestamp < %s
+        """,
+        (since, until)
+    )
+    return pd.DataFrame(cursor.fetchall(), columns=["gamertag_id", "device_id", "server_id", "timestamp"])
+
+
+def process_day(day):
+    """Recomputes session_overlaps for one day. Returns the number of rows stored."""
+    day_start = datetime.combine(day, datetime.min.time())
+    day_end = day_start + timedelta(days=1)
+    conn = get_db_connection()
+    try:
+        with conn.cursor(pymysql.cursors.Cursor) as cursor:
+            history = _fetch_history(cursor, day_start - SESSION_LOOKBACK, day_end)
+        overlaps = detect_overlaps(history)
+        overlaps = overlaps[(overlaps["overlap_start"] >= day_start) & (overlaps["overlap_start"] < day_end)]
+        summary = (
+            overlaps.groupby(["device_id", "gamertag_id_a", "gamertag_id_b"], sort=False)
+            .agg(server_id_a=("server_id_a", "max"), server_id_b=("server_id_b", "max"),
+                 overlaps=("overlap_seconds", "size"), overlap_seconds=("overlap_seconds", "sum"),
+                 last_overlap=("overlap_start", "max"))
+            .reset_index()
+        )
+        rows = [
+            (day, row.device_id, row.gamertag_id_a, row.gamertag_id_b, int(row.server_id_a), int(row.server_id_b),
+             int(row.overlaps), int(row.overlap_seconds), row.last_overlap.to_pydatetime())
+            for row in summary.itertuples(index=False)
+        ]
+        conn.begin()
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM session_overlaps WHERE day = %s", (day,))
+            for offset in range(0, len(rows), WRITE_BATCH_SIZE):
+                batch = rows[offset:offset + WRITE_BATCH_SIZE]
+                cursor.execute(
+                    """
+                    INSERT INTO session_overlaps (day, device_id, gamertag_id_a, gamertag_id_b, server_id_a,
+                        server_id_b, overlaps, overlap_seconds, last_overlap) VALUES
+                    """ + ",".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(batch)),
+                    tuple(value for row in batch for value in row)
+                )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_db_connection(conn)
+    return len(rows)
+
+
+def refresh_session_overlaps(days=None):
+    """
+    Processes every day after the last complete one (the last OVERLAP_INITIAL_DAYS
+    on the first run, or the last `days` days when given) through today.
+    Returns {day: rows stored}.
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT rolled_up_to FROM rollup_state WHERE name = %s", (OVERLAP_ROLLUP,))
+            state = cursor.fetchone()
+    finally:
+        release_db_connection(conn)
+    today = date.today()
+    if days is not None:
+        first = today - timedelta(days=days - 1)
+    elif state and state["rolled_up_to"]:
+        first = state["rolled_up_to"] + timedelta(days=1)
+    else:
+        first = today - timedelta(days=OVERLAP_INITIAL_DAYS - 1)
+
+    results = {}
+    day = first
+    while day <= today:
+        results[day] = process_day(day)
+        if day < today:
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        """
+                        INSERT INTO rollup_state (name, rolled_up_to) VALUES (%s, %s)
+                        ON DUPLICATE KEY UPDATE rolled_up_to = GREATEST(COALESCE(rolled_up_to, VALUES(rolled_up_to)), VALUES(rolled_up_to))
+                        """,
+                        (OVERLAP_ROLLUP, day)
+                    )
+            finally:
+                release_db_connection(conn)
+        day += timedelta(days=1)
+    invalidate_cache("players")
+    logger.info("Session overlaps refreshed for %d day(s)", len(results))
+    return results
+
+
+def fetch_session_overlaps_rolled_up_to():
+    """The last complete day in session_overlaps (None if overlaps were never detected)."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT rolled_up_to FROM rollup_state WHERE name = %s", (OVERLAP_ROLLUP,))
+            state = cursor.fetchone()
+            return state["rolled_up_to"] if state else None
+    finally:
+        release_db_connection(conn)
+
+
+def _server_filter(allowed_servers):
+    if allowed_servers is None:
+        return "", []
+    allowed_servers = list(allowed_servers) or [None]
+    placeholders = ",".join(["%s"] * len(allowed_servers))
+    return f" AND (server_id_a IN ({placeholders}) OR server_id_b IN ({placeholders}))", allowed_servers * 2
+
+
+def count_concurrent_devices(allowed_servers=None, days=1):
+    """Devices that had concurrent sessions of two accounts during the last `days` days (today included)."""
+    where, params = _server_filter(allowed_servers)
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT COUNT(DISTINCT device_id) AS devices, COALESCE(SUM(overlaps), 0) AS overlaps
+                FROM session_overlaps
+                WHERE day > CURDATE() - INTERVAL %s DAY{where}
+                """,
+                tuple([days] + params)
+            )
+            row = cursor.fetchone()
+    finally:
+        release_db_connection(conn)
+    return {"devices": int(row["devices"]), "overlaps": int(row["overlaps"])}
+
+
+def fetch_concurrent_counts(device_ids, days=7):
+    """{device_id: concurrent sessions during the last `days` days} for the given devices."""
+    device_ids = list(dict.fromkeys(device_ids))
+    if not device_ids:
+        return {}
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT device_id, SUM(overlaps) AS overlaps
+                FROM session_overlaps
+                WHERE day > CURDATE() - INTERVAL %s DAY AND device_id IN ({','.join(['%s'] * len(device_ids))})
+                GROUP BY device_id
+                """,
+                tuple([days] + device_ids)
+            )
+            return {row["device_id"]: int(row["overlaps"]) for row in cursor.fetchall()}
+    finally:
+        release_db_connection(conn)
@@ -7,7 +7,7 @@ from common import (
     exchange_code_for_token,
     fetch_user_info,
     init_db_pool,
-    get_user_record  # helper to get the user record and access level
+    get_auth_context  # cached user record, access level and server allowlist
 )
 
 st.set_page_config(layout="wide")
@@ -47,9 +47,9 @@ if not user:
     st.stop()
 
 # Retrieve the user's access level from the database.
-user_record = get_user_record(user["id"])
-if user_record:
-    user["access_level"] = user_record.get("access_level", "user")
+auth = get_auth_context(user["id"])
+if auth:
+    user["access_level"] = auth["access_level"]
 else:
     st.error("Your account is not authorized. Please contact an administrator.")
     st.stop()
@@ -66,7 +66,7 @@ if user["id"] not in allowed_ids:
     st.error("Access Denied: You are not authorized to view this dashboard.")
     st.stop()
 
-# Global initialization (e.g., connection pool).
+# Global initialization (e.g., connection pool). Only the first call per process does any work.
 init_db_pool()
 
 # Optionally add a logout button in the sidebar.
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import common  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, results, executed):
+        self.results, self.executed = results, executed
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=()):
+        self.executed.append((query, params))
+        self.rows = self.results.pop(0)
+
+    def fetchone(self):
+        return self.fetchall()[0] if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+
+class FakeConnection:
+    """Answers each execute() with the next of the given result sets and records the queries."""
+
+    def __init__(self, results):
+        self.results, self.executed = list(results), []
+
+    def cursor(self, *args):
+        return FakeCursor(self.results, self.executed)
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """fake_db(module, results) points module's database helpers at a FakeConnection."""
+    common._read_cache.clear()
+
+    def connect(module, results):
+        conn = FakeConnection(results)
+        monkeypatch.setattr(module, "get_db_connection", lambda: conn)
+        monkeypatch.setattr(module, "release_db_connection", lambda conn: None)
+        return conn
+
+    yield connect
+    common._read_cache.clear()
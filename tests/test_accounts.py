@@ -0,0 +1,25 @@
+import common
+from common import count_accounts, fetch_accounts_page
+
+
+def test_newest_first_pages_backwards(fake_db):
+    conn = fake_db(common, [[{"id": 9}, {"id": 8}]])
+    assert fetch_accounts_page([1], after_id=10, limit=2, newest_first=True) == [{"id": 9}, {"id": 8}]
+    query, params = conn.executed[0]
+    assert "players.id < %s" in query and query.endswith("ORDER BY players.id DESC LIMIT %s")
+    assert params == (1, 10, 2)
+
+
+def test_oldest_first_by_default(fake_db):
+    conn = fake_db(common, [[]])
+    fetch_accounts_page(None, after_id=10)
+    query, _ = conn.executed[0]
+    assert "players.id > %s" in query and "ORDER BY players.id ASC" in query
+
+
+def test_scored_only_count_joins_scores(fake_db):
+    conn = fake_db(common, [[{"total": 3}], [{"total": 5}]])
+    assert count_accounts([1], flags=("alt_flag",), scored_only=True) == 3
+    assert "JOIN alt_scores ON alt_scores.gamertag_id = players.gamertag_id" in conn.executed[0][0]
+    assert count_accounts([1], flags=("alt_flag",)) == 5
+    assert "alt_scores" not in conn.executed[1][0]
@@ -0,0 +1,61 @@
+import numpy as np
+
+import alt_clusters
+from alt_clusters import AltClusterEngine, fetch_rings_members, union_edges
+
+
+def _components(parent):
+    while not np.array_equal(parent[parent], parent):
+        parent = parent[parent]
+    return parent
+
+
+def test_union_edges_roots_at_lowest_node():
+    rng = np.random.default_rng(0)
+    a, b = rng.integers(0, 200, 150), rng.integers(0, 200, 150)
+    parent = np.arange(200)
+    union_edges(parent, a, b)
+    roots = _components(parent)
+
+    # Reference: merge edge by edge.
+    expected = list(range(200))
+    for x, y in zip(a.tolist(), b.tolist()):
+        old, new = sorted((expected[x], expected[y]))[::-1]
+        expected = [new if root == old else root for root in expected]
+    assert roots.tolist() == expected
+
+
+def test_union_edges_in_separate_calls():
+    parent = np.arange(6)
+    union_edges(parent, np.array([4]), np.array([5]))
+    union_edges(parent, np.array([5, 1]), np.array([2, 0]))
+    assert _components(parent).tolist() == [0, 0, 2, 3, 2, 2]
+
+
+def test_engine_assignments():
+    engine = AltClusterEngine()
+    engine.add_edges(["main", "alt", "other", None], ["d1", "d1", "d2", "d3"], [5, 3, 9, 1])
+    engine.add_edges(["alt", "history_only"], ["d4", "d5"])
+    rows = engine.assignments().set_index("gamertag_id")
+    assert rows.loc["main"].tolist() == rows.loc["alt"].tolist() == [3, 2, 2]
+    assert rows.loc["other"].tolist() == [9, 1, 1]
+    # Never seen in players.
+    assert rows.loc["history_only", "cluster_id"] == 0
+
+    touched = engine.add_edges(["other"], ["d4"], [9])
+    rows = engine.assignments(touched).set_index("gamertag_id")
+    assert sorted(rows.index) == ["alt", "main", "other"]
+    assert (rows["cluster_id"] == 3).all() and (rows["cluster_size"] == 3).all()
+    assert (rows["device_count"] == 3).all()
+
+
+def test_rings_members_in_one_query(fake_db):
+    conn = fake_db(alt_clusters, [[
+        {"id": 1, "cluster_id": 7}, {"id": 2, "cluster_id": 3}, {"id": 4, "cluster_id": 7},
+    ]])
+    members = fetch_rings_members([7, 3, 9])
+    assert {cluster_id: [row["id"] for row in rows] for cluster_id, rows in members.items()} == {
+        7: [1, 4], 3: [2], 9: [],
+    }
+    assert len(conn.executed) == 1
+    assert conn.executed[0][1] == (7, 3, 9)
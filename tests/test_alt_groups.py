@@ -0,0 +1,24 @@
+import common
+from common import fetch_alt_device_groups
+
+
+def test_page_of_groups(fake_db):
+    conn = fake_db(common, [
+        [{"device_id": "d2", "max_id": 9, "alt_score": 80.0}, {"device_id": "d1", "max_id": 5, "alt_score": None}],
+        [{"id": 3, "device_id": "d1"}, {"id": 4, "device_id": "d2"}, {"id": 5, "device_id": "d1"},
+         {"id": 9, "device_id": "d2"}],
+    ])
+    groups = fetch_alt_device_groups([1, 2], server_id=1)
+    assert [(device_id, [row["id"] for row in members], score) for device_id, members, score in groups] == [
+        ("d2", [4, 9], 80.0),
+        ("d1", [3, 5], None),
+    ]
+    members_query, members_params = conn.executed[1]
+    assert "device_id IN (%s,%s)" in members_query
+    assert members_params == (1, 2, 1, "d2", "d1")
+
+
+def test_empty_page(fake_db):
+    conn = fake_db(common, [[]])
+    assert fetch_alt_device_groups(None, page=3) == []
+    assert len(conn.executed) == 1
@@ -0,0 +1,44 @@
+import pandas as pd
+
+from alt_scores import ALT_SCORE_MAX_DEVICE_ACCOUNTS, SCORE_COLUMNS, compute_scores
+
+
+def _frames(edges, first_seen=(), servers=(), overlaps=()):
+    return (
+        pd.DataFrame(edges, columns=["gamertag_id", "device_id"]),
+        pd.DataFrame(first_seen, columns=["gamertag_id", "first_seen"]),
+        pd.DataFrame(servers, columns=["gamertag_id", "server_id"]),
+        pd.DataFrame(overlaps, columns=["gamertag_id", "concurrent_sessions"]),
+    )
+
+
+def test_signals():
+    scores = compute_scores(*_frames(
+        edges=[("main", "d1"), ("alt", "d1"), ("alt", "d1"), ("alt", "d2"), ("main", "d2"), ("solo", "d3")],
+        first_seen=[("main", "2024-05-01 00:00"), ("alt", "2024-05-01 06:00"), ("solo", "2024-01-01 00:00")],
+        servers=[("main", 1), ("alt", 2), ("alt", 3), ("solo", 1)],
+        overlaps=[("alt", 2), ("alt", 1)],
+    )).set_index("gamertag_id")
+    assert list(scores.reset_index().columns) == SCORE_COLUMNS
+    assert scores.loc["alt", "shared_devices"] == 2
+    assert scores.loc["alt", "first_seen_gap_hours"] == 6
+    # Its own servers and its peer's.
+    assert scores.loc["alt", "server_spread"] == 3
+    assert scores.loc["alt", "concurrent_sessions"] == 3
+    assert scores.loc["solo", "shared_devices"] == 0
+    assert pd.isna(scores.loc["solo", "first_seen_gap_hours"])
+    # Concurrent play points to two people, so it lowers the score.
+    assert scores.loc["main", "score"] > scores.loc["alt", "score"] > scores.loc["solo", "score"]
+
+
+def test_only_requested_accounts():
+    frames = _frames(edges=[("a", "d1"), ("b", "d1")])
+    scores = compute_scores(*frames, accounts=["b"])
+    assert scores["gamertag_id"].tolist() == ["b"]
+    assert scores["shared_devices"].tolist() == [1]
+
+
+def test_crowded_devices_are_ignored():
+    edges = [(f"account{i}", "kiosk") for i in range(ALT_SCORE_MAX_DEVICE_ACCOUNTS + 1)]
+    scores = compute_scores(*_frames(edges=edges))
+    assert (scores["shared_devices"] == 0).all()
@@ -0,0 +1,56 @@
+import json
+
+import pandas as pd
+import pytest
+
+import common
+from common import apply_audit_diffs, audit_state_diff
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    common._audit_diff_cache.clear()
+    yield
+    common._audit_diff_cache.clear()
+
+
+def _logs(rows):
+    return pd.DataFrame(rows, columns=["id", "action", "before_state", "after_state", "before_diff", "after_diff"])
+
+
+def test_stored_diffs_with_empty_cache():
+    df = apply_audit_diffs(_logs([
+        (1, "Account Edit", "{}", "{}", "Alt_flag - No", "Alt_flag - Yes"),
+        (2, "Search Logged Accounts", "{}", "{}", None, None),
+    ]))
+    assert df["before_state"].tolist() == ["Alt_flag - No", "{}"]
+    assert df["after_state"].tolist() == ["Alt_flag - Yes", "{}"]
+    assert "before_diff" not in df
+
+
+def test_legacy_rows_are_diffed_and_cached():
+    before = json.dumps({"alt_flag": False, "whitelist": True})
+    after = json.dumps({"alt_flag": True, "whitelist": True})
+    df = apply_audit_diffs(_logs([(7, "Account Edit", before, after, None, None)]))
+    assert df.loc[0, "before_state"] == "Alt_flag - No"
+    assert df.loc[0, "after_state"] == "Alt_flag - Yes"
+    assert common._audit_diff_cache[7] == ("Alt_flag - No", "Alt_flag - Yes")
+    # A rerun is served from the cache.
+    assert apply_audit_diffs(_logs([(7, "Account Edit", "bad", "bad", None, None)])).loc[0, "after_state"] == "Alt_flag - Yes"
+
+
+def test_cache_overflow_keeps_rows_of_the_page(monkeypatch):
+    monkeypatch.setattr(common, "_AUDIT_DIFF_CACHE_SIZE", 1)
+    common._audit_diff_cache[1] = ("cached before", "cached after")
+    df = apply_audit_diffs(_logs([
+        (1, "Account Edit", "{}", "{}", None, None),
+        (2, "Account Edit", json.dumps({"watchlisted": True}), json.dumps({"watchlisted": False}), None, None),
+    ]))
+    assert df["before_state"].tolist() == ["cached before", "Watchlisted - Yes"]
+
+
+def test_batch_matches_single_diff():
+    before = {"alt_flag": True, "multiple_devices": False}
+    after = {"alt_flag": False, "multiple_devices": True}
+    df = apply_audit_diffs(_logs([(3, "Account Edit", json.dumps(before), json.dumps(after), None, None)]))
+    assert tuple(df.loc[0, ["before_state", "after_state"]]) == audit_state_diff(before, after)
@@ -0,0 +1,54 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+from common import AUDIT_EVENT_COLUMNS, AuditLogWriter
+
+
+class RecordingWriter(AuditLogWriter):
+    def __init__(self, spool_dir, **kwargs):
+        self.written = []
+        super().__init__(spool_dir, **kwargs)
+
+    def _measure_clock_offset(self):
+        return timedelta(hours=2)
+
+    def _write(self, batch):
+        self.written.extend(event["event_id"] for event in batch)
+
+
+def _event(event_id):
+    return dict.fromkeys(AUDIT_EVENT_COLUMNS, None) | {"event_id": event_id, "action": "Test"}
+
+
+def test_replays_spool_of_dead_process_with_same_pid(tmp_path):
+    # Left behind by a crashed process that had this PID.
+    with open(tmp_path / f"audit-{os.getpid()}.jsonl", "w", encoding="utf-8") as spool:
+        spool.write(json.dumps(_event("lost")) + "\n")
+    writer = RecordingWriter(str(tmp_path), flush_interval=0.05)
+    try:
+        writer.submit(_event("new"))
+        assert writer.flush(timeout=5)
+    finally:
+        writer.close()
+    assert writer.written == ["lost", "new"]
+    assert not (tmp_path / f"audit-{os.getpid()}.jsonl").exists()
+
+
+def test_writers_keep_separate_spools(tmp_path):
+    first = RecordingWriter(str(tmp_path), flush_interval=0.05)
+    second = RecordingWriter(str(tmp_path), flush_interval=0.05)
+    try:
+        assert first._spool_path != second._spool_path
+    finally:
+        first.close()
+        second.close()
+
+
+def test_now_uses_database_clock(tmp_path):
+    writer = RecordingWriter(str(tmp_path))
+    try:
+        assert abs(writer.now() - (datetime.now() + timedelta(hours=2))) < timedelta(seconds=2)
+        assert writer.now().microsecond == 0
+    finally:
+        writer.close()
@@ -0,0 +1,96 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import common
+from common import discord_request, fetch_user_info
+
+
+class StubDiscord(ThreadingHTTPServer):
+    """Answers requests with the queued (status, headers, body, delay) responses and records their paths."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.responses, self.requests = [], []
+
+    @property
+    def base(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        status, headers, body, delay = self.server.responses.pop(0)
+        time.sleep(delay)
+        payload = json.dumps(body).encode()
+        try:
+            self.send_response(status)
+            for name, value in {"Content-Type": "application/json", **headers}.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except OSError:
+            pass  # The client timed out and hung up.
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def discord(monkeypatch):
+    server = StubDiscord()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    # The URLs derived from DISCORD_API_BASE, as if it pointed at the stub.
+    monkeypatch.setattr(common, "DISCORD_API_BASE", server.base)
+    monkeypatch.setattr(common, "DISCORD_API_URL", server.base + "/users/@me")
+    monkeypatch.setattr(common, "DISCORD_MAX_RETRIES", 2)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_rate_limit_waits_for_retry_after(discord):
+    discord.responses = [
+        (429, {"Retry-After": "0.3"}, {"message": "You are being rate limited.", "retry_after": 0.3}, 0),
+        (200, {}, {"id": "42", "username": "survivor"}, 0),
+    ]
+    started = time.monotonic()
+    assert fetch_user_info("token-rate-limited")["id"] == "42"
+    assert time.monotonic() - started >= 0.3
+    assert discord.requests == ["/api/users/@me", "/api/users/@me"]
+
+
+def test_server_errors_are_retried(discord, monkeypatch):
+    monkeypatch.setattr(common, "DISCORD_MAX_RETRY_WAIT", 0.05)
+    discord.responses = [(502, {}, {}, 0), (503, {}, {}, 0), (200, {}, {"ok": True}, 0)]
+    response = discord_request("GET", discord.base + "/users/@me")
+    assert response.status_code == 200
+    assert len(discord.requests) == 3
+
+
+def test_server_errors_stop_after_max_retries(discord, monkeypatch):
+    monkeypatch.setattr(common, "DISCORD_MAX_RETRY_WAIT", 0.05)
+    discord.responses = [(500, {}, {}, 0)] * 3
+    assert discord_request("GET", discord.base + "/users/@me").status_code == 500
+    assert len(discord.requests) == 3
+
+
+def test_request_timeout(discord, monkeypatch):
+    monkeypatch.setattr(common, "DISCORD_READ_TIMEOUT", 0.2)
+    monkeypatch.setattr(common, "DISCORD_MAX_RETRY_WAIT", 0.05)
+    discord.responses = [(200, {}, {}, 1)] * 3
+    started = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        discord_request("GET", discord.base + "/users/@me")
+    assert len(discord.requests) == 3
+    # Three attempts bounded by the read timeout, not by the slow responses.
+    assert time.monotonic() - started < 2.5
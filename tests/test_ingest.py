@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from ingest import parse_sightings
+
+
+def _line(time, gamertag, gamertag_id, device_id):
+    return f'{time} | Player "{gamertag}" (id={gamertag_id} pos=<1, 2, 3>) deviceId={device_id}\n'.encode()
+
+
+def test_parses_sightings():
+    data = _line("12:00:01", " Survivor ", "gid1", "dev1") + b"12:00:02 unrelated line\n" + _line("12:00:03", "Other", "gid2", "dev2")
+    sightings, log_time = parse_sightings(data, datetime(2024, 5, 1, 11, 59))
+    assert sightings == [
+        (datetime(2024, 5, 1, 12, 0, 1), "Survivor", "gid1", "dev1"),
+        (datetime(2024, 5, 1, 12, 0, 3), "Other", "gid2", "dev2"),
+    ]
+    assert log_time == datetime(2024, 5, 1, 12, 0, 3)
+
+
+def test_date_carries_over_midnight():
+    sightings, log_time = parse_sightings(_line("23:59:59", "A", "gid1", "dev1"), datetime(2024, 5, 1, 23, 0))
+    assert log_time == datetime(2024, 5, 1, 23, 59, 59)
+    # The next chunk continues after midnight.
+    sightings, log_time = parse_sightings(_line("0:00:05", "A", "gid1", "dev1"), log_time)
+    assert sightings[0][0] == datetime(2024, 5, 2, 0, 0, 5)
+
+
+def test_no_sightings_keeps_log_time():
+    log_time = datetime(2024, 5, 1, 8)
+    assert parse_sightings(b"08:00:00 nothing here\n", log_time) == ([], log_time)
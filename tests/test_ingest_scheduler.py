@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+
+import ingest_scheduler
+from ingest_scheduler import IngestScheduler
+
+
+@pytest.fixture
+def servers(monkeypatch):
+    release = threading.Event()
+    statuses = []
+
+    def ingest_server(target, deadline=None):
+        if target["service_id"] == "stuck":
+            release.wait()
+        return {"rows": 1, "bytes": 10, "files": 1, "log_time": None, "deadline": deadline}
+
+    targets = [{"service_id": service_id, "server_id": 1, "server_name": service_id} for service_id in ("stuck", "ok")]
+    monkeypatch.setattr(ingest_scheduler, "ingest_server", ingest_server)
+    monkeypatch.setattr(ingest_scheduler, "fetch_ingest_targets", lambda service_id=None: targets)
+    monkeypatch.setattr(ingest_scheduler, "record_ingest_status",
+                        lambda target, run, failures, next_run_at: statuses.append((target["service_id"], run["error"])))
+    yield statuses
+    release.set()
+
+
+def test_hung_run_frees_its_worker(servers):
+    scheduler = IngestScheduler(workers=1, timeout=0.1)
+    started = time.monotonic()
+    runs = scheduler.run_once(poll=0.02)
+    assert time.monotonic() - started < 2
+    assert "Still running" in runs["stuck"]["error"]
+    assert runs["ok"]["error"] is None and runs["ok"]["result"]["rows"] == 1
+    assert ("stuck", runs["stuck"]["error"]) in servers
+
+
+def test_runs_get_a_deadline(servers):
+    scheduler = IngestScheduler(workers=2, timeout=30)
+    scheduler._targets = {"ok": {"service_id": "ok", "server_id": 1, "server_name": "ok"}}
+    scheduler._submit(scheduler._targets["ok"])
+    future, _, _, started = scheduler._running["ok"]
+    assert future.result(timeout=2)["result"]["deadline"] == pytest.approx(started + 30)
+
+
+def test_hung_server_is_not_restarted(servers):
+    scheduler = IngestScheduler(workers=2, timeout=0.05, interval=0.01)
+    scheduler._refresh_targets()
+    deadline = time.monotonic() + 1
+    while time.monotonic() < deadline:
+        scheduler.run_pending()
+        time.sleep(0.01)
+    assert scheduler._hung == {"stuck"}
+    assert [service_id for service_id, _ in servers].count("stuck") == 1
+    assert [service_id for service_id, _ in servers].count("ok") > 5
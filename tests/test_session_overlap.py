@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from session_overlap import SESSION_GAP, SESSION_PAD, build_sessions, detect_overlaps, find_overlaps
+
+
+def _brute_force(device, account, start, end):
+    return {
+        (i, j) for i in range(len(start)) for j in range(len(start))
+        if i < j and device[i] == device[j] and account[i] != account[j]
+        and start[i] < end[j] and start[j] < end[i]
+    }
+
+
+def test_find_overlaps_matches_brute_force():
+    rng = np.random.default_rng(0)
+    device = rng.integers(0, 5, 300)
+    account = rng.integers(0, 8, 300)
+    start = rng.integers(0, 100000, 300)
+    end = start + rng.integers(1, 5000, 300)
+    i, j = find_overlaps(device, account, start, end)
+    assert {tuple(sorted(pair)) for pair in zip(i.tolist(), j.tolist())} == _brute_force(device, account, start, end)
+
+
+def test_find_overlaps_empty():
+    empty = np.zeros(0, dtype=np.int64)
+    i, j = find_overlaps(empty, empty, empty, empty)
+    assert len(i) == len(j) == 0
+
+
+def test_build_sessions_splits_on_gaps():
+    timestamps = np.array([0, 60, 60 + SESSION_GAP + 1, 30])
+    device = np.zeros(4, dtype=np.int64)
+    account = np.array([0, 0, 0, 1])
+    _, _, session_device, session_account, start, end = build_sessions(device, account, timestamps)
+    assert session_account.tolist() == [0, 0, 1]
+    assert start.tolist() == [0, 60 + SESSION_GAP + 1, 30]
+    assert end.tolist() == [60 + SESSION_PAD, 60 + SESSION_GAP + 1 + SESSION_PAD, 30 + SESSION_PAD]
+    assert session_device.tolist() == [0, 0, 0]
+
+
+def test_detect_overlaps_orders_accounts():
+    at = datetime(2024, 5, 1, 12)
+    history = pd.DataFrame({
+        "gamertag_id": ["b", "a", "c", ""],
+        "device_id": ["d1", "d1", "d2", "d1"],
+        "server_id": [2, 1, 1, 1],
+        "timestamp": [at, at + timedelta(minutes=1), at, at],
+    })
+    overlaps = detect_overlaps(history)
+    assert len(overlaps) == 1
+    row = overlaps.iloc[0]
+    assert (row["device_id"], row["gamertag_id_a"], row["gamertag_id_b"]) == ("d1", "a", "b")
+    assert (row["server_id_a"], row["server_id_b"]) == (1, 2)
+    assert row["overlap_start"] == at + timedelta(minutes=1)
+    assert row["overlap_seconds"] == SESSION_PAD - 60
+
+
+def test_detect_overlaps_without_sightings():
+    history = pd.DataFrame(columns=["gamertag_id", "device_id", "server_id", "timestamp"])
+    assert detect_overlaps(history).empty